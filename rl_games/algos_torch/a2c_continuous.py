@@ -48,12 +48,19 @@ class A2CAgent(a2c_common.ContinuousA2CBase):
                 'writter' : self.writer,
                 'max_epochs' : self.max_epochs,
                 'multi_gpu' : self.multi_gpu,
-                'zero_rnn_on_done' : self.zero_rnn_on_done
+                'zero_rnn_on_done' : self.zero_rnn_on_done,
+                'profiler' : self.profiler
             }
             self.central_value_net = central_value.CentralValueTrain(**cv_config).to(self.ppo_device)
 
         self.use_experimental_cv = self.config.get('use_experimental_cv', True)
-        self.dataset = datasets.PPODataset(self.batch_size, self.minibatch_size, self.is_discrete, self.is_rnn, self.ppo_device, self.seq_len)
+        self.dataset = datasets.PPODataset(self.batch_size, self.minibatch_size, self.is_discrete, self.is_rnn, self.ppo_device, self.seq_len, self.shuffle_minibatches)
+        if self.prefetch_minibatches:
+            self.minibatches = datasets.MinibatchPrefetcher(self.dataset, self._preproc_obs, self.ppo_device)
+        else:
+            self.minibatches = datasets.MinibatchIterator(self.dataset)
+        if self.fused_central_value:
+            self.central_value_net.share_sampler(self.dataset.sampler, self.mini_epochs_num)
         if self.normalize_value:
             self.value_mean_std = self.central_value_net.model.value_mean_std if self.has_central_value else self.model.value_mean_std
 
@@ -75,18 +82,13 @@ class A2CAgent(a2c_common.ContinuousA2CBase):
     def get_masked_action_values(self, obs, action_masks):
         assert False
 
-    def calc_gradients(self, input_dict):
+    def calc_losses(self, input_dict):
         value_preds_batch = input_dict['old_values']
         old_action_log_probs_batch = input_dict['old_logp_actions']
         advantage = input_dict['advantages']
-        old_mu_batch = input_dict['mu']
-        old_sigma_batch = input_dict['sigma']
         return_batch = input_dict['returns']
         actions_batch = input_dict['actions']
-        obs_batch = input_dict['obs']
-        obs_batch = self._preproc_obs(obs_batch)
-
-        lr_mul = 1.0
+        obs_batch = input_dict['processed_obs']
         curr_e_clip = self.e_clip
 
         batch_dict = {
@@ -95,7 +97,8 @@ class A2CAgent(a2c_common.ContinuousA2CBase):
             'obs' : obs_batch,
         }
 
-        rnn_masks = None
+        # rnn masks, or step masks of the transitions of stragglers
+        rnn_masks = input_dict.get('rnn_masks', None)
         if self.is_rnn:
             rnn_masks = input_dict['rnn_masks']
             batch_dict['rnn_states'] = input_dict['rnn_states']
@@ -104,7 +107,7 @@ class A2CAgent(a2c_common.ContinuousA2CBase):
             if self.zero_rnn_on_done:
                 batch_dict['dones'] = input_dict['dones']            
 
-        with torch.cuda.amp.autocast(enabled=self.mixed_precision):
+        with torch.cuda.amp.autocast(enabled=self.mixed_precision), self.profiler.scope('forward'):
             res_dict = self.model(batch_dict)
             action_log_probs = res_dict['prev_neglogp']
             values = res_dict['values']
@@ -128,14 +131,33 @@ class A2CAgent(a2c_common.ContinuousA2CBase):
             a_loss, c_loss, entropy, b_loss = losses[0], losses[1], losses[2], losses[3]
 
             loss = a_loss + 0.5 * c_loss * self.critic_coef - entropy * self.entropy_coef + b_loss * self.bounds_loss_coef
-            
-            if self.multi_gpu:
-                self.optimizer.zero_grad()
-            else:
-                for param in self.model.parameters():
-                    param.grad = None
 
-        self.scaler.scale(loss).backward()
+        return loss, {'a_loss' : a_loss, 'c_loss' : c_loss, 'entropy' : entropy, 'b_loss' : b_loss,
+                      'action_log_probs' : action_log_probs, 'mu' : mu, 'sigma' : sigma}
+
+    def calc_gradients(self, input_dict):
+        value_preds_batch = input_dict['old_values']
+        old_action_log_probs_batch = input_dict['old_logp_actions']
+        old_mu_batch = input_dict['mu']
+        old_sigma_batch = input_dict['sigma']
+        return_batch = input_dict['returns']
+        rnn_masks = input_dict.get('rnn_masks', None)
+        # obs of prefetched minibatches are preprocessed already
+        if 'processed_obs' not in input_dict:
+            input_dict = dict(input_dict, processed_obs=self._preproc_obs(input_dict['obs']))
+
+        lr_mul = 1.0
+        curr_e_clip = self.e_clip
+
+        if self.multi_gpu:
+            self.optimizer.zero_grad()
+        else:
+            for param in self.model.parameters():
+                param.grad = None
+
+        outputs = self.accumulate_gradients(input_dict)
+        a_loss, c_loss, entropy, b_loss = outputs['a_loss'], outputs['c_loss'], outputs['entropy'], outputs['b_loss']
+        action_log_probs, mu, sigma = outputs['action_log_probs'], outputs['mu'], outputs['sigma']
         #TODO: Refactor this ugliest code of they year
         self.trancate_gradients_and_step()
 
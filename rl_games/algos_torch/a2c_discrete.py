@@ -50,12 +50,19 @@ class DiscreteA2CAgent(a2c_common.DiscreteA2CBase):
                 'writter' : self.writer,
                 'max_epochs' : self.max_epochs,
                 'multi_gpu' : self.multi_gpu,
-                'zero_rnn_on_done' : self.zero_rnn_on_done
+                'zero_rnn_on_done' : self.zero_rnn_on_done,
+                'profiler' : self.profiler
             }
             self.central_value_net = central_value.CentralValueTrain(**cv_config).to(self.ppo_device)
 
         self.use_experimental_cv = self.config.get('use_experimental_cv', False)        
-        self.dataset = datasets.PPODataset(self.batch_size, self.minibatch_size, self.is_discrete, self.is_rnn, self.ppo_device, self.seq_len)
+        self.dataset = datasets.PPODataset(self.batch_size, self.minibatch_size, self.is_discrete, self.is_rnn, self.ppo_device, self.seq_len, self.shuffle_minibatches)
+        if self.prefetch_minibatches:
+            self.minibatches = datasets.MinibatchPrefetcher(self.dataset, self._preproc_obs, self.ppo_device)
+        else:
+            self.minibatches = datasets.MinibatchIterator(self.dataset)
+        if self.fused_central_value:
+            self.central_value_net.share_sampler(self.dataset.sampler, self.mini_epochs_num)
 
         if self.normalize_value:
             self.value_mean_std = self.central_value_net.model.value_mean_std if self.has_central_value else self.model.value_mean_std
@@ -109,16 +116,14 @@ class DiscreteA2CAgent(a2c_common.DiscreteA2CBase):
 
         return self.train_result
 
-    def calc_gradients(self, input_dict):
+    def calc_losses(self, input_dict):
         value_preds_batch = input_dict['old_values']
         old_action_log_probs_batch = input_dict['old_logp_actions']
         advantage = input_dict['advantages']
         return_batch = input_dict['returns']
         actions_batch = input_dict['actions']
-        obs_batch = input_dict['obs']
-        obs_batch = self._preproc_obs(obs_batch)
-        lr_mul = 1.0
-        curr_e_clip = lr_mul * self.e_clip
+        obs_batch = input_dict['processed_obs']
+        curr_e_clip = self.e_clip
 
         batch_dict = {
             'is_train': True,
@@ -127,7 +132,8 @@ class DiscreteA2CAgent(a2c_common.DiscreteA2CBase):
         }
         if self.use_action_masks:
             batch_dict['action_masks'] = input_dict['action_masks']
-        rnn_masks = None
+        # rnn masks, or step masks of the transitions of stragglers
+        rnn_masks = input_dict.get('rnn_masks', None)
         if self.is_rnn:
             rnn_masks = input_dict['rnn_masks']
             batch_dict['rnn_states'] = input_dict['rnn_states']
@@ -136,7 +142,7 @@ class DiscreteA2CAgent(a2c_common.DiscreteA2CBase):
             if self.zero_rnn_on_done:
                 batch_dict['dones'] = input_dict['dones']
 
-        with torch.cuda.amp.autocast(enabled=self.mixed_precision):
+        with torch.cuda.amp.autocast(enabled=self.mixed_precision), self.profiler.scope('forward'):
             res_dict = self.model(batch_dict)
             action_log_probs = res_dict['prev_neglogp']
             values = res_dict['values']
@@ -153,13 +159,27 @@ class DiscreteA2CAgent(a2c_common.DiscreteA2CBase):
             a_loss, c_loss, entropy = losses[0], losses[1], losses[2]
             loss = a_loss + 0.5 *c_loss * self.critic_coef - entropy * self.entropy_coef
 
-            if self.multi_gpu:
-                self.optimizer.zero_grad()
-            else:
-                for param in self.model.parameters():
-                    param.grad = None
+        return loss, {'a_loss' : a_loss, 'c_loss' : c_loss, 'entropy' : entropy, 'action_log_probs' : action_log_probs}
+
+    def calc_gradients(self, input_dict):
+        value_preds_batch = input_dict['old_values']
+        old_action_log_probs_batch = input_dict['old_logp_actions']
+        return_batch = input_dict['returns']
+        rnn_masks = input_dict.get('rnn_masks', None)
+        # obs of prefetched minibatches are preprocessed already
+        if 'processed_obs' not in input_dict:
+            input_dict = dict(input_dict, processed_obs=self._preproc_obs(input_dict['obs']))
+        lr_mul = 1.0
+        curr_e_clip = lr_mul * self.e_clip
+
+        if self.multi_gpu:
+            self.optimizer.zero_grad()
+        else:
+            for param in self.model.parameters():
+                param.grad = None
 
-        self.scaler.scale(loss).backward()
+        outputs = self.accumulate_gradients(input_dict)
+        a_loss, c_loss, entropy, action_log_probs = outputs['a_loss'], outputs['c_loss'], outputs['entropy'], outputs['action_log_probs']
         self.trancate_gradients_and_step()
 
         with torch.no_grad():
@@ -0,0 +1,239 @@
+import copy
+import queue
+import threading
+import time
+
+import numpy as np
+import torch
+
+from rl_games.algos_torch import a2c_continuous
+from rl_games.algos_torch import a2c_discrete
+from rl_games.common import a2c_common
+from rl_games.common import advantages
+
+
+class AsyncActorLearner:
+    '''
+    Asynchronous actor-learner schedule for PPO agents (APPO).
+    A rollout thread keeps stepping vec_env with a copy of the policy and puts finished rollouts into a bounded queue.
+    The learner takes them from the queue in play_steps, recomputes values and action log probs with the current policy
+    and replaces GAE with V-trace targets and advantages, which correct for the policy lag.
+    Weights are sent to the rollout thread after every epoch. Rollouts started before are 'policy_lag' epochs behind.
+    The rollout thread only collects transitions, episode stats are sent with the rollout and written by the learner,
+    so the meters and the algo observer are used by one thread.
+    '''
+    def init_async(self):
+        assert not self.is_rnn, 'appo does not support rnn'
+        assert not self.has_central_value, 'appo does not support central value'
+        assert not self.use_action_masks, 'appo does not support action masks'
+        assert not self.multi_gpu, 'appo does not support multi gpu'
+        assert not self.pipelined_rollout, 'appo can not be used with pipelined_rollout'
+        # batches are consumed while the next rollout is written, so they can't be views of the experience buffer
+        assert not self.actor_major_buffers, 'appo can not be used with actor_major_buffers'
+        assert self.num_actors * self.num_agents > 1 and self.horizon_length > 1, 'appo needs more than one actor and horizon_length > 1'
+
+        self.rollout_queue_size = self.config.get('appo_queue_size', 2)
+        self.vtrace_clip_rho = self.config.get('vtrace_clip_rho', 1.0)
+        self.vtrace_clip_c = self.config.get('vtrace_clip_c', 1.0)
+        self.vtrace_clip_pg_rho = self.config.get('vtrace_clip_pg_rho', 1.0)
+
+        self.rollout_queue = queue.Queue(maxsize=self.rollout_queue_size)
+        self.actor_model = None
+        self.actor_thread = None
+        self.stop_event = threading.Event()
+        self.weights_lock = threading.Lock()
+        self.published_weights = None
+        self.policy_version = 0
+        self.actor_version = 0
+        # update_game_stats arguments of the rollout in progress, owned by the rollout thread
+        self.pending_game_stats = []
+
+    def start_actor(self):
+        self.actor_model = copy.deepcopy(self.model)
+        self.actor_model.eval()
+        self.actor_version = self.policy_version
+        self.actor_thread = threading.Thread(target=self._actor_loop, daemon=True)
+        self.actor_thread.start()
+
+    def stop_actor(self):
+        if self.actor_thread is None:
+            return
+        self.stop_event.set()
+        # unblock the rollout thread if it waits for a free slot
+        while self.actor_thread.is_alive():
+            try:
+                self.rollout_queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.actor_thread.join(timeout=0.1)
+        self.actor_thread = None
+
+    def publish_weights(self):
+        weights = {k : v.detach().clone() for k, v in self.model.state_dict().items()}
+        with self.weights_lock:
+            self.published_weights = weights
+            self.policy_version += 1
+
+    def _sync_actor_weights(self):
+        with self.weights_lock:
+            if self.published_weights is None or self.actor_version == self.policy_version:
+                return
+            self.actor_model.load_state_dict(self.published_weights)
+            self.actor_version = self.policy_version
+
+    def _put(self, item):
+        while not self.stop_event.is_set():
+            try:
+                self.rollout_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _actor_loop(self):
+        try:
+            while not self.stop_event.is_set():
+                self._sync_actor_weights()
+                version = self.actor_version
+                self.pending_game_stats = []
+                with torch.no_grad():
+                    step_time = self.collect_rollout()
+                batch_dict = self.experience_buffer.get_transformed_list(a2c_common.swap_and_flatten01, self.tensor_list)
+                if self.use_step_masks:
+                    batch_dict['rnn_masks'] = a2c_common.swap_and_flatten01(self.experience_buffer.tensor_dict['step_masks'])
+                batch_dict['played_frames'] = self.batch_size
+                batch_dict['step_time'] = step_time
+                batch_dict['game_stats'] = self.pending_game_stats
+                batch_dict['last_obs'] = self._clone_tensors(self.obs['obs'])
+                batch_dict['last_dones'] = self.dones.clone()
+                batch_dict['policy_version'] = version
+                self._put(batch_dict)
+        except Exception as exc:
+            self._put(exc)
+
+    def update_game_stats(self, dones, infos, current_rewards, current_shaped_rewards, current_lengths):
+        # called by the rollout thread, the learner replays the stats when it takes the rollout
+        self.pending_game_stats.append((dones.clone(), self._copy_infos(infos), current_rewards.clone(), current_shaped_rewards.clone(), current_lengths.clone()))
+
+    def _copy_infos(self, infos):
+        # vec envs reuse the arrays of concatenated infos (RayVecEnv, envpool), they are overwritten before the learner reads them
+        if isinstance(infos, dict):
+            return {k : self._copy_infos(v) for k, v in infos.items()}
+        if isinstance(infos, (list, tuple)):
+            return type(infos)(self._copy_infos(v) for v in infos)
+        if isinstance(infos, np.ndarray):
+            return infos.copy()
+        if isinstance(infos, torch.Tensor):
+            return infos.clone()
+        return infos
+
+    def _clone_tensors(self, value):
+        if isinstance(value, dict):
+            return {k : self._clone_tensors(v) for k, v in value.items()}
+        return value.clone()
+
+    def get_action_values(self, obs):
+        processed_obs = self._preproc_obs(obs['obs'])
+        input_dict = {
+            'is_train': False,
+            'prev_actions': None,
+            'obs' : processed_obs,
+            'rnn_states' : None
+        }
+        with torch.no_grad():
+            return self.actor_model(input_dict)
+
+    def get_values(self, obs):
+        return self.get_action_values(obs)['values']
+
+    def _target_neglogp_values(self, obs, actions):
+        neglogps = []
+        values = []
+        for start in range(0, self.batch_size, self.minibatch_size):
+            end = start + self.minibatch_size
+            input_dict = {
+                'is_train': True,
+                'prev_actions': actions[start:end],
+                'obs' : self._preproc_obs(self._tensors_slice(obs, slice(start, end))),
+                'rnn_states' : None
+            }
+            res_dict = self.model(input_dict)
+            neglogps.append(res_dict['prev_neglogp'])
+            values.append(self.model.denorm_value(res_dict['values']))
+        return torch.cat(neglogps), torch.cat(values)
+
+    def play_steps(self):
+        if self.actor_thread is None:
+            self.start_actor()
+
+        wait_start = time.time()
+        queue_depth = self.rollout_queue.qsize()
+        batch_dict = self.rollout_queue.get()
+        if isinstance(batch_dict, Exception):
+            raise batch_dict
+        wait_time = time.time() - wait_start
+
+        with self.profiler.scope('episode_stats'):
+            for game_stats in batch_dict.pop('game_stats'):
+                super().update_game_stats(*game_stats)
+
+        policy_lag = self.policy_version - batch_dict.pop('policy_version')
+        last_obs = batch_dict.pop('last_obs')
+        fdones = batch_dict.pop('last_dones').float()
+        batch_size = self.num_actors * self.num_agents
+
+        # batch is flattened as (actors, horizon), V-trace runs over (horizon, actors)
+        def to_time_major(arr):
+            return arr.view(batch_size, self.horizon_length, *arr.size()[1:]).transpose(0, 1)
+
+        with torch.no_grad():
+            neglogps, values = self._target_neglogp_values(batch_dict['obses'], batch_dict['actions'])
+            last_values = self.model({
+                'is_train': False,
+                'prev_actions': None,
+                'obs' : self._preproc_obs(last_obs),
+                'rnn_states' : None
+            })['values']
+            log_rhos = batch_dict['neglogpacs'] - neglogps
+            vs, pg_advantages = advantages.vtrace(to_time_major(log_rhos), fdones, last_values,
+                to_time_major(batch_dict['dones'].float()), to_time_major(values), to_time_major(batch_dict['rewards']),
+                self.gamma, self.tau, self.vtrace_clip_rho, self.vtrace_clip_c, self.vtrace_clip_pg_rho)
+
+        batch_dict['returns'] = a2c_common.swap_and_flatten01(vs)
+        batch_dict['advantages'] = a2c_common.swap_and_flatten01(pg_advantages)
+
+        self.writer.add_scalar('appo/policy_lag', policy_lag, self.frame)
+        self.writer.add_scalar('appo/queue_depth', queue_depth, self.frame)
+        self.writer.add_scalar('appo/queue_wait_time', wait_time, self.frame)
+        self.writer.add_scalar('appo/mean_rho', torch.exp(log_rhos).mean().item(), self.frame)
+        return batch_dict
+
+    def train_epoch(self):
+        res = super().train_epoch()
+        self.publish_weights()
+        return res
+
+    def train(self):
+        try:
+            return super().train()
+        finally:
+            self.stop_actor()
+
+
+class AppoContinuousAgent(AsyncActorLearner, a2c_continuous.A2CAgent):
+    def __init__(self, base_name, params):
+        a2c_continuous.A2CAgent.__init__(self, base_name, params)
+        self.init_async()
+
+    def init_tensors(self):
+        a2c_continuous.A2CAgent.init_tensors(self)
+        self.tensor_list = self.tensor_list + ['rewards']
+
+
+class AppoDiscreteAgent(AsyncActorLearner, a2c_discrete.DiscreteA2CAgent):
+    def __init__(self, base_name, params):
+        a2c_discrete.DiscreteA2CAgent.__init__(self, base_name, params)
+        self.init_async()
+
+    def init_tensors(self):
+        a2c_discrete.DiscreteA2CAgent.init_tensors(self)
+        self.tensor_list = self.tensor_list + ['rewards']
@@ -7,12 +7,13 @@ from rl_games.algos_torch.running_mean_std import RunningMeanStd, RunningMeanStd
 from rl_games.common  import common_losses
 from rl_games.common import datasets
 from rl_games.common import schedulers
+from rl_games.common.profiler import DefaultProfiler
 
 
 class CentralValueTrain(nn.Module):
 
     def __init__(self, state_shape, value_size, ppo_device, num_agents, horizon_length, num_actors, num_actions, 
-                seq_len, normalize_value, network, config, writter, max_epochs, multi_gpu, zero_rnn_on_done):
+                seq_len, normalize_value, network, config, writter, max_epochs, multi_gpu, zero_rnn_on_done, profiler=None):
         nn.Module.__init__(self)
 
         self.ppo_device = ppo_device
@@ -27,6 +28,7 @@ class CentralValueTrain(nn.Module):
         self.config = config
         self.normalize_input = config['normalize_input']
         self.zero_rnn_on_done = zero_rnn_on_done
+        self.profiler = profiler if profiler is not None else DefaultProfiler()
 
         state_config = {
             'value_size' : value_size,
@@ -100,7 +102,15 @@ class CentralValueTrain(nn.Module):
                 config['print_stats'] = False
                 config['lr_schedule'] = None
 
-        self.dataset = datasets.PPODataset(self.batch_size, self.minibatch_size, True, self.is_rnn, self.ppo_device, self.seq_len)
+        self.dataset = datasets.PPODataset(self.batch_size, self.minibatch_size, True, self.is_rnn, self.ppo_device, self.seq_len,
+                                           config.get('shuffle_minibatches', False))
+        if config.get('prefetch_minibatches', False):
+            self.minibatches = datasets.MinibatchPrefetcher(self.dataset, self._preproc_obs, self.ppo_device)
+        else:
+            self.minibatches = datasets.MinibatchIterator(self.dataset)
+        # minibatch sampler of the actor dataset is used, its permutations are drawn by the actor
+        self.shared_sampler = False
+        self.avg_loss = 0
 
     def update_lr(self, lr):
         if self.multi_gpu:
@@ -135,6 +145,9 @@ class CentralValueTrain(nn.Module):
             batch_dict['returns'] = res[1]
             batch_dict['actions'] = res[2]
             batch_dict['dones'] = res[3]
+            if rnn_masks is not None:
+                # step masks are the same for all agents of an actor
+                batch_dict['rnn_masks'] = rnn_masks.view(self.num_actors, self.num_agents, self.horizon_length).transpose(0, 1).contiguous().view(-1)[:self.batch_size]
         
         if self.is_rnn:
             states = []
@@ -171,14 +184,14 @@ class CentralValueTrain(nn.Module):
             for s, mb_s in zip(self.rnn_states, self.mb_rnn_states):
                 mb_s[n // self.seq_len,:,:,:] = s
 
-    def post_step_rnn(self, all_done_indices, zero_rnn_on_done=True):
+    def post_step_rnn(self, dones, zero_rnn_on_done=True):
         if not self.is_rnn:
             return
         if not self.zero_rnn_on_done:
             return
-        all_done_indices = all_done_indices[::self.num_agents] // self.num_agents
+        not_dones = 1.0 - dones[::self.num_agents].float()
         for s in self.rnn_states:
-            s[:,all_done_indices,:] = s[:,all_done_indices,:] * 0.0
+            s.mul_(not_dones.view(1, -1, 1))
 
     def forward(self, input_dict):
         return self.model(input_dict)
@@ -216,15 +229,38 @@ class CentralValueTrain(nn.Module):
 
         return value_preds, returns, actions, dones
 
-    def train_net(self):
-        self.train()
-        loss = 0
+    def share_sampler(self, sampler, mini_epochs):
+        '''
+        Uses the minibatch sampler of the actor dataset for fused training if the datasets have the same layout
+        (single agent, same minibatches and mini-epochs): critic and actor minibatches then cover the same transitions.
+        Multi-agent critics keep their own sampler.
+        '''
+        own_sampler = self.dataset.sampler
+        same_layout = (own_sampler.num_items, own_sampler.items_per_minibatch) == (sampler.num_items, sampler.items_per_minibatch)
+        if self.num_agents == 1 and mini_epochs == self.mini_epoch and same_layout:
+            self.dataset.sampler = sampler
+            self.shared_sampler = True
+
+    def num_train_steps(self):
+        return self.mini_epoch * len(self.minibatches)
+
+    def train_steps(self):
+        '''
+        Generator of the critic updates of an epoch, one per step. Fused training interleaves them with the actor minibatches.
+        Losses stay on the device and are read back once at the end of the epoch.
+        '''
+        losses = []
         for _ in range(self.mini_epoch):
-            for idx in range(len(self.dataset)):
-                loss += self.train_critic(self.dataset[idx])
+            if not self.shared_sampler:
+                self.dataset.new_mini_epoch()
+            for input_dict in self.minibatches:
+                self.train()
+                losses.append(self.calc_gradients(input_dict).detach())
+                yield
             if self.normalize_input:
                 self.model.running_mean_std.eval()  # don't need to update statstics more than one miniepoch
-        avg_loss = loss / (self.mini_epoch * self.num_minibatches)
+        avg_loss = torch_ext.mean_list(losses).item()
+        self.avg_loss = avg_loss
 
         self.epoch_num += 1
         self.lr, _ = self.scheduler.update(self.lr, 0, self.epoch_num, 0, 0)
@@ -233,10 +269,17 @@ class CentralValueTrain(nn.Module):
         if self.writter != None:
             self.writter.add_scalar('losses/cval_loss', avg_loss, self.frame)
             self.writter.add_scalar('info/cval_lr', self.lr, self.frame)        
-        return avg_loss
+
+    def train_net(self):
+        for _ in self.train_steps():
+            pass
+        return self.avg_loss
 
     def calc_gradients(self, batch):
-        obs_batch = self._preproc_obs(batch['obs'])
+        if 'processed_obs' in batch:
+            obs_batch = batch['processed_obs']
+        else:
+            obs_batch = self._preproc_obs(batch['obs'])
         value_preds_batch = batch['old_values']
         returns_batch = batch['returns']
         actions_batch = batch['actions']
@@ -250,39 +293,43 @@ class CentralValueTrain(nn.Module):
         if self.is_rnn:
             batch_dict['rnn_states'] = batch['rnn_states']
 
-        res_dict = self.model(batch_dict)
-        values = res_dict['values']
-        loss = common_losses.critic_loss(self.model, value_preds_batch, values, self.e_clip, returns_batch, self.clip_value)
-        #print(loss.min(), loss.max(), loss.size(), rnn_masks_batch)
-        losses, _ = torch_ext.apply_masks([loss], rnn_masks_batch)
-        loss = losses[0]
+        with self.profiler.scope('forward'):
+            res_dict = self.model(batch_dict)
+            values = res_dict['values']
+            loss = common_losses.critic_loss(self.model, value_preds_batch, values, self.e_clip, returns_batch, self.clip_value)
+            #print(loss.min(), loss.max(), loss.size(), rnn_masks_batch)
+            losses, _ = torch_ext.apply_masks([loss], rnn_masks_batch)
+            loss = losses[0]
         #6print('aaa', loss.min(), loss.max(), loss.size())
         if self.multi_gpu:
             self.optimizer.zero_grad()
         else:
             for param in self.model.parameters():
                 param.grad = None
-        loss.backward()
+        with self.profiler.scope('backward'):
+            loss.backward()
 
         if self.multi_gpu:
-            # batch allreduce ops: see https://github.com/entity-neural-network/incubator/pull/220
-            all_grads_list = []
-            for param in self.model.parameters():
-                if param.grad is not None:
-                    all_grads_list.append(param.grad.view(-1))
-            all_grads = torch.cat(all_grads_list)
-            dist.all_reduce(all_grads, op=dist.ReduceOp.SUM)
-            offset = 0
-            for param in self.model.parameters():
-                if param.grad is not None:
-                    param.grad.data.copy_(
-                        all_grads[offset : offset + param.numel()].view_as(param.grad.data) / self.world_size
-                    )
-                    offset += param.numel()
-
-        if self.truncate_grads:
-            nn.utils.clip_grad_norm_(self.model.parameters(), self.grad_norm)
-
-        self.optimizer.step()
+            with self.profiler.scope('all_reduce'):
+                # batch allreduce ops: see https://github.com/entity-neural-network/incubator/pull/220
+                all_grads_list = []
+                for param in self.model.parameters():
+                    if param.grad is not None:
+                        all_grads_list.append(param.grad.view(-1))
+                all_grads = torch.cat(all_grads_list)
+                dist.all_reduce(all_grads, op=dist.ReduceOp.SUM)
+                offset = 0
+                for param in self.model.parameters():
+                    if param.grad is not None:
+                        param.grad.data.copy_(
+                            all_grads[offset : offset + param.numel()].view_as(param.grad.data) / self.world_size
+                        )
+                        offset += param.numel()
+
+        with self.profiler.scope('optimizer_step'):
+            if self.truncate_grads:
+                nn.utils.clip_grad_norm_(self.model.parameters(), self.grad_norm)
+
+            self.optimizer.step()
         
         return loss
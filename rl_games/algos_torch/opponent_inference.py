@@ -0,0 +1,120 @@
+import asyncio
+import copy
+from collections import defaultdict
+
+import numpy as np
+import ray
+import yaml
+
+from rl_games.algos_torch import torch_ext
+
+
+class OpponentInferenceServer:
+    '''
+    Runs the opponent policy of self-play envs batched over all envs, instead of a player with its own model
+    in every env worker. Envs send single observations with get_action, requests which arrive within batch_timeout
+    seconds (or batch_size of them) are stacked and run in one forward pass per weights version.
+    Every update of the opponent weights is a new version, envs keep the version they play against.
+    '''
+    def __init__(self, params, batch_size, batch_timeout):
+        from rl_games.torch_runner import Runner
+
+        runner = Runner()
+        runner.load(params)
+        self.player = runner.create_player()
+        assert not self.player.is_rnn, 'central opponent inference does not support rnn opponents'
+        self.player.has_batch_dimension = True
+        self.player.model.eval()
+        self.base_model = self.player.model
+        # weights version -> model, version 0 are the initial weights of the player
+        self.models = {0 : self.base_model}
+        self.last_version = 0
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        # pending requests as (obs, action mask, version, is_deterministic, future)
+        self.requests = []
+        self.flush_handle = None
+
+    def set_weights(self, version, weights, versions):
+        '''
+        Loads weights as a new version. versions are the versions envs still play against, models of the others are dropped.
+        '''
+        self.player.model = copy.deepcopy(self.base_model)
+        self.player.set_weights(torch_ext.state_dict_to_float(weights))
+        self.player.model.eval()
+        self.models[version] = self.player.model
+        self.last_version = version
+        self.models = {v : model for v, model in self.models.items() if v in versions}
+
+    async def get_action(self, obs, action_mask, version, is_deterministic):
+        future = asyncio.get_running_loop().create_future()
+        self.requests.append((obs, action_mask, version, is_deterministic, future))
+        if len(self.requests) >= self.batch_size:
+            self._run_batch()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.batch_timeout, self._run_batch)
+        return await future
+
+    def _run_batch(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        requests, self.requests = self.requests, []
+        groups = defaultdict(list)
+        for request in requests:
+            obs, action_mask, version, is_deterministic, _ = request
+            groups[(version, is_deterministic, action_mask is None)].append(request)
+        for (version, is_deterministic, no_mask), group in groups.items():
+            try:
+                actions = self._get_actions(version, is_deterministic, no_mask, group)
+            except Exception as e:
+                for request in group:
+                    request[-1].set_exception(e)
+                continue
+            for request, action in zip(group, actions):
+                request[-1].set_result(action)
+
+    def _get_actions(self, version, is_deterministic, no_mask, group):
+        # a straggler env may still ask for a version which was just replaced, it gets the latest one
+        self.player.model = self.models.get(version, self.models[self.last_version])
+        obs = self.player.obs_to_torch(np.stack([request[0] for request in group]))
+        if no_mask:
+            actions = self.player.get_action(obs, is_deterministic)
+        else:
+            actions = self.player.get_masked_action(obs, np.stack([request[1] for request in group]), is_deterministic)
+        # players squeeze the batch dimension of a single action away
+        actions = actions.cpu().numpy().reshape(len(group), -1)
+        return [np.squeeze(action) for action in actions]
+
+
+class RemoteOpponent:
+    '''
+    Stands in for the opponent player of a self-play env, actions come from an OpponentInferenceServer.
+    Envs get it with update_weights when the self-play manager runs the opponents centrally.
+    '''
+    def __init__(self, opponent_server, version):
+        self.opponent_server = opponent_server
+        self.version = version
+
+    def obs_to_torch(self, obs):
+        # obs are batched and moved to the device by the server
+        return obs
+
+    def get_action(self, obs, is_deterministic=False):
+        return ray.get(self.opponent_server.get_action.remote(obs, None, self.version, is_deterministic))
+
+    def get_masked_action(self, obs, action_masks, is_deterministic=True):
+        return ray.get(self.opponent_server.get_action.remote(obs, action_masks, self.version, is_deterministic))
+
+
+def create_opponent_server(config_path, env_info, device='cpu', batch_size=1, batch_timeout=0.002):
+    '''
+    Starts an OpponentInferenceServer ray actor for the player config at config_path.
+    A cuda device gets a fraction of a gpu, so the server can share it with the learner.
+    '''
+    with open(config_path, 'r') as stream:
+        params = yaml.safe_load(stream)
+    params['params']['config']['env_info'] = env_info
+    params['params']['config']['device_name'] = device
+    num_gpus = 0.1 if device.startswith('cuda') else 0
+    return ray.remote(OpponentInferenceServer).options(num_gpus=num_gpus).remote(params, batch_size, batch_timeout)
@@ -4,6 +4,7 @@ from rl_games.common import vecenv
 from rl_games.common import schedulers
 from rl_games.common import experience
 from rl_games.common.a2c_common import print_statistics
+from rl_games.common.profiler import DefaultProfiler, TimelineProfiler
 
 from rl_games.interfaces.base_algorithm import  BaseAlgorithm
 from torch.utils.tensorboard import SummaryWriter
@@ -126,6 +127,7 @@ class SACAgent(BaseAlgorithm):
         # self.c2_loss = nn.SmoothL1Loss()
 
         self.save_best_after = config.get('save_best_after', 500)
+        self.save_freq = config.get('save_frequency', 0)
         self.print_stats = config.get('print_stats', True)
         self.rnn_states = None
         self.name = base_name
@@ -177,6 +179,15 @@ class SACAgent(BaseAlgorithm):
         os.makedirs(self.nn_dir, exist_ok=True)
         os.makedirs(self.summaries_dir, exist_ok=True)
 
+        self.use_profiler = config.get('use_profiler', False)
+        if self.use_profiler:
+            trace_path = None
+            if config.get('profiler_trace', False):
+                trace_path = os.path.join(self.experiment_dir, 'profiler_trace.json')
+            self.profiler = TimelineProfiler(sync_cuda=config.get('profiler_sync_cuda', False), trace_path=trace_path)
+        else:
+            self.profiler = DefaultProfiler()
+
         self.writer = SummaryWriter('runs/' + config['name'] + datetime.now().strftime("_%d-%H-%M-%S"))
         print("Run Directory:", config['name'] + datetime.now().strftime("_%d-%H-%M-%S"))
 
@@ -316,18 +327,22 @@ class SACAgent(BaseAlgorithm):
                                     (1.0 - tau) * target_param.data)
 
     def update(self, step):
-        obs, action, reward, next_obs, done = self.replay_buffer.sample(self.batch_size)
-        not_done = ~done
+        with self.profiler.scope('sample'):
+            obs, action, reward, next_obs, done = self.replay_buffer.sample(self.batch_size)
+            not_done = ~done
 
-        obs = self.preproc_obs(obs)
-        next_obs = self.preproc_obs(next_obs)
-        critic_loss, critic1_loss, critic2_loss = self.update_critic(obs, action, reward, next_obs, not_done, step)
+            obs = self.preproc_obs(obs)
+            next_obs = self.preproc_obs(next_obs)
+        with self.profiler.scope('critic'):
+            critic_loss, critic1_loss, critic2_loss = self.update_critic(obs, action, reward, next_obs, not_done, step)
 
-        actor_loss, entropy, alpha, alpha_loss = self.update_actor_and_alpha(obs, step)
+        with self.profiler.scope('actor'):
+            actor_loss, entropy, alpha, alpha_loss = self.update_actor_and_alpha(obs, step)
 
         actor_loss_info = actor_loss, entropy, alpha, alpha_loss
-        self.soft_update_params(self.model.sac_network.critic, self.model.sac_network.critic_target,
-                                     self.critic_tau)
+        with self.profiler.scope('target_update'):
+            self.soft_update_params(self.model.sac_network.critic, self.model.sac_network.critic_target,
+                                         self.critic_tau)
         return actor_loss_info, critic1_loss, critic2_loss
 
     def preproc_obs(self, obs):
@@ -431,17 +446,20 @@ class SACAgent(BaseAlgorithm):
         critic2_losses = []
 
         obs = self.obs
+        if isinstance(obs, dict):
+            obs = obs['obs']
         for s in range(self.num_steps_per_episode):
             self.set_eval()
-            if random_exploration:
-                action = torch.rand((self.num_actors, *self.env_info["action_space"].shape), device=self._device) * 2.0 - 1.0
-            else:
-                with torch.no_grad():
-                    action = self.act(obs.float(), self.env_info["action_space"].shape, sample=True)
+            with self.profiler.scope('inference'):
+                if random_exploration:
+                    action = torch.rand((self.num_actors, *self.env_info["action_space"].shape), device=self._device) * 2.0 - 1.0
+                else:
+                    with torch.no_grad():
+                        action = self.act(obs.float(), self.env_info["action_space"].shape, sample=True)
 
             step_start = time.time()
 
-            with torch.no_grad():
+            with torch.no_grad(), self.profiler.scope('env_step'):
                 next_obs, rewards, dones, infos = self.env_step(action)
             step_end = time.time()
 
@@ -473,14 +491,16 @@ class SACAgent(BaseAlgorithm):
 
             rewards = self.rewards_shaper(rewards)
 
-            self.replay_buffer.add(obs, action, torch.unsqueeze(rewards, 1), next_obs, torch.unsqueeze(dones, 1))
+            with self.profiler.scope('buffer_write'):
+                self.replay_buffer.add(obs, action, torch.unsqueeze(rewards, 1), next_obs, torch.unsqueeze(dones, 1))
 
             self.obs = obs = next_obs.clone()
 
             if not random_exploration:
                 self.set_train()
                 update_time_start = time.time()
-                actor_loss_info, critic1_loss, critic2_loss = self.update(self.epoch_num)
+                with self.profiler.scope('update'):
+                    actor_loss_info, critic1_loss, critic2_loss = self.update(self.epoch_num)
                 update_time_end = time.time()
                 update_time = update_time_end - update_time_start
 
@@ -503,6 +523,13 @@ class SACAgent(BaseAlgorithm):
         return self.play_steps(random_exploration)
 
     def train(self):
+        try:
+            return self.train_loop()
+        finally:
+            # the trace file is closed however training ends
+            self.profiler.close()
+
+    def train_loop(self):
         self.init_tensors()
         self.algo_observer.after_init(self)
         self.last_mean_rewards = -100500
@@ -533,6 +560,7 @@ class SACAgent(BaseAlgorithm):
             self.writer.add_scalar('performance/rl_update_time', update_time, self.frame)
             self.writer.add_scalar('performance/step_inference_time', play_time, self.frame)
             self.writer.add_scalar('performance/step_time', step_time, self.frame)
+            self.profiler.send_info(self.writer, self.frame)
 
             if self.epoch_num >= self.num_warmup_steps:
                 self.writer.add_scalar('losses/a_loss', torch_ext.mean_list(actor_losses).item(), self.frame)
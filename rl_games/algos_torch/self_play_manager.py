@@ -1,4 +1,8 @@
+import math
 import numpy as np
+import ray
+from rl_games.algos_torch import torch_ext
+from rl_games.algos_torch.opponent_inference import create_opponent_server
 
 class SelfPlayManager:
     def __init__(self, config, writter):
@@ -8,9 +12,37 @@ class SelfPlayManager:
         self.games_to_check = self.config['games_to_check']
         self.check_scores = self.config.get('check_scores', False)
         self.env_update_num = self.config.get('env_update_num', 1)
+        # send opponent weights as float16, halves the transfer for big models
+        self.fp16_weights = self.config.get('fp16_weights', False)
         self.env_indexes = np.arange(start=0, stop=self.env_update_num)
         self.updates_num = 0
-        
+        # opponents of all envs run batched in one OpponentInferenceServer instead of a player in every env
+        self.central_opponent = self.config.get('central_opponent', False)
+        self.opponent_server = None
+
+    def init_opponents(self, algo):
+        '''
+        Starts the opponent inference server and sends it to the envs, before the first reset of the envs.
+        '''
+        if not self.central_opponent:
+            return
+        # envs of one worker ask for actions one after another, so at most one request per worker is pending
+        batch_size = math.ceil(algo.num_actors / algo.env_config.get('envs_per_worker', 1))
+        self.opponent_server = create_opponent_server(self.config.get('opponent_config_path', algo.env_config['config_path']),
+            algo.env_info, self.config.get('opponent_device', 'cpu'), self.config.get('opponent_batch_size', batch_size),
+            self.config.get('opponent_batch_timeout', 0.002))
+        # weights version of the opponent of every env
+        self.opponent_version = 0
+        self.env_versions = np.zeros(algo.num_actors, dtype=np.int64)
+        algo.vec_env.set_weights(np.arange(algo.num_actors), {'opponent_server' : self.opponent_server, 'version' : 0})
+
+    def _set_opponent_weights(self, algo, weights):
+        self.opponent_version += 1
+        self.env_versions[self.env_indexes] = self.opponent_version
+        # the server has the new version before the envs switch to it
+        ray.get(self.opponent_server.set_weights.remote(self.opponent_version, weights, np.unique(self.env_versions).tolist()))
+        algo.vec_env.set_weights(self.env_indexes, {'opponent_server' : self.opponent_server, 'version' : self.opponent_version})
+
     def update(self, algo):
         self.updates_num += 1
         if self.check_scores:
@@ -26,7 +58,11 @@ class SelfPlayManager:
 
                 algo.clear_stats()
                 self.writter.add_scalar('selfplay/iters_update_weigths', self.updates_num, algo.frame)
-                algo.vec_env.set_weights(self.env_indexes, algo.get_weights())
+                weights = torch_ext.state_dict_to_cpu(algo.get_weights(), half=self.fp16_weights)
+                if self.central_opponent:
+                    self._set_opponent_weights(algo, weights)
+                else:
+                    algo.vec_env.set_weights(self.env_indexes, weights)
                 self.env_indexes = (self.env_indexes + 1) % (algo.num_actors)
                 self.updates_num = 0
                       
\ No newline at end of file
@@ -6,6 +6,7 @@ import torch.optim as optim
 from torch.optim.optimizer import Optimizer
 import math
 import time
+import copy
 
 numpy_to_torch_dtype_dict = {
     np.dtype('bool')       : torch.bool,
@@ -150,11 +151,12 @@ def normalization_with_masks(values, masks):
     return normalized_values
 
 def get_mean_var_with_masks(values, masks):
-    sum_mask = masks.sum()
+    # clamped, so a batch with less than two valid entries (i.e. all masked by step masks) doesn't produce nans
+    sum_mask = masks.sum().clamp(min=1)
     values_mask = values * masks
     values_mean = values_mask.sum() / sum_mask
     min_sqr = ((((values_mask)**2)/sum_mask).sum() - ((values_mask/sum_mask).sum())**2)
-    values_var = min_sqr * sum_mask / (sum_mask-1)
+    values_var = min_sqr * sum_mask / (sum_mask-1).clamp(min=1)
     return values_mean, values_var
 
 def explained_variance(y_pred,y, masks=None):
@@ -277,6 +279,34 @@ def get_mean(v):
         mean = 0
     return mean
 
+def map_state_dict(state, func):
+    '''
+    Applies func to the tensors of a (nested) state dict. Dict types and the _metadata of torch state dicts are kept
+    '''
+    if isinstance(state, dict):
+        state = copy.copy(state)
+        for k, v in state.items():
+            state[k] = map_state_dict(v, func)
+        return state
+    if torch.is_tensor(state):
+        return func(state)
+    return state
+
+def state_dict_to_cpu(state, half=False):
+    '''
+    Detached cpu copy of a state dict to send it to env workers. half casts float32 tensors to float16,
+    halves the size of big opponents, state_dict_to_float casts them back
+    '''
+    def to_cpu(tensor):
+        tensor = tensor.detach().cpu()
+        if half and tensor.dtype == torch.float32:
+            tensor = tensor.half()
+        return tensor
+    return map_state_dict(state, to_cpu)
+
+def state_dict_to_float(state):
+    return map_state_dict(state, lambda tensor: tensor.float() if tensor.dtype == torch.float16 else tensor)
+
 
 class AverageMeter(nn.Module):
     def __init__(self, in_shape, max_size):
@@ -307,6 +337,60 @@ class AverageMeter(nn.Module):
         return self.mean.squeeze(0).cpu().numpy()
 
 
+class RingAverageMeter(nn.Module):
+    '''
+    Same interface as AverageMeter, but keeps the last max_size values in a ring buffer on the device.
+    update_masked writes only the values selected by the mask without computing their indices on the host,
+    so it can be called every env step without syncing with the device. Only current_size and get_mean sync.
+    get_mean returns array of in_shape.
+    '''
+    def __init__(self, in_shape, max_size):
+        super(RingAverageMeter, self).__init__()
+        self.max_size = max_size
+        if isinstance(in_shape, int):
+            in_shape = (in_shape,)
+        # the last row is a scratch slot for the masked out values
+        self.register_buffer("values", torch.zeros((max_size + 1,) + tuple(in_shape), dtype = torch.float32))
+        self.register_buffer("write_pos", torch.zeros((), dtype = torch.long))
+        self.register_buffer("count", torch.zeros((), dtype = torch.long))
+
+    def update_masked(self, values, mask):
+        mask = mask.bool()
+        values = values.float().view((values.size()[0],) + self.values.size()[1:])
+        cum_mask = torch.cumsum(mask.long(), dim=0)
+        num_new = cum_mask[-1]
+        # if there are more than max_size new values only the last max_size are kept
+        mask = mask & (num_new - cum_mask < self.max_size)
+        positions = (self.write_pos + cum_mask - 1) % self.max_size
+        positions = torch.where(mask, positions, torch.full_like(positions, self.max_size))
+        self.values.index_copy_(0, positions, values)
+        self.write_pos.copy_((self.write_pos + num_new) % self.max_size)
+        self.count.copy_(torch.clamp(self.count + num_new, max=self.max_size))
+
+    def update(self, values):
+        size = values.size()[0]
+        if size == 0:
+            return
+        self.update_masked(values, torch.ones(size, dtype=torch.bool, device=values.device))
+
+    def clear(self):
+        self.write_pos.fill_(0)
+        self.count.fill_(0)
+
+    @property
+    def current_size(self):
+        return self.count.item()
+
+    def __len__(self):
+        return self.current_size
+
+    def get_mean(self):
+        valid = (torch.arange(self.max_size, device=self.values.device) < self.count).float()
+        valid = valid.view((self.max_size,) + (1,) * (self.values.dim() - 1))
+        mean = (self.values[:self.max_size] * valid).sum(dim=0) / torch.clamp(self.count, min=1)
+        return mean.cpu().numpy()
+
+
 class IdentityRNN(nn.Module):
     def __init__(self, in_shape, out_shape):
         super(IdentityRNN, self).__init__()
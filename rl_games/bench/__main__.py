@@ -0,0 +1,44 @@
+import argparse
+import sys
+
+from rl_games.bench import benchmark
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='rl_games throughput benchmarks. Runs fixed epoch training on the batched test envs.')
+    ap.add_argument('-b', '--benchmarks', nargs='+', choices=list(benchmark.BENCHMARKS.keys()), default=None,
+                    help='benchmarks to run, all by default')
+    ap.add_argument('-e', '--epochs', type=int, default=None, help='number of epochs, overrides the benchmark default')
+    ap.add_argument('--warmup_epochs', type=int, default=2, help='first epochs are not used for the metrics')
+    ap.add_argument('-d', '--device', default='cpu', help='training device')
+    ap.add_argument('-s', '--save', default=None, help='write results as a new baseline json')
+    ap.add_argument('-c', '--compare', default=None, help='baseline json to compare with')
+    ap.add_argument('-t', '--tolerance', type=float, default=0.1, help='allowed relative regression of fps and update time')
+    ap.add_argument('--vecenvs', nargs='+', choices=benchmark.VECENV_TYPES, default=None,
+                    help='compare env stepping throughput of these vecenv types, first one is the reference')
+    ap.add_argument('--vecenv_benchmarks', nargs='+', choices=list(benchmark.VECENV_BENCHMARKS.keys()), default=None,
+                    help='configs for --vecenvs, all by default')
+    ap.add_argument('--num_actors', type=int, default=16, help='number of envs for --vecenvs')
+    ap.add_argument('--steps', type=int, default=200, help='number of steps for --vecenvs')
+    ap.add_argument('--memory_tolerance', type=float, default=None, help='allowed relative regression of peak memory, same as tolerance by default')
+    args = ap.parse_args()
+
+    results = {}
+    # training benchmarks run by default, vecenv benchmarks only with --vecenvs
+    if args.benchmarks or not args.vecenvs:
+        results.update(benchmark.run_benchmarks(args.benchmarks, args.epochs, args.device, args.warmup_epochs))
+    if args.vecenvs:
+        results.update(benchmark.run_vecenv_benchmarks(args.vecenv_benchmarks, args.vecenvs, args.num_actors, args.steps))
+
+    if args.save:
+        benchmark.save_baseline(args.save, results, args.device)
+        print(f'Saved baseline to {args.save}')
+
+    if args.compare:
+        baseline = benchmark.load_baseline(args.compare)
+        regressions = benchmark.compare_to_baseline(results, baseline, args.tolerance, args.memory_tolerance)
+        for name, metric, old, new, change in regressions:
+            print(f'REGRESSION {name} {metric}: {old:.4g} -> {new:.4g} ({change:+.1%})')
+        if regressions:
+            sys.exit(1)
+        print('No regressions')
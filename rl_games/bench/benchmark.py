@@ -0,0 +1,309 @@
+import copy
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import torch
+import yaml
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from rl_games.common.algo_observer import DefaultAlgoObserver
+
+
+CONFIGS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'configs')
+
+# every benchmark is a config from rl_games/configs with overrides. They use the numpy batched test envs (TEST_VEC),
+# so they run offline, need no ray workers and measure the training loop rather than the environments.
+BENCHMARKS = {
+    'ppo_continuous': {
+        'file': 'ppo_pendulum_torch.yaml',
+        'config': {'env_name': 'test_vec_env', 'num_actors': 64},
+        'env_config': {'name': 'TestAsymmetricEnv-v0', 'wrapped_env_name': 'Pendulum-v1', 'apply_mask': False, 'use_central_value': False},
+    },
+    'ppo_discrete': {
+        'file': 'test/test_discrete.yaml',
+        'config': {'env_name': 'test_vec_env'},
+    },
+    'ppo_rnn': {
+        'file': 'test/test_rnn_vec.yaml',
+    },
+    'central_value': {
+        'file': 'test/test_asymmetric_discrete_vec.yaml',
+    },
+    'sac': {
+        'file': 'mujoco/sac_ant_envpool.yaml',
+        'config': {'name': 'sac_pendulum', 'env_name': 'test_vec_env', 'num_actors': 16, 'batch_size': 256, 'num_warmup_steps': 2},
+        'env_config': {'name': 'TestAsymmetricEnv-v0', 'wrapped_env_name': 'Pendulum-v1', 'apply_mask': False, 'use_central_value': False},
+        # sac stops only after the first finished episode, pendulum episodes are 200 steps
+        'epochs': 30,
+    },
+}
+
+# vec env benchmarks step envs of the bundled configs with random actions, without training. Every config is run with
+# each vecenv type, so RAY, SHM and THREADED can be compared on the same envs. mujoco and box2d configs need the simulators.
+VECENV_BENCHMARKS = {
+    'pendulum': {'file': 'ppo_pendulum_torch.yaml'},
+    'test_rnn': {'file': 'test/test_discrete.yaml'},
+    'lunar': {'file': 'ppo_lunar_discrete.yaml'},
+    'ant': {'file': 'mujoco/ant.yaml'},
+}
+VECENV_TYPES = ['RAY', 'SHM', 'THREADED']
+
+# metric name -> (summary tag, True if higher is better)
+METRICS = {
+    'env_fps' : ('performance/step_fps', True),
+    'inference_fps' : ('performance/step_inference_fps', True),
+    'total_fps' : ('performance/step_inference_rl_update_fps', True),
+    'update_time' : ('performance/rl_update_time', False),
+}
+PEAK_MEMORY_METRIC = 'peak_memory_mb'
+
+
+class _RecordingWriter:
+    '''
+    Forwards everything to the algo SummaryWriter and keeps the values of the performance tags.
+    '''
+    def __init__(self, writer, records):
+        self.writer = writer
+        self.records = records
+
+    def add_scalar(self, tag, value, *args, **kwargs):
+        if tag in self.records:
+            self.records[tag].append(float(value))
+        if self.writer is not None:
+            return self.writer.add_scalar(tag, value, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.writer, name)
+
+
+class BenchmarkObserver(DefaultAlgoObserver):
+    def __init__(self):
+        DefaultAlgoObserver.__init__(self)
+        self.records = {tag : [] for tag, _ in METRICS.values()}
+
+    def after_init(self, algo):
+        DefaultAlgoObserver.after_init(self, algo)
+        algo.writer = _RecordingWriter(algo.writer, self.records)
+        self.writer = algo.writer
+
+
+def _peak_memory_mb(device):
+    if device.startswith('cuda') and torch.cuda.is_available():
+        return torch.cuda.max_memory_allocated() / 2**20
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return max_rss / 2**20 if sys.platform == 'darwin' else max_rss / 2**10
+
+
+def load_benchmark_config(name, epochs=None, device='cpu', seed=5):
+    spec = BENCHMARKS[name]
+    with open(os.path.join(CONFIGS_DIR, spec['file']), 'r') as stream:
+        params = yaml.safe_load(stream)['params']
+
+    config = params['config']
+    config.update(copy.deepcopy(spec.get('config', {})))
+    if 'env_config' in spec:
+        config['env_config'] = copy.deepcopy(spec['env_config'])
+    config['env_config']['seed'] = seed
+    config['device'] = device
+    config['max_epochs'] = epochs or spec.get('epochs', 10)
+    config['multi_gpu'] = False
+    config['score_to_win'] = float('inf')
+    config['save_best_after'] = config['max_epochs'] + 1
+    config['print_stats'] = False
+    if 'central_value_config' in config:
+        config['central_value_config']['minibatch_size'] = min(config['central_value_config']['minibatch_size'], config['minibatch_size'])
+    params['seed'] = seed
+    return params
+
+
+def run_benchmark(name, epochs=None, device='cpu', warmup_epochs=2):
+    '''
+    Trains the benchmark for a fixed number of epochs and returns medians of the per epoch performance metrics,
+    first warmup_epochs are skipped. Runs in the current process, use run_benchmarks to get isolated peak memory.
+    '''
+    from rl_games.torch_runner import Runner
+
+    params = load_benchmark_config(name, epochs, device)
+    observer = BenchmarkObserver()
+    with tempfile.TemporaryDirectory() as train_dir:
+        params['config']['train_dir'] = train_dir
+        cwd = os.getcwd()
+        # sac writes summaries relative to the working directory
+        os.chdir(train_dir)
+        try:
+            runner = Runner(observer)
+            runner.load({'params' : params})
+            start_time = time.time()
+            runner.run({'train' : True, 'play' : False})
+            total_time = time.time() - start_time
+        finally:
+            os.chdir(cwd)
+
+    result = {'epochs' : params['config']['max_epochs'], 'total_time' : total_time}
+    for metric, (tag, _) in METRICS.items():
+        values = observer.records[tag]
+        values = values[warmup_epochs:] if len(values) > warmup_epochs else values
+        result[metric] = statistics.median(values) if values else None
+    result[PEAK_MEMORY_METRIC] = _peak_memory_mb(device)
+    return result
+
+
+def run_benchmarks(names=None, epochs=None, device='cpu', warmup_epochs=2):
+    '''
+    Runs every benchmark in a fresh process, so peak memory and global state are not shared between them.
+    '''
+    names = names or list(BENCHMARKS.keys())
+    ctx = multiprocessing.get_context('spawn')
+    results = {}
+    for name in names:
+        print(f'Running benchmark {name}')
+        with ctx.Pool(1) as pool:
+            results[name] = pool.apply(run_benchmark, (name, epochs, device, warmup_epochs))
+        print(name, json.dumps(results[name]))
+    return results
+
+
+def run_vecenv_benchmark(name, vecenv_type, num_actors=16, steps=200, warmup_steps=10, seed=5):
+    '''
+    Steps the env of the benchmark config with vecenv_type and returns env fps and mean step time.
+    Actions are sampled once, so only the vec env is measured.
+    '''
+    import numpy as np
+    from rl_games.common import vecenv
+
+    spec = VECENV_BENCHMARKS[name]
+    with open(os.path.join(CONFIGS_DIR, spec['file']), 'r') as stream:
+        config = yaml.safe_load(stream)['params']['config']
+    env_config = copy.deepcopy(config.get('env_config', {}))
+    env_config['seed'] = seed
+    env_config['vecenv_type'] = vecenv_type
+    env = vecenv.create_vec_env(config['env_name'], num_actors, **env_config)
+
+    action_space = env.get_env_info()['action_space']
+    action_space.seed(seed)
+    actions = np.stack([action_space.sample() for _ in range(num_actors * env.get_number_of_agents())])
+    env.reset()
+    for _ in range(warmup_steps):
+        env.step(actions)
+    start_time = time.time()
+    for _ in range(steps):
+        env.step(actions)
+    total_time = time.time() - start_time
+    if hasattr(env, 'close'):
+        env.close()
+    return {'num_actors' : num_actors, 'steps' : steps, 'env_fps' : num_actors * steps / total_time, 'step_time' : total_time / steps}
+
+
+def _process_target(pipe, func, args):
+    try:
+        pipe.send(('ok', func(*args)))
+    except Exception as e:
+        pipe.send(('error', repr(e)))
+
+
+def _run_in_process(func, args):
+    '''
+    Runs func in a fresh spawned process. Unlike a Pool worker the process is not daemonic, so SHM vecenv can start its workers.
+    '''
+    ctx = multiprocessing.get_context('spawn')
+    parent_pipe, child_pipe = ctx.Pipe()
+    process = ctx.Process(target=_process_target, args=(child_pipe, func, args))
+    process.start()
+    child_pipe.close()
+    try:
+        res = parent_pipe.recv()
+    except EOFError:
+        res = ('error', f'benchmark process exited with code {process.exitcode}')
+    process.join()
+    return res
+
+
+def run_vecenv_benchmarks(names=None, vecenv_types=None, num_actors=16, steps=200):
+    '''
+    Runs every config with every vecenv type in a fresh process and prints env fps relative to the first vecenv type.
+    Results are named vecenv_<config>_<vecenv type>.
+    '''
+    names = names or list(VECENV_BENCHMARKS.keys())
+    vecenv_types = vecenv_types or VECENV_TYPES
+    results = {}
+    for name in names:
+        for vecenv_type in vecenv_types:
+            print(f'Running vecenv benchmark {name} {vecenv_type}')
+            status, result = _run_in_process(run_vecenv_benchmark, (name, vecenv_type, num_actors, steps))
+            if status == 'error':
+                # i.e. mujoco or box2d are not installed
+                print(f'Skipped {name} {vecenv_type}: {result}')
+                continue
+            results[f'vecenv_{name}_{vecenv_type}'] = result
+        base = results.get(f'vecenv_{name}_{vecenv_types[0]}')
+        for vecenv_type in vecenv_types:
+            result = results.get(f'vecenv_{name}_{vecenv_type}')
+            if result is not None:
+                speedup = f' x{result["env_fps"] / base["env_fps"]:.2f}' if base is not None else ''
+                print(f'{name} {vecenv_type}: {result["env_fps"]:.0f} fps{speedup}')
+    return results
+
+
+def environment_info(device='cpu'):
+    return {
+        'python' : platform.python_version(),
+        'torch' : torch.__version__,
+        'platform' : platform.platform(),
+        'processor' : platform.processor(),
+        'cpu_count' : os.cpu_count(),
+        'torch_threads' : torch.get_num_threads(),
+        'device' : device,
+    }
+
+
+def save_baseline(path, results, device='cpu'):
+    baseline = {
+        'environment' : environment_info(device),
+        'benchmarks' : results,
+    }
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+
+
+def load_baseline(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def compare_to_baseline(results, baseline, tolerance=0.1, memory_tolerance=None):
+    '''
+    Returns the list of regressions: (benchmark, metric, baseline value, new value, relative change).
+    A metric regresses if it is worse than the baseline by more than tolerance, relative to the baseline value.
+    '''
+    memory_tolerance = tolerance if memory_tolerance is None else memory_tolerance
+    higher_is_better = {metric : higher for metric, (_, higher) in METRICS.items()}
+    higher_is_better[PEAK_MEMORY_METRIC] = False
+
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline['benchmarks']:
+            continue
+        base_result = baseline['benchmarks'][name]
+        for metric, higher in higher_is_better.items():
+            old, new = base_result.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            allowed = memory_tolerance if metric == PEAK_MEMORY_METRIC else tolerance
+            worse = -change if higher else change
+            if worse > allowed:
+                regressions.append((name, metric, old, new, change))
+    return regressions
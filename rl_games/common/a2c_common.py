@@ -7,9 +7,13 @@ from rl_games.algos_torch.moving_mean_std import GeneralizedMovingStats
 from rl_games.algos_torch.self_play_manager import SelfPlayManager
 from rl_games.algos_torch import torch_ext
 from rl_games.common import schedulers
+from rl_games.common import advantages
+from rl_games.common import transfer
+from rl_games.common import obs_compression
 from rl_games.common.experience import ExperienceBuffer
 from rl_games.common.interval_summary_writer import IntervalSummaryWriter
 from rl_games.common.diagnostics import DefaultDiagnostics, PpoDiagnostics
+from rl_games.common.profiler import DefaultProfiler, TimelineProfiler
 from rl_games.algos_torch import  model_builder
 from rl_games.interfaces.base_algorithm import  BaseAlgorithm
 import numpy as np
@@ -140,6 +144,8 @@ class A2CBase(BaseAlgorithm):
 
         self.central_value_config = self.config.get('central_value_config', None)
         self.has_central_value = self.central_value_config is not None
+        # interleave central value and actor minibatch updates in one loop instead of training the central value first
+        self.fused_central_value = self.has_central_value and self.central_value_config.get('fused_training', False)
         self.truncate_grads = self.config.get('truncate_grads', False)
 
         if self.has_central_value:
@@ -204,6 +210,22 @@ class A2CBase(BaseAlgorithm):
         self.seq_len = self.config.get('seq_length', 4)
         self.bptt_len = self.config.get('bptt_length', self.seq_len) # not used right now. Didn't show that it is usefull
         self.zero_rnn_on_done = self.config.get('zero_rnn_on_done', True)
+        # copy numpy env results through preallocated (pinned on cuda) host buffers
+        self.pinned_transfer = self.config.get('pinned_transfer', False)
+        self.transfer_manager = transfer.TransferManager(self.ppo_device) if self.pinned_transfer else None
+        # rollout storage is allocated actors first, so the batch is built without copies
+        self.actor_major_buffers = self.config.get('actor_major_buffers', False)
+        # split actors into groups and step one group while the policy runs on the other ones
+        self.pipelined_rollout = self.config.get('pipelined_rollout', False)
+        self.num_rollout_groups = self.config.get('num_rollout_groups', 2)
+        self.rollout_overlap = 0
+        # vec env returns partial batches of the envs which finished first (envpool async), see play_steps_async
+        self.partial_batches = self.vec_env is not None and self.vec_env.has_partial_batches()
+        # vec env masks out transitions of stragglers (RAY with step_timeout), masks are used in GAE and the losses
+        self.use_step_masks = self.vec_env is not None and self.vec_env.has_step_masks()
+        # envs with dropped transitions since their last written row and the number of dropped transitions in the rollout
+        self.dropped_envs = np.zeros(self.num_actors, dtype=bool)
+        self.dropped_steps = 0
         self.normalize_advantage = config['normalize_advantage']
         self.normalize_rms_advantage = config.get('normalize_rms_advantage', False)
         self.normalize_input = self.config['normalize_input']
@@ -216,17 +238,25 @@ class A2CBase(BaseAlgorithm):
                 self.obs_shape[k] = v.shape
         else:
             self.obs_shape = self.observation_space.shape
+        # obs key -> compression of obs sent by the vec env workers, obs are decompressed in _preproc_obs
+        self.obs_compression = self.env_info.get('obs_compression')
  
         self.critic_coef = config['critic_coef']
         self.grad_norm = config['grad_norm']
         self.gamma = self.config['gamma']
         self.tau = self.config['tau']
+        # 'scripted', 'chunked' or 'loop'
+        self.gae_engine = self.config.get('gae_engine', 'scripted')
+        gae_kwargs = {}
+        if self.gae_engine == 'chunked':
+            gae_kwargs['chunk_size'] = self.config.get('gae_chunk_size', 16)
+        self.advantage_estimator = advantages.create_advantage_estimator(self.gae_engine, self.gamma, self.tau, **gae_kwargs)
 
         self.games_to_track = self.config.get('games_to_track', 100)
         print('current training device:', self.ppo_device)
-        self.game_rewards = torch_ext.AverageMeter(self.value_size, self.games_to_track).to(self.ppo_device)
-        self.game_shaped_rewards = torch_ext.AverageMeter(self.value_size, self.games_to_track).to(self.ppo_device)
-        self.game_lengths = torch_ext.AverageMeter(1, self.games_to_track).to(self.ppo_device)
+        self.game_rewards = torch_ext.RingAverageMeter(self.value_size, self.games_to_track).to(self.ppo_device)
+        self.game_shaped_rewards = torch_ext.RingAverageMeter(self.value_size, self.games_to_track).to(self.ppo_device)
+        self.game_lengths = torch_ext.RingAverageMeter(1, self.games_to_track).to(self.ppo_device)
         self.obs = None
         self.games_num = self.config['minibatch_size'] // self.seq_len # it is used only for current rnn implementation
         self.batch_size = self.horizon_length * self.num_actors * self.num_agents
@@ -235,6 +265,24 @@ class A2CBase(BaseAlgorithm):
         self.minibatch_size_per_env = self.config.get('minibatch_size_per_env', 0)
         self.minibatch_size = self.config.get('minibatch_size', self.num_actors * self.minibatch_size_per_env)
         self.mini_epochs_num = self.config['mini_epochs']
+        # new permutation of the minibatches every mini-epoch instead of the same contiguous slices
+        self.shuffle_minibatches = self.config.get('shuffle_minibatches', False)
+        # prepare the next minibatch on a side cuda stream or a worker thread while the current one is trained
+        self.prefetch_minibatches = self.config.get('prefetch_minibatches', False)
+        # stop the update once the kl of the current mini-epoch exceeds target_kl, checked after every minibatch or mini-epoch
+        self.target_kl = self.config.get('target_kl', None)
+        self.target_kl_check = self.config.get('target_kl_check', 'mini_epoch')
+        assert self.target_kl_check in ['minibatch', 'mini_epoch']
+        # minibatch updates of the last epoch skipped by target_kl and the estimated update time they would have taken
+        self.kl_skipped_minibatches = 0
+        self.kl_saved_update_time = 0
+        # split minibatches into micro batches and accumulate their gradients: micro_batch_size transitions, or on cuda
+        # as many as fit into micro_batch_memory_budget megabytes, measured on the first minibatch
+        self.micro_batch_size = self.config.get('micro_batch_size', None)
+        self.micro_batch_memory_budget = self.config.get('micro_batch_memory_budget', None)
+        if self.micro_batch_memory_budget is not None and self.micro_batch_size is None and not str(self.ppo_device).startswith('cuda'):
+            print('micro_batch_memory_budget is supported on cuda only, minibatches are not split')
+            self.micro_batch_memory_budget = None
         self.num_minibatches = self.batch_size // self.minibatch_size
         assert(self.batch_size % self.minibatch_size == 0)
 
@@ -246,6 +294,7 @@ class A2CBase(BaseAlgorithm):
         self.update_time = 0
         self.mean_rewards = self.last_mean_rewards = -100500
         self.play_time = 0
+        self.gae_time = 0
         self.epoch_num = 0
         self.curr_frames = 0
         # allows us to specify a folder where all experiments will reside
@@ -263,6 +312,15 @@ class A2CBase(BaseAlgorithm):
         os.makedirs(self.nn_dir, exist_ok=True)
         os.makedirs(self.summaries_dir, exist_ok=True)
 
+        self.use_profiler = self.config.get('use_profiler', False)
+        if self.use_profiler and self.global_rank == 0:
+            trace_path = None
+            if self.config.get('profiler_trace', False):
+                trace_path = os.path.join(self.experiment_dir, 'profiler_trace.json')
+            self.profiler = TimelineProfiler(sync_cuda=self.config.get('profiler_sync_cuda', False), trace_path=trace_path)
+        else:
+            self.profiler = DefaultProfiler()
+
         self.entropy_coef = self.config['entropy_coef']
 
         if self.global_rank == 0:
@@ -295,6 +353,7 @@ class A2CBase(BaseAlgorithm):
         if self.has_self_play_config:
             print('Initializing SelfPlay Manager')
             self.self_play_manager = SelfPlayManager(self.self_play_config, self.writer)
+            self.self_play_manager.init_opponents(self)
 
         # features
         self.algo_observer = config['features']['observer']
@@ -306,28 +365,30 @@ class A2CBase(BaseAlgorithm):
 
     def trancate_gradients_and_step(self):
         if self.multi_gpu:
-            # batch allreduce ops: see https://github.com/entity-neural-network/incubator/pull/220
-            all_grads_list = []
-            for param in self.model.parameters():
-                if param.grad is not None:
-                    all_grads_list.append(param.grad.view(-1))
-
-            all_grads = torch.cat(all_grads_list)
-            dist.all_reduce(all_grads, op=dist.ReduceOp.SUM)
-            offset = 0
-            for param in self.model.parameters():
-                if param.grad is not None:
-                    param.grad.data.copy_(
-                        all_grads[offset : offset + param.numel()].view_as(param.grad.data) / self.world_size
-                    )
-                    offset += param.numel()
-
-        if self.truncate_grads:
-            self.scaler.unscale_(self.optimizer)
-            nn.utils.clip_grad_norm_(self.model.parameters(), self.grad_norm)
-
-        self.scaler.step(self.optimizer)
-        self.scaler.update()
+            with self.profiler.scope('all_reduce'):
+                # batch allreduce ops: see https://github.com/entity-neural-network/incubator/pull/220
+                all_grads_list = []
+                for param in self.model.parameters():
+                    if param.grad is not None:
+                        all_grads_list.append(param.grad.view(-1))
+
+                all_grads = torch.cat(all_grads_list)
+                dist.all_reduce(all_grads, op=dist.ReduceOp.SUM)
+                offset = 0
+                for param in self.model.parameters():
+                    if param.grad is not None:
+                        param.grad.data.copy_(
+                            all_grads[offset : offset + param.numel()].view_as(param.grad.data) / self.world_size
+                        )
+                        offset += param.numel()
+
+        with self.profiler.scope('optimizer_step'):
+            if self.truncate_grads:
+                self.scaler.unscale_(self.optimizer)
+                nn.utils.clip_grad_norm_(self.model.parameters(), self.grad_norm)
+
+            self.scaler.step(self.optimizer)
+            self.scaler.update()
 
     def load_networks(self, params):
         builder = model_builder.ModelBuilder()
@@ -343,12 +404,27 @@ class A2CBase(BaseAlgorithm):
     def write_stats(self, total_time, epoch_num, step_time, play_time, update_time, a_losses, c_losses, entropies, kls, last_lr, lr_mul, frame, scaled_time, scaled_play_time, curr_frames):
         # do we need scaled time?
         self.diagnostics.send_info(self.writer)
+        self.profiler.send_info(self.writer, frame)
         self.writer.add_scalar('performance/step_inference_rl_update_fps', curr_frames / scaled_time, frame)
         self.writer.add_scalar('performance/step_inference_fps', curr_frames / scaled_play_time, frame)
         self.writer.add_scalar('performance/step_fps', curr_frames / step_time, frame)
         self.writer.add_scalar('performance/rl_update_time', update_time, frame)
         self.writer.add_scalar('performance/step_inference_time', play_time, frame)
         self.writer.add_scalar('performance/step_time', step_time, frame)
+        self.writer.add_scalar('performance/gae_time', self.gae_time, frame)
+        if self.pipelined_rollout:
+            self.writer.add_scalar('performance/rollout_overlap', self.rollout_overlap, frame)
+        if self.partial_batches:
+            self.writer.add_scalar('performance/dropped_steps', self.dropped_steps, frame)
+        if self.use_step_masks:
+            self.writer.add_scalar('performance/masked_steps', 1.0 - self.experience_buffer.tensor_dict['step_masks'].mean().item(), frame)
+        if self.vec_env is not None:
+            # i.e. per worker step latencies of RAY with step_timeout
+            for name, value in self.vec_env.get_step_stats().items():
+                if np.ndim(value) > 0:
+                    self.writer.add_histogram(f'vecenv/{name}', value, frame)
+                else:
+                    self.writer.add_scalar(f'vecenv/{name}', value, frame)
         self.writer.add_scalar('losses/a_loss', torch_ext.mean_list(a_losses).item(), frame)
         self.writer.add_scalar('losses/c_loss', torch_ext.mean_list(c_losses).item(), frame)
 
@@ -357,9 +433,106 @@ class A2CBase(BaseAlgorithm):
         self.writer.add_scalar('info/lr_mul', lr_mul, frame)
         self.writer.add_scalar('info/e_clip', self.e_clip * lr_mul, frame)
         self.writer.add_scalar('info/kl', torch_ext.mean_list(kls).item(), frame)
+        if self.target_kl is not None:
+            self.writer.add_scalar('info/kl_skipped_minibatches', self.kl_skipped_minibatches, frame)
+            self.writer.add_scalar('performance/kl_saved_update_time', self.kl_saved_update_time, frame)
         self.writer.add_scalar('info/epochs', epoch_num, frame)
         self.algo_observer.after_print_stats(frame, epoch_num, total_time)
 
+    def kl_above_target(self, kls):
+        '''
+        Compares the mean of kls with target_kl. The mean is averaged over the ranks, so all of them stop at the same minibatch.
+        '''
+        av_kls = torch_ext.mean_list(kls)
+        if self.multi_gpu:
+            dist.all_reduce(av_kls, op=dist.ReduceOp.SUM)
+            av_kls /= self.world_size
+        return av_kls.item() > self.target_kl
+
+    def update_kl_early_stop_stats(self, num_updates, updates_time):
+        num_skipped = self.mini_epochs_num * len(self.minibatches) - num_updates
+        self.kl_skipped_minibatches = num_skipped
+        self.kl_saved_update_time = updates_time / num_updates * num_skipped
+
+    def _micro_batch_slice(self, input_dict, start, end):
+        micro_dict = {}
+        for k, v in input_dict.items():
+            if k == 'rnn_states':
+                micro_dict[k] = [s[:, start // self.seq_len:end // self.seq_len, :].contiguous() for s in v]
+            elif isinstance(v, dict):
+                micro_dict[k] = {kd : vd[start:end] for kd, vd in v.items()}
+            elif isinstance(v, torch.Tensor):
+                micro_dict[k] = v[start:end]
+            else:
+                micro_dict[k] = v
+        return micro_dict
+
+    def _get_micro_batch_size(self, minibatch_size):
+        # rnn micro batches are whole sequences
+        unit = self.seq_len if self.is_rnn else 1
+        if self.micro_batch_size is not None:
+            assert self.micro_batch_size % unit == 0, 'micro_batch_size must be a multiple of seq_length'
+            return self.micro_batch_size
+        if self.micro_batch_memory_budget is not None:
+            # probe size for the memory measurement
+            return max(unit, minibatch_size // 8 // unit * unit)
+        return minibatch_size
+
+    def _set_micro_batch_size(self, probe_size, probe_memory):
+        unit = self.seq_len if self.is_rnn else 1
+        bytes_per_transition = max(probe_memory, 1) / probe_size
+        budget = self.micro_batch_memory_budget * 1024 * 1024
+        self.micro_batch_size = max(unit, int(budget / bytes_per_transition) // unit * unit)
+        print(f'micro batch size: {self.micro_batch_size}, {bytes_per_transition / 1024:.1f} KB per transition')
+
+    def accumulate_gradients(self, input_dict):
+        '''
+        Runs calc_losses over micro batches of the minibatch and accumulates the gradients of their losses, weighted with
+        their share of the minibatch. Minibatch losses are means over its transitions, so the gradients are the ones of the
+        unsplit minibatch. Scalar outputs of calc_losses are summed with the same weights, per transition outputs are
+        concatenated, so KL and diagnostics are computed on the whole minibatch as well.
+        '''
+        minibatch_size = input_dict['returns'].size(0)
+        micro_batch_size = self._get_micro_batch_size(minibatch_size)
+        if micro_batch_size >= minibatch_size:
+            loss, outputs = self.calc_losses(input_dict)
+            with self.profiler.scope('backward'):
+                self.scaler.scale(loss).backward()
+            return outputs
+
+        normalize_input = self.normalize_input and self.model.running_mean_std.training
+        if normalize_input:
+            # running statistics are updated once with the whole minibatch, every micro batch is normalized with them
+            with torch.no_grad():
+                self.model.running_mean_std(input_dict['processed_obs'])
+            self.model.running_mean_std.eval()
+        measure_memory = self.micro_batch_size is None
+        weights, micro_outputs = [], []
+        for start in range(0, minibatch_size, micro_batch_size):
+            end = min(start + micro_batch_size, minibatch_size)
+            if measure_memory:
+                torch.cuda.reset_peak_memory_stats(self.ppo_device)
+                memory_start = torch.cuda.memory_allocated(self.ppo_device)
+            loss, outputs = self.calc_losses(self._micro_batch_slice(input_dict, start, end))
+            weight = (end - start) / minibatch_size
+            with self.profiler.scope('backward'):
+                self.scaler.scale(loss * weight).backward()
+            if measure_memory:
+                self._set_micro_batch_size(end - start, torch.cuda.max_memory_allocated(self.ppo_device) - memory_start)
+                measure_memory = False
+            weights.append(weight)
+            micro_outputs.append({k : v.detach() for k, v in outputs.items()})
+        if normalize_input:
+            self.model.running_mean_std.train()
+
+        outputs = {}
+        for k, v in micro_outputs[0].items():
+            if v.dim() == 0:
+                outputs[k] = sum(weight * micro[k] for weight, micro in zip(weights, micro_outputs))
+            else:
+                outputs[k] = torch.cat([micro[k] for micro in micro_outputs])
+        return outputs
+
     def set_eval(self):
         self.model.eval()
         if self.normalize_rms_advantage:
@@ -442,9 +615,17 @@ class A2CBase(BaseAlgorithm):
             'num_actors' : self.num_actors,
             'horizon_length' : self.horizon_length,
             'has_central_value' : self.has_central_value,
-            'use_action_masks' : self.use_action_masks
+            'use_action_masks' : self.use_action_masks,
+            'actor_major' : self.actor_major_buffers,
+            'partial_batches' : self.partial_batches,
+            'step_masks' : self.use_step_masks,
         }
-        self.experience_buffer = ExperienceBuffer(self.env_info, algo_info, self.ppo_device)
+        buffer_env_info = self.env_info
+        if self.obs_compression is not None:
+            # obs are stored compressed
+            buffer_env_info = dict(self.env_info)
+            buffer_env_info['observation_space'] = obs_compression.compressed_space(self.observation_space, self.obs_compression)
+        self.experience_buffer = ExperienceBuffer(buffer_env_info, algo_info, self.ppo_device)
 
         val_shape = (self.horizon_length, batch_size, self.value_size)
         current_rewards_shape = (batch_size, self.value_size)
@@ -462,16 +643,43 @@ class A2CBase(BaseAlgorithm):
             assert((self.horizon_length * total_agents // self.num_minibatches) % self.seq_len == 0)
             self.mb_rnn_states = [torch.zeros((num_seqs, s.size()[0], total_agents, s.size()[2]), dtype = torch.float32, device=self.ppo_device) for s in self.rnn_states]
 
+        if self.pipelined_rollout:
+            assert self.vec_env.has_async_step(), 'pipelined_rollout requires vec env with step_async/step_wait support'
+            assert self.num_actors % self.num_rollout_groups == 0, 'num_actors should be divisible by num_rollout_groups'
+            assert not self.use_action_masks, 'pipelined_rollout does not support action masks'
+            assert not (self.has_central_value and self.central_value_net.is_rnn), 'pipelined_rollout does not support rnn central value'
+
+        if self.partial_batches:
+            assert not self.is_rnn, 'partial batches rollout does not support rnn'
+            assert not self.has_central_value, 'partial batches rollout does not support central value'
+            assert not self.use_action_masks, 'partial batches rollout does not support action masks'
+            assert not self.pipelined_rollout, 'partial batches rollout can not be used with pipelined_rollout'
+            assert not self.actor_major_buffers, 'partial batches rollout can not be used with actor_major_buffers'
+            assert self.num_agents == 1, 'partial batches rollout does not support multi agent envs'
+
+        if self.use_step_masks:
+            assert not self.pipelined_rollout, 'step masks (step_timeout) can not be used with pipelined_rollout'
+
     def init_rnn_from_model(self, model):
         self.is_rnn = self.model.is_rnn()
 
-    def cast_obs(self, obs):
+    def cast_obs(self, obs, key='obs'):
         if isinstance(obs, torch.Tensor):
             self.is_tensor_obses = True
         elif isinstance(obs, np.ndarray):
             assert(obs.dtype != np.int8)
-            if obs.dtype == np.uint8:
+            # compressed obs keep their dtype over the transfer, they are decompressed on the device in _preproc_obs
+            is_compressed = self.obs_compression is not None and key.split('/')[-1] in self.obs_compression
+            if self.transfer_manager is not None:
+                if obs.dtype == np.uint8 or is_compressed:
+                    dtype = torch_ext.numpy_to_torch_dtype_dict[obs.dtype]
+                else:
+                    dtype = torch.float32
+                obs = self.transfer_manager.to_device(key, obs, dtype)
+            elif obs.dtype == np.uint8:
                 obs = torch.ByteTensor(obs).to(self.ppo_device)
+            elif is_compressed:
+                obs = torch.tensor(obs, device=self.ppo_device)
             else:
                 obs = torch.FloatTensor(obs).to(self.ppo_device)
         return obs
@@ -481,31 +689,38 @@ class A2CBase(BaseAlgorithm):
         if obs_is_dict:
             upd_obs = {}
             for key, value in obs.items():
-                upd_obs[key] = self._obs_to_tensors_internal(value)
+                upd_obs[key] = self._obs_to_tensors_internal(value, key)
         else:
             upd_obs = self.cast_obs(obs)
         if not obs_is_dict or 'obs' not in obs:    
             upd_obs = {'obs' : upd_obs}
         return upd_obs
 
-    def _obs_to_tensors_internal(self, obs):
+    def _obs_to_tensors_internal(self, obs, key='obs'):
         if isinstance(obs, dict):
             upd_obs = {}
-            for key, value in obs.items():
-                upd_obs[key] = self._obs_to_tensors_internal(value)
+            for k, value in obs.items():
+                upd_obs[k] = self._obs_to_tensors_internal(value, key + '/' + k)
         else:
-            upd_obs = self.cast_obs(obs)
+            upd_obs = self.cast_obs(obs, key)
         return upd_obs
 
     def preprocess_actions(self, actions):
         if not self.is_tensor_obses:
-            actions = actions.cpu().numpy()
+            if self.transfer_manager is not None:
+                actions = self.transfer_manager.to_host('actions', actions)
+            else:
+                actions = actions.cpu().numpy()
         return actions
 
     def env_step(self, actions):
         actions = self.preprocess_actions(actions)
-        obs, rewards, dones, infos = self.vec_env.step(actions)
+        with self.profiler.scope('vec_env_step'):
+            obs, rewards, dones, infos = self.vec_env.step(actions)
+        with self.profiler.scope('to_device'):
+            return self.env_step_results(obs, rewards, dones, infos)
 
+    def env_step_results(self, obs, rewards, dones, infos):
         if self.is_tensor_obses:
             if self.value_size == 1:
                 rewards = rewards.unsqueeze(1)
@@ -513,45 +728,41 @@ class A2CBase(BaseAlgorithm):
         else:
             if self.value_size == 1:
                 rewards = np.expand_dims(rewards, axis=1)
+            if self.transfer_manager is not None:
+                return self.obs_to_tensors(obs), self.transfer_manager.to_device('rewards', rewards, torch.float32), self.transfer_manager.to_device('dones', dones), infos
             return self.obs_to_tensors(obs), torch.from_numpy(rewards).to(self.ppo_device).float(), torch.from_numpy(dones).to(self.ppo_device), infos
 
     def env_reset(self):
+        if self.partial_batches:
+            # first observations are returned by recv in play_steps_async
+            self.vec_env.async_reset()
+            return None
         obs = self.vec_env.reset()
         obs = self.obs_to_tensors(obs)
         return obs
 
-    def discount_values(self, fdones, last_extrinsic_values, mb_fdones, mb_extrinsic_values, mb_rewards):
-        lastgaelam = 0
-        mb_advs = torch.zeros_like(mb_rewards)
-
-        for t in reversed(range(self.horizon_length)):
-            if t == self.horizon_length - 1:
-                nextnonterminal = 1.0 - fdones
-                nextvalues = last_extrinsic_values
-            else:
-                nextnonterminal = 1.0 - mb_fdones[t+1]
-                nextvalues = mb_extrinsic_values[t+1]
-            nextnonterminal = nextnonterminal.unsqueeze(1)
+    def gae_clock(self):
+        # gae kernels run asynchronously, synchronize so performance/gae_time is not only the launch time
+        if torch.device(self.ppo_device).type == 'cuda':
+            torch.cuda.synchronize(self.ppo_device)
+        return time.time()
 
-            delta = mb_rewards[t] + self.gamma * nextvalues * nextnonterminal - mb_extrinsic_values[t]
-            mb_advs[t] = lastgaelam = delta + self.gamma * self.tau * nextnonterminal * lastgaelam
-        return mb_advs
+    def discount_values(self, fdones, last_extrinsic_values, mb_fdones, mb_extrinsic_values, mb_rewards):
+        return self.advantage_estimator.discount_values(fdones, last_extrinsic_values, mb_fdones, mb_extrinsic_values, mb_rewards)
 
     def discount_values_masks(self, fdones, last_extrinsic_values, mb_fdones, mb_extrinsic_values, mb_rewards, mb_masks):
-        lastgaelam = 0
-        mb_advs = torch.zeros_like(mb_rewards)
-        for t in reversed(range(self.horizon_length)):
-            if t == self.horizon_length - 1:
-                nextnonterminal = 1.0 - fdones
-                nextvalues = last_extrinsic_values
-            else:
-                nextnonterminal = 1.0 - mb_fdones[t+1]
-                nextvalues = mb_extrinsic_values[t+1]
-            nextnonterminal = nextnonterminal.unsqueeze(1)
-            masks_t = mb_masks[t].unsqueeze(1)
-            delta = (mb_rewards[t] + self.gamma * nextvalues * nextnonterminal  - mb_extrinsic_values[t])
-            mb_advs[t] = lastgaelam = (delta + self.gamma * self.tau * nextnonterminal * lastgaelam) * masks_t
-        return mb_advs
+        return self.advantage_estimator.discount_values_masks(fdones, last_extrinsic_values, mb_fdones, mb_extrinsic_values, mb_rewards, mb_masks)
+
+    def update_game_stats(self, dones, infos, current_rewards, current_shaped_rewards, current_lengths):
+        # finished games are written with masks, done indices are computed only if the observer needs them
+        env_dones = dones[::self.num_agents]
+        self.game_rewards.update_masked(current_rewards[::self.num_agents], env_dones)
+        self.game_shaped_rewards.update_masked(current_shaped_rewards[::self.num_agents], env_dones)
+        self.game_lengths.update_masked(current_lengths[::self.num_agents], env_dones)
+        env_done_indices = None
+        if self.algo_observer.needs_done_indices(infos):
+            env_done_indices = dones.nonzero(as_tuple=False)[::self.num_agents]
+        self.algo_observer.process_infos(infos, env_done_indices)
 
     def clear_stats(self):
         batch_size = self.num_agents * self.num_actors
@@ -565,6 +776,13 @@ class A2CBase(BaseAlgorithm):
         pass
 
     def train(self):
+        try:
+            return self.train_loop()
+        finally:
+            # the trace file is closed however training ends
+            self.profiler.close()
+
+    def train_loop(self):
         pass
 
     def prepare_dataset(self, batch_dict):
@@ -579,12 +797,41 @@ class A2CBase(BaseAlgorithm):
     def calc_gradients(self):
         pass
 
+    def calc_losses(self, input_dict):
+        '''
+        Forward pass of a minibatch or a micro batch of it. Returns the loss, a mean over its transitions, and a dict of outputs.
+        '''
+        pass
+
     def get_central_value(self, obs_dict):
         return self.central_value_net.get_value(obs_dict)
 
     def train_central_value(self):
         return self.central_value_net.train_net()
 
+    def start_fused_central_value(self):
+        self.central_value_steps = self.central_value_net.train_steps()
+        self.num_central_value_steps = self.central_value_net.num_train_steps()
+        self.central_value_steps_done = 0
+
+    def step_fused_central_value(self, actor_steps_done):
+        '''
+        Runs the central value updates due after actor_steps_done actor minibatches, so both finish together.
+        '''
+        num_actor_steps = self.mini_epochs_num * len(self.minibatches)
+        target_steps = actor_steps_done * self.num_central_value_steps // num_actor_steps
+        with self.profiler.scope('central_value'):
+            while self.central_value_steps_done < target_steps:
+                next(self.central_value_steps)
+                self.central_value_steps_done += 1
+
+    def finish_fused_central_value(self):
+        # remaining updates if the actor stopped early (target_kl) and the end of the central value epoch
+        with self.profiler.scope('central_value'):
+            for _ in self.central_value_steps:
+                pass
+        self.central_value_steps = None
+
     def get_full_state_weights(self):
         state = self.get_weights()
         state['epoch'] = self.epoch_num
@@ -652,6 +899,8 @@ class A2CBase(BaseAlgorithm):
         self.set_stats_weights(weights)
 
     def _preproc_obs(self, obs_batch):
+        if self.obs_compression is not None:
+            obs_batch = obs_compression.decompress_obs(obs_batch, self.obs_compression, self.observation_space)
         if type(obs_batch) is dict:
             obs_batch = copy.copy(obs_batch)
             for k,v in obs_batch.items():
@@ -664,65 +913,85 @@ class A2CBase(BaseAlgorithm):
                 obs_batch = obs_batch.float() / 255.0
         return obs_batch
 
-    def play_steps(self):
+    def collect_rollout(self):
+        '''
+        Steps vec_env for horizon_length steps and writes the transitions to the experience buffer.
+        Returns the time spent in env steps, values and returns are computed by play_steps.
+        '''
         update_list = self.update_list
 
         step_time = 0.0
 
         for n in range(self.horizon_length):
-            if self.use_action_masks:
-                masks = self.vec_env.get_action_masks()
-                res_dict = self.get_masked_action_values(self.obs, masks)
-            else:
-                res_dict = self.get_action_values(self.obs)
-            self.experience_buffer.update_data('obses', n, self.obs['obs'])
-            self.experience_buffer.update_data('dones', n, self.dones)
+            with self.profiler.scope('inference'):
+                if self.use_action_masks:
+                    masks = self.vec_env.get_action_masks()
+                    res_dict = self.get_masked_action_values(self.obs, masks)
+                else:
+                    res_dict = self.get_action_values(self.obs)
+            with self.profiler.scope('buffer_write'):
+                self.experience_buffer.update_data('obses', n, self.obs['obs'])
+                self.experience_buffer.update_data('dones', n, self.dones)
 
-            for k in update_list:
-                self.experience_buffer.update_data(k, n, res_dict[k]) 
-            if self.has_central_value:
-                self.experience_buffer.update_data('states', n, self.obs['states'])
+                for k in update_list:
+                    self.experience_buffer.update_data(k, n, res_dict[k]) 
+                if self.has_central_value:
+                    self.experience_buffer.update_data('states', n, self.obs['states'])
 
             step_time_start = time.time()
-            self.obs, rewards, self.dones, infos = self.env_step(res_dict['actions'])
+            with self.profiler.scope('env_step'):
+                self.obs, rewards, self.dones, infos = self.env_step(res_dict['actions'])
             step_time_end = time.time()
+            if self.use_step_masks:
+                self.experience_buffer.update_data('step_masks', n, torch.from_numpy(self.vec_env.get_step_masks()).to(self.ppo_device).float())
 
             step_time += (step_time_end - step_time_start)
 
             shaped_rewards = self.rewards_shaper(rewards)
             if self.value_bootstrap and 'time_outs' in infos:
-                shaped_rewards += self.gamma * res_dict['values'] * self.cast_obs(infos['time_outs']).unsqueeze(1).float()
+                shaped_rewards += self.gamma * res_dict['values'] * self.cast_obs(infos['time_outs'], 'time_outs').unsqueeze(1).float()
 
-            self.experience_buffer.update_data('rewards', n, shaped_rewards)
+            with self.profiler.scope('buffer_write'):
+                self.experience_buffer.update_data('rewards', n, shaped_rewards)
 
-            self.current_rewards += rewards
-            self.current_shaped_rewards += shaped_rewards
-            self.current_lengths += 1
-            all_done_indices = self.dones.nonzero(as_tuple=False)
-            env_done_indices = all_done_indices[::self.num_agents]
-     
-            self.game_rewards.update(self.current_rewards[env_done_indices])
-            self.game_shaped_rewards.update(self.current_shaped_rewards[env_done_indices])
-            self.game_lengths.update(self.current_lengths[env_done_indices])
-            self.algo_observer.process_infos(infos, env_done_indices)
+            with self.profiler.scope('episode_stats'):
+                self.current_rewards += rewards
+                self.current_shaped_rewards += shaped_rewards
+                self.current_lengths += 1
+                self.update_game_stats(self.dones, infos, self.current_rewards, self.current_shaped_rewards, self.current_lengths)
 
-            not_dones = 1.0 - self.dones.float()
+                not_dones = 1.0 - self.dones.float()
+
+                self.current_rewards = self.current_rewards * not_dones.unsqueeze(1)
+                self.current_shaped_rewards = self.current_shaped_rewards * not_dones.unsqueeze(1)
+                self.current_lengths = self.current_lengths * not_dones
 
-            self.current_rewards = self.current_rewards * not_dones.unsqueeze(1)
-            self.current_shaped_rewards = self.current_shaped_rewards * not_dones.unsqueeze(1)
-            self.current_lengths = self.current_lengths * not_dones
+        return step_time
 
-        last_values = self.get_values(self.obs)
+    def play_steps(self):
+        step_time = self.collect_rollout()
+
+        with self.profiler.scope('inference'):
+            last_values = self.get_values(self.obs)
 
         fdones = self.dones.float()
         mb_fdones = self.experience_buffer.tensor_dict['dones'].float()
         mb_values = self.experience_buffer.tensor_dict['values']
         mb_rewards = self.experience_buffer.tensor_dict['rewards']
-        mb_advs = self.discount_values(fdones, last_values, mb_fdones, mb_values, mb_rewards)
+        gae_start = self.gae_clock()
+        with self.profiler.scope('gae'):
+            if self.use_step_masks:
+                mb_masks = self.experience_buffer.tensor_dict['step_masks']
+                mb_advs = self.discount_values_masks(fdones, last_values, mb_fdones, mb_values, mb_rewards, mb_masks)
+            else:
+                mb_advs = self.discount_values(fdones, last_values, mb_fdones, mb_values, mb_rewards)
+        self.gae_time = self.gae_clock() - gae_start
         mb_returns = mb_advs + mb_values
 
         batch_dict = self.experience_buffer.get_transformed_list(swap_and_flatten01, self.tensor_list)
         batch_dict['returns'] = swap_and_flatten01(mb_returns)
+        if self.use_step_masks:
+            batch_dict['rnn_masks'] = swap_and_flatten01(mb_masks)
         batch_dict['played_frames'] = self.batch_size
         batch_dict['step_time'] = step_time
 
@@ -741,68 +1010,78 @@ class A2CBase(BaseAlgorithm):
             if self.has_central_value:
                 self.central_value_net.pre_step_rnn(n)
 
-            if self.use_action_masks:
-                masks = self.vec_env.get_action_masks()
-                res_dict = self.get_masked_action_values(self.obs, masks)
-            else:
-                res_dict = self.get_action_values(self.obs)
+            with self.profiler.scope('inference'):
+                if self.use_action_masks:
+                    masks = self.vec_env.get_action_masks()
+                    res_dict = self.get_masked_action_values(self.obs, masks)
+                else:
+                    res_dict = self.get_action_values(self.obs)
             self.rnn_states = res_dict['rnn_states']
-            self.experience_buffer.update_data('obses', n, self.obs['obs'])
-            self.experience_buffer.update_data('dones', n, self.dones.byte())
+            with self.profiler.scope('buffer_write'):
+                self.experience_buffer.update_data('obses', n, self.obs['obs'])
+                self.experience_buffer.update_data('dones', n, self.dones.byte())
 
-            for k in update_list:
-                self.experience_buffer.update_data(k, n, res_dict[k])
-            if self.has_central_value:
-                self.experience_buffer.update_data('states', n, self.obs['states'])
+                for k in update_list:
+                    self.experience_buffer.update_data(k, n, res_dict[k])
+                if self.has_central_value:
+                    self.experience_buffer.update_data('states', n, self.obs['states'])
 
             step_time_start = time.time()
-            self.obs, rewards, self.dones, infos = self.env_step(res_dict['actions'])
+            with self.profiler.scope('env_step'):
+                self.obs, rewards, self.dones, infos = self.env_step(res_dict['actions'])
             step_time_end = time.time()
+            if self.use_step_masks:
+                self.experience_buffer.update_data('step_masks', n, torch.from_numpy(self.vec_env.get_step_masks()).to(self.ppo_device).float())
 
             step_time += (step_time_end - step_time_start)
 
             shaped_rewards = self.rewards_shaper(rewards)
 
             if self.value_bootstrap and 'time_outs' in infos:
-                shaped_rewards += self.gamma * res_dict['values'] * self.cast_obs(infos['time_outs']).unsqueeze(1).float()
+                shaped_rewards += self.gamma * res_dict['values'] * self.cast_obs(infos['time_outs'], 'time_outs').unsqueeze(1).float()
 
-            self.experience_buffer.update_data('rewards', n, shaped_rewards)
+            with self.profiler.scope('buffer_write'):
+                self.experience_buffer.update_data('rewards', n, shaped_rewards)
 
             self.current_rewards += rewards
             self.current_shaped_rewards += shaped_rewards
             self.current_lengths += 1
-            all_done_indices = self.dones.nonzero(as_tuple=False)
-            env_done_indices = all_done_indices[::self.num_agents]
+            not_dones = 1.0 - self.dones.float()
 
-            if len(all_done_indices) > 0:
-                if self.zero_rnn_on_done:
-                    for s in self.rnn_states:
-                        s[:, all_done_indices, :] = s[:, all_done_indices, :] * 0.0
-                if self.has_central_value:
-                    self.central_value_net.post_step_rnn(all_done_indices)
+            if self.zero_rnn_on_done:
+                for s in self.rnn_states:
+                    s.mul_(not_dones.view(1, -1, 1))
+            if self.has_central_value:
+                self.central_value_net.post_step_rnn(self.dones)
 
-            self.game_rewards.update(self.current_rewards[env_done_indices])
-            self.game_shaped_rewards.update(self.current_shaped_rewards[env_done_indices])
-            self.game_lengths.update(self.current_lengths[env_done_indices])
-            self.algo_observer.process_infos(infos, env_done_indices)
+            with self.profiler.scope('episode_stats'):
+                self.update_game_stats(self.dones, infos, self.current_rewards, self.current_shaped_rewards, self.current_lengths)
 
-            not_dones = 1.0 - self.dones.float()
+                self.current_rewards = self.current_rewards * not_dones.unsqueeze(1)
+                self.current_shaped_rewards = self.current_shaped_rewards * not_dones.unsqueeze(1)
+                self.current_lengths = self.current_lengths * not_dones
 
-            self.current_rewards = self.current_rewards * not_dones.unsqueeze(1)
-            self.current_shaped_rewards = self.current_shaped_rewards * not_dones.unsqueeze(1)
-            self.current_lengths = self.current_lengths * not_dones
-
-        last_values = self.get_values(self.obs)
+        with self.profiler.scope('inference'):
+            last_values = self.get_values(self.obs)
 
         fdones = self.dones.float()
         mb_fdones = self.experience_buffer.tensor_dict['dones'].float()
 
         mb_values = self.experience_buffer.tensor_dict['values']
         mb_rewards = self.experience_buffer.tensor_dict['rewards']
-        mb_advs = self.discount_values(fdones, last_values, mb_fdones, mb_values, mb_rewards)
+        gae_start = self.gae_clock()
+        with self.profiler.scope('gae'):
+            if self.use_step_masks:
+                mb_masks = self.experience_buffer.tensor_dict['step_masks']
+                mb_advs = self.discount_values_masks(fdones, last_values, mb_fdones, mb_values, mb_rewards, mb_masks)
+            else:
+                mb_advs = self.discount_values(fdones, last_values, mb_fdones, mb_values, mb_rewards)
+        self.gae_time = self.gae_clock() - gae_start
         mb_returns = mb_advs + mb_values
         batch_dict = self.experience_buffer.get_transformed_list(swap_and_flatten01, self.tensor_list)
         batch_dict['returns'] = swap_and_flatten01(mb_returns)
+        if self.use_step_masks:
+            batch_dict['rnn_masks'] = swap_and_flatten01(mb_masks)
         batch_dict['played_frames'] = self.batch_size
         states = []
         for mb_s in mb_rnn_states:
@@ -813,6 +1092,262 @@ class A2CBase(BaseAlgorithm):
         batch_dict['step_time'] = step_time
         return batch_dict
 
+    def _obs_slice(self, obs, agent_slice, actor_slice):
+        res = {}
+        for k, v in obs.items():
+            index = actor_slice if k == 'states' else agent_slice
+            res[k] = self._tensors_slice(v, index)
+        return res
+
+    def _tensors_slice(self, value, index):
+        if isinstance(value, dict):
+            return {k : self._tensors_slice(v, index) for k, v in value.items()}
+        return value[index]
+
+    def _copy_obs_slice(self, obs, group_obs, agent_slice, actor_slice):
+        for k, v in group_obs.items():
+            index = actor_slice if k == 'states' else agent_slice
+            self._copy_tensors_slice(obs[k], v, index)
+
+    def _copy_tensors_slice(self, dst, src, index):
+        if isinstance(dst, dict):
+            for k, v in src.items():
+                self._copy_tensors_slice(dst[k], v, index)
+        else:
+            dst[index] = src
+
+    def play_steps_pipelined(self):
+        '''
+        Collects the same batch as play_steps and play_steps_rnn. Actors are split into num_rollout_groups groups,
+        a group is stepped with vec_env.step_async while the policy runs inference for the other groups.
+        rollout_overlap is the part of the env step time hidden behind inference.
+        '''
+        update_list = self.update_list
+        mb_rnn_states = self.mb_rnn_states if self.is_rnn else None
+        num_groups = self.num_rollout_groups
+        actors_per_group = self.num_actors // num_groups
+        actor_slices = [slice(g * actors_per_group, (g + 1) * actors_per_group) for g in range(num_groups)]
+        agent_slices = [slice(s.start * self.num_agents, s.stop * self.num_agents) for s in actor_slices]
+
+        step_time = 0.0
+        in_flight_time = 0.0
+        hidden_time = 0.0
+        launch_times = [0.0] * num_groups
+        group_values = [None] * num_groups
+
+        for n in range(self.horizon_length + 1):
+            for g in range(num_groups):
+                actor_slice, agent_slice = actor_slices[g], agent_slices[g]
+                if n > 0:
+                    step_time_start = time.time()
+                    with self.profiler.scope('env_step'):
+                        with self.profiler.scope('vec_env_step'):
+                            step_results = self.vec_env.step_wait(actor_slice)
+                        with self.profiler.scope('to_device'):
+                            obs, rewards, dones, infos = self.env_step_results(*step_results)
+                    step_time_end = time.time()
+
+                    step_time += (step_time_end - step_time_start)
+                    in_flight_time += (step_time_end - launch_times[g])
+                    hidden_time += (step_time_start - launch_times[g])
+
+                    shaped_rewards = self.rewards_shaper(rewards)
+                    if self.value_bootstrap and 'time_outs' in infos:
+                        shaped_rewards += self.gamma * group_values[g] * self.cast_obs(infos['time_outs'], 'time_outs').unsqueeze(1).float()
+
+                    self.experience_buffer.update_data_rnn('rewards', n - 1, agent_slice, shaped_rewards)
+                    self._copy_obs_slice(self.obs, obs, agent_slice, actor_slice)
+                    self.dones[agent_slice] = dones
+
+                    current_rewards = self.current_rewards[agent_slice]
+                    current_shaped_rewards = self.current_shaped_rewards[agent_slice]
+                    current_lengths = self.current_lengths[agent_slice]
+                    current_rewards += rewards
+                    current_shaped_rewards += shaped_rewards
+                    current_lengths += 1
+                    not_dones = 1.0 - dones.float()
+
+                    if self.is_rnn and self.zero_rnn_on_done:
+                        for s in self.rnn_states:
+                            s[:, agent_slice, :].mul_(not_dones.view(1, -1, 1))
+
+                    self.update_game_stats(dones, infos, current_rewards, current_shaped_rewards, current_lengths)
+
+                    current_rewards *= not_dones.unsqueeze(1)
+                    current_shaped_rewards *= not_dones.unsqueeze(1)
+                    current_lengths *= not_dones
+
+                if n == self.horizon_length:
+                    continue
+
+                group_obs = self._obs_slice(self.obs, agent_slice, actor_slice)
+                with self.profiler.scope('inference'):
+                    if self.is_rnn:
+                        if n % self.seq_len == 0:
+                            for s, mb_s in zip(self.rnn_states, mb_rnn_states):
+                                mb_s[n // self.seq_len, :, agent_slice, :] = s[:, agent_slice, :]
+                        all_rnn_states = self.rnn_states
+                        self.rnn_states = [s[:, agent_slice, :].contiguous() for s in all_rnn_states]
+                        res_dict = self.get_action_values(group_obs)
+                        for s, group_s in zip(all_rnn_states, res_dict['rnn_states']):
+                            s[:, agent_slice, :] = group_s
+                        self.rnn_states = all_rnn_states
+                    else:
+                        res_dict = self.get_action_values(group_obs)
+
+                self.experience_buffer.update_data_rnn('obses', n, agent_slice, group_obs['obs'])
+                self.experience_buffer.update_data_rnn('dones', n, agent_slice, self.dones[agent_slice].byte())
+                for k in update_list:
+                    self.experience_buffer.update_data_rnn(k, n, agent_slice, res_dict[k])
+                if self.has_central_value:
+                    self.experience_buffer.update_data_rnn('states', n, actor_slice, group_obs['states'])
+                group_values[g] = res_dict['values']
+
+                self.vec_env.step_async(self.preprocess_actions(res_dict['actions']), actor_slice)
+                launch_times[g] = time.time()
+
+        self.rollout_overlap = hidden_time / max(in_flight_time, 1e-9)
+        with self.profiler.scope('inference'):
+            last_values = self.get_values(self.obs)
+
+        fdones = self.dones.float()
+        mb_fdones = self.experience_buffer.tensor_dict['dones'].float()
+        mb_values = self.experience_buffer.tensor_dict['values']
+        mb_rewards = self.experience_buffer.tensor_dict['rewards']
+        gae_start = self.gae_clock()
+        with self.profiler.scope('gae'):
+            mb_advs = self.discount_values(fdones, last_values, mb_fdones, mb_values, mb_rewards)
+        self.gae_time = self.gae_clock() - gae_start
+        mb_returns = mb_advs + mb_values
+
+        batch_dict = self.experience_buffer.get_transformed_list(swap_and_flatten01, self.tensor_list)
+        batch_dict['returns'] = swap_and_flatten01(mb_returns)
+        batch_dict['played_frames'] = self.batch_size
+        if self.is_rnn:
+            states = []
+            for mb_s in mb_rnn_states:
+                t_size = mb_s.size()[0] * mb_s.size()[2]
+                h_size = mb_s.size()[3]
+                states.append(mb_s.permute(1,2,0,3).reshape(-1,t_size, h_size))
+            batch_dict['rnn_states'] = states
+        batch_dict['step_time'] = step_time
+        return batch_dict
+
+
+    def _play_partial_batch(self, env_ids, obs, rewards, dones, infos):
+        '''
+        Writes the results of envs env_ids (numpy array) at their rows of the experience buffer, runs the policy and sends
+        them the next actions. Envs which filled all rows keep stepping, their transitions are dropped until the next
+        rollout frees rows. The first dropped transition is handled like a time out: value of its observation is
+        bootstrapped into the reward of the last written row and the next written row starts with done.
+        '''
+        experience_buffer = self.experience_buffer
+        steps = experience_buffer.env_steps[env_ids]
+        full = steps >= experience_buffer.capacity
+        cut = self.dropped_envs[env_ids]
+        ids = torch.from_numpy(env_ids).to(self.ppo_device)
+        # rows are computed on the host from env_steps, env ids are never read back from the device
+        rows = experience_buffer.get_env_rows(env_ids)
+        prev_rows = rows - 1
+
+        # reward of the previous transition. There is none right after reset, and none to write for dropped transitions
+        shaped_rewards = self.rewards_shaper(rewards)
+        if self.value_bootstrap and 'time_outs' in infos:
+            prev_values = experience_buffer.get_data_envs('values', prev_rows, ids)
+            shaped_rewards += self.gamma * prev_values * self.cast_obs(infos['time_outs'], 'time_outs').unsqueeze(1).float()
+        write_rewards = (steps > 0) & ~cut
+        if write_rewards.all():
+            experience_buffer.update_data_envs('rewards', prev_rows, ids, shaped_rewards)
+        elif write_rewards.any():
+            sel = torch.from_numpy(write_rewards.nonzero()[0]).to(self.ppo_device)
+            experience_buffer.update_data_envs('rewards', prev_rows[sel], ids[sel], shaped_rewards[sel])
+
+        with self.profiler.scope('episode_stats'):
+            started = torch.from_numpy(steps > 0).to(self.ppo_device)
+            current_rewards = self.current_rewards[ids] + rewards
+            current_shaped_rewards = self.current_shaped_rewards[ids] + shaped_rewards
+            current_lengths = self.current_lengths[ids] + started.float()
+            self.update_game_stats(dones, infos, current_rewards, current_shaped_rewards, current_lengths)
+            not_dones = 1.0 - dones.float()
+            self.current_rewards[ids] = current_rewards * not_dones.unsqueeze(1)
+            self.current_shaped_rewards[ids] = current_shaped_rewards * not_dones.unsqueeze(1)
+            self.current_lengths[ids] = current_lengths * not_dones
+        self.dones[ids] = dones.byte()
+
+        with self.profiler.scope('inference'):
+            res_dict = self.get_action_values(obs)
+
+        with self.profiler.scope('buffer_write'):
+            if full.any():
+                self.dropped_steps += int(full.sum())
+                new_cut = full & ~cut
+                if new_cut.any():
+                    sel = torch.from_numpy(new_cut.nonzero()[0]).to(self.ppo_device)
+                    bootstrap = self.gamma * res_dict['values'][sel] * not_dones[sel].unsqueeze(1)
+                    last_row = experience_buffer.capacity - 1
+                    experience_buffer.tensor_dict['rewards'][last_row, ids[sel]] += bootstrap
+                    self.dropped_envs[env_ids[new_cut]] = True
+
+            write = ~full
+            if write.any():
+                sel = None if write.all() else torch.from_numpy(write.nonzero()[0]).to(self.ppo_device)
+                def select(value):
+                    return value if sel is None else self._tensors_slice(value, sel)
+                write_ids = select(ids)
+                write_rows = select(rows)
+                # rows after dropped transitions start a new trajectory
+                write_dones = select(dones.byte() | torch.from_numpy(cut).to(self.ppo_device).byte())
+                experience_buffer.update_data_envs('obses', write_rows, write_ids, select(obs['obs']))
+                experience_buffer.update_data_envs('dones', write_rows, write_ids, write_dones)
+                for k in self.update_list:
+                    experience_buffer.update_data_envs(k, write_rows, write_ids, select(res_dict[k]))
+                experience_buffer.advance_envs(env_ids[write])
+                self.dropped_envs[env_ids[write]] = False
+
+        self.vec_env.send(self.preprocess_actions(res_dict['actions']), env_ids)
+
+    def play_steps_async(self):
+        '''
+        Rollout for vec envs with partial batches (envpool async mode). recv returns the envs which finished stepping first,
+        their transitions are written at their own rows of the experience buffer and they get the next actions right away,
+        so slow envs don't gate the fast ones. The rollout ends when every env has horizon_length transitions and the
+        observation after them. Fast envs keep stepping, their extra rows start the next rollout.
+        Transitions of envs more than a horizon ahead are dropped, their number is written to tensorboard.
+        '''
+        experience_buffer = self.experience_buffer
+        step_time = 0.0
+        self.dropped_steps = 0
+
+        while not experience_buffer.envs_done():
+            step_time_start = time.time()
+            with self.profiler.scope('env_step'):
+                with self.profiler.scope('vec_env_step'):
+                    obs, rewards, dones, infos, env_ids = self.vec_env.recv()
+                with self.profiler.scope('to_device'):
+                    obs, rewards, dones, infos = self.env_step_results(obs, rewards, dones, infos)
+            step_time += time.time() - step_time_start
+            self._play_partial_batch(np.asarray(env_ids, dtype=np.int64), obs, rewards, dones, infos)
+
+        # values and dones of the observation after the last transition of every env
+        tensor_dict = experience_buffer.tensor_dict
+        last_values = tensor_dict['values'][self.horizon_length]
+        fdones = tensor_dict['dones'][self.horizon_length].float()
+        mb_fdones = tensor_dict['dones'][:self.horizon_length].float()
+        mb_values = tensor_dict['values'][:self.horizon_length]
+        mb_rewards = tensor_dict['rewards'][:self.horizon_length]
+        gae_start = self.gae_clock()
+        with self.profiler.scope('gae'):
+            mb_advs = self.discount_values(fdones, last_values, mb_fdones, mb_values, mb_rewards)
+        self.gae_time = self.gae_clock() - gae_start
+        mb_returns = mb_advs + mb_values
+
+        batch_dict = experience_buffer.get_transformed_list(swap_and_flatten01, self.tensor_list)
+        batch_dict['returns'] = swap_and_flatten01(mb_returns)
+        batch_dict['played_frames'] = self.batch_size
+        batch_dict['step_time'] = step_time
+        experience_buffer.carry_over_envs()
+        return batch_dict
+
 
 class DiscreteA2CBase(A2CBase):
 
@@ -844,8 +1379,12 @@ class DiscreteA2CBase(A2CBase):
         self.set_eval()
         play_time_start = time.time()
 
-        with torch.no_grad():
-            if self.is_rnn:
+        with torch.no_grad(), self.profiler.scope('play'):
+            if self.pipelined_rollout:
+                batch_dict = self.play_steps_pipelined()
+            elif self.partial_batches:
+                batch_dict = self.play_steps_async()
+            elif self.is_rnn:
                 batch_dict = self.play_steps_rnn()
             else:
                 batch_dict = self.play_steps()
@@ -857,24 +1396,37 @@ class DiscreteA2CBase(A2CBase):
         rnn_masks = batch_dict.get('rnn_masks', None)
 
         self.curr_frames = batch_dict.pop('played_frames')
-        self.prepare_dataset(batch_dict)
+        with self.profiler.scope('prepare_dataset'):
+            self.prepare_dataset(batch_dict)
         self.algo_observer.after_steps()
 
         a_losses = []
         c_losses = []
         entropies = []
         kls = []
-        if self.has_central_value:
-            self.train_central_value()
-
+        if self.fused_central_value:
+            self.start_fused_central_value()
+        elif self.has_central_value:
+            with self.profiler.scope('central_value'):
+                self.train_central_value()
+
+        updates_time_start = time.time()
+        stop_update = False
         for mini_ep in range(0, self.mini_epochs_num):
             ep_kls = []
-            for i in range(len(self.dataset)):
-                a_loss, c_loss, entropy, kl, last_lr, lr_mul = self.train_actor_critic(self.dataset[i])
+            self.dataset.new_mini_epoch()
+            for input_dict in self.minibatches:
+                with self.profiler.scope('update'):
+                    a_loss, c_loss, entropy, kl, last_lr, lr_mul = self.train_actor_critic(input_dict)
                 a_losses.append(a_loss)
                 c_losses.append(c_loss)
                 ep_kls.append(kl)
                 entropies.append(entropy)
+                if self.fused_central_value:
+                    self.step_fused_central_value(len(a_losses))
+                if self.target_kl is not None and self.target_kl_check == 'minibatch' and self.kl_above_target(ep_kls):
+                    stop_update = True
+                    break
 
             av_kls = torch_ext.mean_list(ep_kls)
             if self.multi_gpu:
@@ -887,7 +1439,15 @@ class DiscreteA2CBase(A2CBase):
             self.diagnostics.mini_epoch(self, mini_ep)
             if self.normalize_input:
                 self.model.running_mean_std.eval() # don't need to update statstics more than one miniepoch
-
+            if self.target_kl is not None and self.target_kl_check == 'mini_epoch':
+                stop_update = av_kls.item() > self.target_kl
+            if stop_update:
+                break
+
+        if self.fused_central_value:
+            self.finish_fused_central_value()
+        if self.target_kl is not None:
+            self.update_kl_early_stop_stats(len(a_losses), time.time() - updates_time_start)
         update_time_end = time.time()
         play_time = play_time_end - play_time_start
         update_time = update_time_end - update_time_start
@@ -905,7 +1465,9 @@ class DiscreteA2CBase(A2CBase):
         rnn_states = batch_dict.get('rnn_states', None)
         
         obses = batch_dict['obses']
-        advantages = returns - values
+        advantages = batch_dict.get('advantages')
+        if advantages is None:
+            advantages = returns - values
 
         if self.normalize_value:
             self.value_mean_std.train()
@@ -917,7 +1479,7 @@ class DiscreteA2CBase(A2CBase):
         advantages = torch.sum(advantages, axis=1)
 
         if self.normalize_advantage:
-            if self.is_rnn:
+            if self.is_rnn or rnn_masks is not None:
                 if self.normalize_rms_advantage:
                     advantages = self.advantage_mean_std(advantages, mask=rnn_masks)
                 else:
@@ -954,7 +1516,7 @@ class DiscreteA2CBase(A2CBase):
             dataset_dict['rnn_masks'] = rnn_masks
             self.central_value_net.update_dataset(dataset_dict)
 
-    def train(self):
+    def train_loop(self):
         self.init_tensors()
         self.mean_rewards = self.last_mean_rewards = -100500
         start_time = time.time()
@@ -1093,7 +1655,10 @@ class ContinuousA2CBase(A2CBase):
             rescaled_actions = actions
 
         if not self.is_tensor_obses:
-            rescaled_actions = rescaled_actions.cpu().numpy()
+            if self.transfer_manager is not None:
+                rescaled_actions = self.transfer_manager.to_host('actions', rescaled_actions)
+            else:
+                rescaled_actions = rescaled_actions.cpu().numpy()
 
         return rescaled_actions
 
@@ -1107,8 +1672,12 @@ class ContinuousA2CBase(A2CBase):
 
         self.set_eval()
         play_time_start = time.time()
-        with torch.no_grad():
-            if self.is_rnn:
+        with torch.no_grad(), self.profiler.scope('play'):
+            if self.pipelined_rollout:
+                batch_dict = self.play_steps_pipelined()
+            elif self.partial_batches:
+                batch_dict = self.play_steps_async()
+            elif self.is_rnn:
                 batch_dict = self.play_steps_rnn()
             else:
                 batch_dict = self.play_steps()
@@ -1119,10 +1688,14 @@ class ContinuousA2CBase(A2CBase):
 
         self.set_train()
         self.curr_frames = batch_dict.pop('played_frames')
-        self.prepare_dataset(batch_dict)
+        with self.profiler.scope('prepare_dataset'):
+            self.prepare_dataset(batch_dict)
         self.algo_observer.after_steps()
-        if self.has_central_value:
-            self.train_central_value()
+        if self.fused_central_value:
+            self.start_fused_central_value()
+        elif self.has_central_value:
+            with self.profiler.scope('central_value'):
+                self.train_central_value()
 
         a_losses = []
         c_losses = []
@@ -1130,18 +1703,24 @@ class ContinuousA2CBase(A2CBase):
         entropies = []
         kls = []
 
+        updates_time_start = time.time()
+        stop_update = False
         for mini_ep in range(0, self.mini_epochs_num):
             ep_kls = []
-            for i in range(len(self.dataset)):
-                a_loss, c_loss, entropy, kl, last_lr, lr_mul, cmu, csigma, b_loss = self.train_actor_critic(self.dataset[i])
+            self.dataset.new_mini_epoch()
+            for input_dict in self.minibatches:
+                with self.profiler.scope('update'):
+                    a_loss, c_loss, entropy, kl, last_lr, lr_mul, cmu, csigma, b_loss = self.train_actor_critic(input_dict)
                 a_losses.append(a_loss)
                 c_losses.append(c_loss)
                 ep_kls.append(kl)
                 entropies.append(entropy)
+                if self.fused_central_value:
+                    self.step_fused_central_value(len(a_losses))
                 if self.bounds_loss_coef is not None:
                     b_losses.append(b_loss)
 
-                self.dataset.update_mu_sigma(cmu, csigma)
+                self.minibatches.update_mu_sigma(cmu, csigma)
                 if self.schedule_type == 'legacy':
                     av_kls = kl
                     if self.multi_gpu:
@@ -1149,6 +1728,9 @@ class ContinuousA2CBase(A2CBase):
                         av_kls /= self.world_size
                     self.last_lr, self.entropy_coef = self.scheduler.update(self.last_lr, self.entropy_coef, self.epoch_num, 0, av_kls.item())
                     self.update_lr(self.last_lr)
+                if self.target_kl is not None and self.target_kl_check == 'minibatch' and self.kl_above_target(ep_kls):
+                    stop_update = True
+                    break
 
             av_kls = torch_ext.mean_list(ep_kls)
             if self.multi_gpu:
@@ -1162,7 +1744,15 @@ class ContinuousA2CBase(A2CBase):
             self.diagnostics.mini_epoch(self, mini_ep)
             if self.normalize_input:
                 self.model.running_mean_std.eval() # don't need to update statstics more than one miniepoch
-
+            if self.target_kl is not None and self.target_kl_check == 'mini_epoch':
+                stop_update = av_kls.item() > self.target_kl
+            if stop_update:
+                break
+
+        if self.fused_central_value:
+            self.finish_fused_central_value()
+        if self.target_kl is not None:
+            self.update_kl_early_stop_stats(len(a_losses), time.time() - updates_time_start)
         update_time_end = time.time()
         play_time = play_time_end - play_time_start
         update_time = update_time_end - update_time_start
@@ -1182,7 +1772,9 @@ class ContinuousA2CBase(A2CBase):
         rnn_states = batch_dict.get('rnn_states', None)
         rnn_masks = batch_dict.get('rnn_masks', None)
 
-        advantages = returns - values
+        advantages = batch_dict.get('advantages')
+        if advantages is None:
+            advantages = returns - values
 
         if self.normalize_value:
             self.value_mean_std.train()
@@ -1193,7 +1785,7 @@ class ContinuousA2CBase(A2CBase):
         advantages = torch.sum(advantages, axis=1)
 
         if self.normalize_advantage:
-            if self.is_rnn:
+            if self.is_rnn or rnn_masks is not None:
                 if self.normalize_rms_advantage:
                     advantages = self.advantage_mean_std(advantages, mask=rnn_masks)
                 else:
@@ -1230,7 +1822,7 @@ class ContinuousA2CBase(A2CBase):
             dataset_dict['rnn_masks'] = rnn_masks
             self.central_value_net.update_dataset(dataset_dict)
 
-    def train(self):
+    def train_loop(self):
         self.init_tensors()
         self.last_mean_rewards = -100500
         start_time = time.time()
@@ -0,0 +1,162 @@
+import torch
+from typing import Optional
+
+
+def gae_loop(fdones, last_extrinsic_values, mb_fdones, mb_extrinsic_values, mb_rewards, mb_masks: Optional[torch.Tensor], gamma: float, tau: float):
+    horizon_length = mb_rewards.size(0)
+    lastgaelam = torch.zeros_like(mb_rewards[0])
+    mb_advs = torch.zeros_like(mb_rewards)
+
+    for t in range(horizon_length - 1, -1, -1):
+        if t == horizon_length - 1:
+            nextnonterminal = 1.0 - fdones
+            nextvalues = last_extrinsic_values
+        else:
+            nextnonterminal = 1.0 - mb_fdones[t+1]
+            nextvalues = mb_extrinsic_values[t+1]
+        nextnonterminal = nextnonterminal.unsqueeze(1)
+
+        delta = mb_rewards[t] + gamma * nextvalues * nextnonterminal - mb_extrinsic_values[t]
+        lastgaelam = delta + gamma * tau * nextnonterminal * lastgaelam
+        if mb_masks is not None:
+            masks = mb_masks
+            lastgaelam = lastgaelam * masks[t].unsqueeze(1)
+        mb_advs[t] = lastgaelam
+    return mb_advs
+
+
+class AdvantageEstimator:
+    '''
+    Computes GAE advantages for the (horizon_length, batch_size, value_size) tensors collected by the rollout.
+    All implementations produce the same results as the reference per-timestep loop.
+    '''
+    def __init__(self, gamma, tau):
+        self.gamma = gamma
+        self.tau = tau
+
+    def discount_values(self, fdones, last_extrinsic_values, mb_fdones, mb_extrinsic_values, mb_rewards):
+        return self.compute(fdones, last_extrinsic_values, mb_fdones, mb_extrinsic_values, mb_rewards, None)
+
+    def discount_values_masks(self, fdones, last_extrinsic_values, mb_fdones, mb_extrinsic_values, mb_rewards, mb_masks):
+        return self.compute(fdones, last_extrinsic_values, mb_fdones, mb_extrinsic_values, mb_rewards, mb_masks)
+
+    def compute(self, fdones, last_extrinsic_values, mb_fdones, mb_extrinsic_values, mb_rewards, mb_masks):
+        raise NotImplementedError
+
+
+class LoopAdvantageEstimator(AdvantageEstimator):
+    '''
+    Reference implementation: python loop over the horizon.
+    '''
+    def compute(self, fdones, last_extrinsic_values, mb_fdones, mb_extrinsic_values, mb_rewards, mb_masks):
+        return gae_loop(fdones, last_extrinsic_values, mb_fdones, mb_extrinsic_values, mb_rewards, mb_masks, self.gamma, self.tau)
+
+
+class ScriptedAdvantageEstimator(AdvantageEstimator):
+    '''
+    Same reverse scan as the reference loop but compiled with TorchScript, so no python overhead per step.
+    Falls back to the eager loop if scripting is not available.
+    '''
+    def __init__(self, gamma, tau):
+        super().__init__(gamma, tau)
+        try:
+            self.scan = torch.jit.script(gae_loop)
+        except Exception as exc:
+            print(f'Could not script GAE, falling back to the python loop: {exc}')
+            self.scan = gae_loop
+
+    def compute(self, fdones, last_extrinsic_values, mb_fdones, mb_extrinsic_values, mb_rewards, mb_masks):
+        return self.scan(fdones, last_extrinsic_values, mb_fdones, mb_extrinsic_values, mb_rewards, mb_masks, self.gamma, self.tau)
+
+
+class ChunkedAdvantageEstimator(AdvantageEstimator):
+    '''
+    Closed form discounted cumsum. GAE is the linear recurrence adv[t] = delta[t] + c[t] * adv[t+1],
+    so inside a chunk of chunk_size steps it is computed with one masked cumprod and one reduction,
+    and only horizon_length / chunk_size steps are done in python.
+    Memory is chunk_size * chunk_size * batch_size * value_size.
+    '''
+    def __init__(self, gamma, tau, chunk_size=16):
+        super().__init__(gamma, tau)
+        self.chunk_size = chunk_size
+        self.triu_masks = {}
+
+    def _get_triu_mask(self, size, device):
+        key = (size, device)
+        if key not in self.triu_masks:
+            self.triu_masks[key] = torch.ones((size, size), dtype=torch.bool, device=device).triu()
+        return self.triu_masks[key]
+
+    def compute(self, fdones, last_extrinsic_values, mb_fdones, mb_extrinsic_values, mb_rewards, mb_masks):
+        horizon_length = mb_rewards.size(0)
+        extra_dims = (1,) * (mb_rewards.dim() - 2)
+
+        nextnonterminal = 1.0 - torch.cat([mb_fdones[1:], fdones.unsqueeze(0)], dim=0)
+        nextnonterminal = nextnonterminal.unsqueeze(2)
+        nextvalues = torch.cat([mb_extrinsic_values[1:], last_extrinsic_values.unsqueeze(0)], dim=0)
+
+        deltas = mb_rewards + self.gamma * nextvalues * nextnonterminal - mb_extrinsic_values
+        coefs = self.gamma * self.tau * nextnonterminal
+        if mb_masks is not None:
+            masks = mb_masks.unsqueeze(2)
+            deltas = deltas * masks
+            coefs = coefs * masks
+
+        mb_advs = torch.zeros_like(mb_rewards)
+        nextadv = torch.zeros_like(mb_rewards[0])
+        for end in range(horizon_length, 0, -self.chunk_size):
+            start = max(end - self.chunk_size, 0)
+            size = end - start
+            triu = self._get_triu_mask(size, mb_rewards.device).view(size, size, 1, *extra_dims)
+
+            # prods[i, k] = coefs[start + i] * ... * coefs[start + k] for k >= i, 1 otherwise
+            c = coefs[start:end].unsqueeze(0).expand(size, *coefs[start:end].size())
+            prods = torch.where(triu, c, torch.ones_like(c)).cumprod(dim=1)
+            # weights[i, k] = coefs[start + i] * ... * coefs[start + k - 1], weights[i, i] = 1
+            weights = torch.cat([torch.ones_like(prods[:, :1]), prods[:, :-1]], dim=1) * triu
+
+            adv = (weights * deltas[start:end].unsqueeze(0)).sum(dim=1) + prods[:, -1] * nextadv
+            mb_advs[start:end] = adv
+            nextadv = adv[0]
+        return mb_advs
+
+
+def create_advantage_estimator(name, gamma, tau, **kwargs):
+    if name == 'loop':
+        return LoopAdvantageEstimator(gamma, tau)
+    if name == 'scripted':
+        return ScriptedAdvantageEstimator(gamma, tau)
+    if name == 'chunked':
+        return ChunkedAdvantageEstimator(gamma, tau, **kwargs)
+    raise ValueError(f'Unknown gae engine: {name}')
+
+
+def vtrace(log_rhos, fdones, last_extrinsic_values, mb_fdones, mb_extrinsic_values, mb_rewards, gamma, tau,
+        clip_rho_threshold=1.0, clip_c_threshold=1.0, clip_pg_rho_threshold=1.0):
+    '''
+    V-trace value targets and policy gradient advantages (IMPALA, Espeholt et al. 2018).
+    Uses the same (horizon_length, batch_size, value_size) layout and dones convention as gae_loop,
+    log_rhos are log(target_prob / behaviour_prob) of the played actions with shape (horizon_length, batch_size).
+    tau is used as lambda in the trace coefficients. With on-policy data it gives GAE returns.
+    '''
+    horizon_length = mb_rewards.size(0)
+    rhos = torch.exp(log_rhos).unsqueeze(2)
+    clipped_rhos = torch.clamp(rhos, max=clip_rho_threshold)
+    cs = tau * torch.clamp(rhos, max=clip_c_threshold)
+
+    nextnonterminal = 1.0 - torch.cat([mb_fdones[1:], fdones.unsqueeze(0)], dim=0)
+    nextnonterminal = nextnonterminal.unsqueeze(2)
+    nextvalues = torch.cat([mb_extrinsic_values[1:], last_extrinsic_values.unsqueeze(0)], dim=0)
+    deltas = clipped_rhos * (mb_rewards + gamma * nextvalues * nextnonterminal - mb_extrinsic_values)
+
+    vs_minus_values = torch.zeros_like(mb_rewards)
+    acc = torch.zeros_like(mb_rewards[0])
+    for t in range(horizon_length - 1, -1, -1):
+        acc = deltas[t] + gamma * cs[t] * nextnonterminal[t] * acc
+        vs_minus_values[t] = acc
+    vs = vs_minus_values + mb_extrinsic_values
+
+    next_vs = torch.cat([vs[1:], last_extrinsic_values.unsqueeze(0)], dim=0)
+    pg_rhos = torch.clamp(rhos, max=clip_pg_rho_threshold)
+    pg_advantages = pg_rhos * (mb_rewards + gamma * next_vs * nextnonterminal - mb_extrinsic_values)
+    return vs, pg_advantages
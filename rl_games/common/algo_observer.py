@@ -13,6 +13,12 @@ class AlgoObserver:
     def after_init(self, algo):
         pass
 
+    def needs_done_indices(self, infos):
+        """
+        Computing done indices syncs the rollout with the device. If it returns False process_infos gets None as done_indices.
+        """
+        return True
+
     def process_infos(self, infos, done_indices):
         pass
 
@@ -32,13 +38,25 @@ class DefaultAlgoObserver(AlgoObserver):
         self.game_scores = torch_ext.AverageMeter(1, self.algo.games_to_track).to(self.algo.ppo_device)  
         self.writer = self.algo.writer
 
+    def needs_done_indices(self, infos):
+        if not infos:
+            return False
+        if isinstance(infos, dict):
+            # envpool finished games are found with lives
+            return 'lives' not in infos and ('battle_won' in infos or 'scores' in infos)
+        # envs can add the results only to the infos of finished games
+        return any(isinstance(info, dict) and ('battle_won' in info or 'scores' in info) for info in infos)
+
     def process_infos(self, infos, done_indices):
         if not infos:
             return
 
-        done_indices = done_indices.cpu().numpy()
+        if done_indices is not None:
+            done_indices = done_indices.cpu().numpy()
 
         if not isinstance(infos, dict) and len(infos) > 0 and isinstance(infos[0], dict):
+            if done_indices is None:
+                return
             for ind in done_indices:
                 ind = ind.item()
                 if len(infos) <= ind//self.algo.num_agents:
@@ -57,6 +75,8 @@ class DefaultAlgoObserver(AlgoObserver):
             if 'lives' in infos:
                 # envpool
                 done_indices = np.argwhere(infos['lives'] == 0).squeeze(1)
+            if done_indices is None:
+                return
 
             for ind in done_indices:
                 ind = ind.item()
@@ -92,6 +112,9 @@ class IsaacAlgoObserver(AlgoObserver):
         self.direct_info = {}
         self.writer = self.algo.writer
 
+    def needs_done_indices(self, infos):
+        return False
+
     def process_infos(self, infos, done_indices):
         if not isinstance(infos, dict):
             classname = self.__class__.__name__
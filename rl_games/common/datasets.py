@@ -1,9 +1,45 @@
 import torch
 import copy
+from concurrent.futures import ThreadPoolExecutor
 from torch.utils.data import Dataset
 
+
+class MinibatchSampler:
+    '''
+    Contiguous minibatches in the same order every mini-epoch. Items are transitions, or games of seq_len transitions for rnns.
+    '''
+    def __init__(self, num_items, items_per_minibatch, device):
+        self.num_items = num_items
+        self.items_per_minibatch = items_per_minibatch
+        self.device = device
+
+    def new_mini_epoch(self):
+        pass
+
+    def get_items(self, idx):
+        start = idx * self.items_per_minibatch
+        return slice(start, start + self.items_per_minibatch)
+
+
+class ShuffledMinibatchSampler(MinibatchSampler):
+    '''
+    Draws a new permutation of the items every mini-epoch, minibatches are consecutive chunks of it.
+    Minibatches mix transitions of all actors instead of a few neighbouring ones.
+    '''
+    def __init__(self, num_items, items_per_minibatch, device):
+        super().__init__(num_items, items_per_minibatch, device)
+        self.permutation = torch.arange(num_items, dtype=torch.long, device=device)
+
+    def new_mini_epoch(self):
+        self.permutation = torch.randperm(self.num_items, device=self.device)
+
+    def get_items(self, idx):
+        start = idx * self.items_per_minibatch
+        return self.permutation[start:start + self.items_per_minibatch]
+
+
 class PPODataset(Dataset):
-    def __init__(self, batch_size, minibatch_size, is_discrete, is_rnn, device, seq_len):
+    def __init__(self, batch_size, minibatch_size, is_discrete, is_rnn, device, seq_len, shuffle=False):
         self.is_rnn = is_rnn
         self.seq_len = seq_len
         self.batch_size = batch_size
@@ -18,58 +54,88 @@ class PPODataset(Dataset):
         self.flat_indexes = torch.arange(total_games * self.seq_len, dtype=torch.long, device=self.device).reshape(total_games, self.seq_len)
 
         self.special_names = ['rnn_states']
+        # rnns are shuffled by whole games, so sequences and their rnn states stay together
+        sampler_class = ShuffledMinibatchSampler if shuffle else MinibatchSampler
+        if self.is_rnn:
+            self.sampler = sampler_class(total_games, self.num_games_batch, self.device)
+        else:
+            self.sampler = sampler_class(self.batch_size, self.minibatch_size, self.device)
+        # key -> preallocated minibatch, shuffled minibatches are gathered into it with index_select
+        self.gather_buffers = {}
+        # minibatches alternate between the buffer sets, a prefetcher uses two so the next minibatch doesn't overwrite the current one
+        self.num_buffer_sets = 1
+        self.buffer_set = 0
 
     def update_values_dict(self, values_dict):
         self.values_dict = values_dict     
 
-    def update_mu_sigma(self, mu, sigma):	    
-        start = self.last_range[0]	           
-        end = self.last_range[1]	
-        self.values_dict['mu'][start:end] = mu	
-        self.values_dict['sigma'][start:end] = sigma 
+    def new_mini_epoch(self):
+        self.sampler.new_mini_epoch()
+
+    def update_mu_sigma(self, mu, sigma, indexes=None):
+        if indexes is None:
+            indexes = self.last_indexes
+        if isinstance(indexes, slice):
+            self.values_dict['mu'][indexes] = mu
+            self.values_dict['sigma'][indexes] = sigma
+        else:
+            self.values_dict['mu'].index_copy_(0, indexes, mu)
+            self.values_dict['sigma'].index_copy_(0, indexes, sigma)
 
     def __len__(self):
         return self.length
 
-    def _get_item_rnn(self, idx):
-        gstart = idx * self.num_games_batch
-        gend = (idx + 1) * self.num_games_batch
-        start = gstart * self.seq_len
-        end = gend * self.seq_len
-        self.last_range = (start, end)   
+    def _gather(self, key, value, indexes, dim=0):
+        shape = list(value.shape)
+        shape[dim] = len(indexes)
+        key = (self.buffer_set, key)
+        buffer = self.gather_buffers.get(key)
+        if buffer is None or list(buffer.shape) != shape or buffer.dtype != value.dtype or buffer.device != value.device:
+            buffer = torch.empty(shape, dtype=value.dtype, device=value.device)
+            self.gather_buffers[key] = buffer
+        return torch.index_select(value, dim, indexes, out=buffer)
+
+    def _take(self, key, value, indexes):
+        if isinstance(indexes, slice):
+            return value[indexes]
+        return self._gather(key, value, indexes)
+
+    def _get_values(self, indexes):
+        self.last_indexes = indexes
         input_dict = {}
         for k,v in self.values_dict.items():
-            if k not in self.special_names:
-                if isinstance(v, dict):
-                    v_dict = {kd:vd[start:end] for kd, vd in v.items()}
+            if k not in self.special_names and v is not None:
+                if type(v) is dict:
+                    v_dict = { kd:self._take((k, kd), vd, indexes) for kd, vd in v.items() }
                     input_dict[k] = v_dict
                 else:
-                    if v is not None:
-                        input_dict[k] = v[start:end]
-                    else:
-                        input_dict[k] = None
-        
+                    input_dict[k] = self._take(k, v, indexes)
+        return input_dict
+
+    def _get_item_rnn(self, idx):
+        games = self.sampler.get_items(idx)
+        if isinstance(games, slice):
+            indexes = slice(games.start * self.seq_len, games.stop * self.seq_len)
+        else:
+            indexes = self._gather('indexes', self.flat_indexes, games).view(-1)
+        input_dict = self._get_values(indexes)
+        for k,v in self.values_dict.items():
+            if k not in self.special_names and v is None:
+                input_dict[k] = None
+
         rnn_states = self.values_dict['rnn_states']
-        input_dict['rnn_states'] = [s[:, gstart:gend, :].contiguous() for s in rnn_states]
+        if isinstance(games, slice):
+            input_dict['rnn_states'] = [s[:, games, :].contiguous() for s in rnn_states]
+        else:
+            input_dict['rnn_states'] = [self._gather(('rnn_states', i), s, games, dim=1) for i, s in enumerate(rnn_states)]
 
         return input_dict
 
     def _get_item(self, idx):
-        start = idx * self.minibatch_size
-        end = (idx + 1) * self.minibatch_size
-        self.last_range = (start, end)
-        input_dict = {}
-        for k,v in self.values_dict.items():
-            if k not in self.special_names and v is not None:
-                if type(v) is dict:
-                    v_dict = { kd:vd[start:end] for kd, vd in v.items() }
-                    input_dict[k] = v_dict
-                else:
-                    input_dict[k] = v[start:end]
-                
-        return input_dict
+        return self._get_values(self.sampler.get_items(idx))
 
     def __getitem__(self, idx):
+        self.buffer_set = (self.buffer_set + 1) % self.num_buffer_sets
         if self.is_rnn:
             sample = self._get_item_rnn(idx)
         else:
@@ -77,6 +143,96 @@ class PPODataset(Dataset):
         return sample
 
 
+def _minibatch_tensors(input_dict):
+    for v in input_dict.values():
+        if isinstance(v, torch.Tensor):
+            yield v
+        elif isinstance(v, dict):
+            yield from (vd for vd in v.values() if isinstance(vd, torch.Tensor))
+        elif isinstance(v, list):
+            yield from (vl for vl in v if isinstance(vl, torch.Tensor))
+
+
+class MinibatchIterator:
+    '''
+    Iterates over the minibatches of a mini-epoch of a PPODataset. update_mu_sigma writes to the rows of the last minibatch.
+    '''
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.indexes = None
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __iter__(self):
+        for idx in range(len(self.dataset)):
+            input_dict = self.dataset[idx]
+            self.indexes = self.dataset.last_indexes
+            yield input_dict
+
+    def update_mu_sigma(self, mu, sigma):
+        self.dataset.update_mu_sigma(mu, sigma, self.indexes)
+
+
+class MinibatchPrefetcher(MinibatchIterator):
+    '''
+    Prepares minibatch k+1 while minibatch k is trained: slicing or gathering of the dataset, rnn states and preproc_obs
+    (decompression and uint8 to float conversion), the result is returned as processed_obs. Input normalization stays
+    in the model, it updates its statistics in the first mini-epoch.
+    On cuda the next minibatch is prepared on a side stream, on cpu in a worker thread.
+    The first minibatch of a mini-epoch isn't prefetched during the last one of the previous mini-epoch: they can share rows,
+    whose mu and sigma are updated after the last minibatch is trained.
+    '''
+    def __init__(self, dataset, preproc_obs, device):
+        super().__init__(dataset)
+        # the trained minibatch and the prefetched one
+        self.dataset.num_buffer_sets = 2
+        self.preproc_obs = preproc_obs
+        self.device = torch.device(device)
+        self.use_stream = self.device.type == 'cuda'
+        if self.use_stream:
+            self.stream = torch.cuda.Stream(device=self.device)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rl_games_prefetch')
+
+    def _prepare(self, idx):
+        input_dict = self.dataset[idx]
+        input_dict['processed_obs'] = self.preproc_obs(input_dict['obs'])
+        return input_dict, self.dataset.last_indexes
+
+    def _launch(self, idx):
+        if not self.use_stream:
+            return self.executor.submit(self._prepare, idx)
+        # buffers of the minibatch before the trained one are reused, wait until its kernels are done
+        self.stream.wait_stream(torch.cuda.current_stream(self.device))
+        with torch.cuda.stream(self.stream):
+            return self._prepare(idx)
+
+    def _wait(self, pending):
+        if not self.use_stream:
+            return pending.result()
+        current_stream = torch.cuda.current_stream(self.device)
+        current_stream.wait_stream(self.stream)
+        # tensors allocated on the side stream are used by the training stream
+        for value in _minibatch_tensors(pending[0]):
+            value.record_stream(current_stream)
+        return pending
+
+    def __iter__(self):
+        num_minibatches = len(self.dataset)
+        pending = self._launch(0)
+        try:
+            for idx in range(num_minibatches):
+                input_dict, self.indexes = self._wait(pending)
+                pending = None
+                if idx + 1 < num_minibatches:
+                    pending = self._launch(idx + 1)
+                yield input_dict
+        finally:
+            # the update loop stopped early (target_kl), the dataset can't change under a running prefetch
+            if pending is not None and not self.use_stream:
+                pending.result()
+
 
 class DatasetList(Dataset):
     def __init__(self):
@@ -0,0 +1,102 @@
+import importlib
+
+import numpy as np
+import torch
+import torch.utils.dlpack as tpack
+
+from rl_games.common.ivecenv import IVecEnv
+
+
+def get_framework(array):
+    '''
+    Name of the array library of array (torch, numpy, jax, cupy...), dicts are looked up by their first value.
+    '''
+    if isinstance(array, dict):
+        return get_framework(next(iter(array.values())))
+    framework = type(array).__module__.split('.')[0]
+    # jax arrays are implemented in jaxlib
+    return 'jax' if framework == 'jaxlib' else framework
+
+def to_torch(array):
+    '''
+    Zero-copy torch view of a DLPack capable array on the same device, dtype is kept.
+    '''
+    if isinstance(array, torch.Tensor):
+        return array
+    if isinstance(array, np.ndarray):
+        # numpy refuses to export read-only arrays with DLPack, from_numpy shares the memory as well
+        return torch.from_numpy(array)
+    if hasattr(array, '__dlpack__'):
+        return tpack.from_dlpack(array)
+    if get_framework(array) == 'jax':
+        # jax versions without __dlpack__
+        from jax import dlpack
+        return tpack.from_dlpack(dlpack.to_dlpack(array))
+    return array
+
+def from_torch(tensor, framework):
+    '''
+    Zero-copy view of tensor as an array of framework. numpy arrays are on the host, tensors on other devices are copied.
+    '''
+    if framework == 'torch':
+        return tensor
+    tensor = tensor.detach().contiguous()
+    if framework == 'numpy':
+        return tensor.cpu().numpy()
+    if framework == 'jax':
+        from jax import dlpack
+        try:
+            return dlpack.from_dlpack(tensor)
+        except TypeError:
+            # jax versions which only take DLPack capsules
+            return dlpack.from_dlpack(tpack.to_dlpack(tensor))
+    return importlib.import_module(framework).from_dlpack(tensor)
+
+def dict_to_torch(values):
+    if isinstance(values, dict):
+        return {k : dict_to_torch(v) for k, v in values.items()}
+    return to_torch(values)
+
+
+class DLPackVecEnv(IVecEnv):
+    '''
+    Adapter for batched, tensor-native simulators which return arrays of any DLPack capable library (JAX, CuPy, numpy, torch).
+    Obs, rewards, dones and array infos are returned as torch views of the simulator arrays, so the training loop
+    takes its tensor obs path. Actions are passed back as arrays of the library of the obs. There are no host round trips
+    and dtype conversions if the simulator and the training run on the same device.
+    Select it with vecenv_type: DLPACK. The env_creator of the env gets num_actors and has to return a simulator
+    with step(actions) and reset() for all envs, and get_env_info or observation_space and action_space of one env.
+    '''
+    def __init__(self, config_name, num_actors, **kwargs):
+        # env_configurations imports the envs which are built on this adapter
+        from rl_games.common.env_configurations import configurations
+
+        self.env = configurations[config_name]['env_creator'](num_actors=num_actors, **kwargs)
+        self.num_actors = num_actors
+        # array library of the simulator, known after the first reset
+        self.framework = None
+
+    def step(self, actions):
+        next_obs, reward, is_done, info = self.env.step(from_torch(actions, self.framework))
+        return dict_to_torch(next_obs), to_torch(reward), to_torch(is_done), self._infos_to_torch(info)
+
+    def reset(self):
+        obs = self.env.reset()
+        self.framework = get_framework(obs)
+        return dict_to_torch(obs)
+
+    def _infos_to_torch(self, infos):
+        if not isinstance(infos, dict):
+            return infos
+        return {k : to_torch(v) if get_framework(v) == self.framework else v for k, v in infos.items()}
+
+    def get_number_of_agents(self):
+        return 1
+
+    def get_env_info(self):
+        if hasattr(self.env, 'get_env_info'):
+            return self.env.get_env_info()
+        info = {}
+        info['action_space'] = self.env.action_space
+        info['observation_space'] = self.env.observation_space
+        return info
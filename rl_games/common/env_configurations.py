@@ -387,6 +387,10 @@ configurations = {
         'env_creator' : lambda **kwargs : create_test_env(kwargs.pop('name'), **kwargs),
         'vecenv_type' : 'RAY'
     },
+    'test_vec_env' : {
+        'env_creator' : lambda **kwargs : create_test_env(kwargs.pop('name'), **kwargs),
+        'vecenv_type' : 'TEST_VEC'
+    },
     'minigrid_env' : {
         'env_creator' : lambda **kwargs : create_minigrid_env(kwargs.pop('name'), **kwargs),
         'vecenv_type' : 'RAY'
@@ -20,7 +20,7 @@ class ReplayBuffer(object):
         self._next_obses = np.zeros((size,) + ob_space.shape, dtype=ob_space.dtype)
         self._rewards = np.zeros(size)
         self._actions = np.zeros(size, dtype=np.int32)
-        self._dones = np.zeros(size, dtype=np.bool)
+        self._dones = np.zeros(size, dtype=np.bool_)
 
         self._maxsize = size
         self._next_idx = 0
@@ -299,12 +299,22 @@ class ExperienceBuffer:
         self.horizon_length = algo_info['horizon_length']
         self.has_central_value = algo_info['has_central_value']
         self.use_action_masks = algo_info.get('use_action_masks', False)
+        # allocate storage as (actors, horizon, ...) and keep (horizon, actors, ...) views of it,
+        # so swap_and_flatten01 on these views doesn't copy
+        self.actor_major = algo_info.get('actor_major', False)
+        # envs are stepped in partial batches (envpool async), every env writes at its own row.
+        # Envs can run up to a horizon ahead of the slowest one, rows after horizon_length are carried over to the next rollout
+        self.partial_batches = algo_info.get('partial_batches', False)
+        self.capacity = 2 * self.horizon_length + 1 if self.partial_batches else self.horizon_length
+        # 1.0 for valid transitions, 0.0 for transitions of envs which missed the step timeout
+        self.use_step_masks = algo_info.get('step_masks', False)
+        self.env_steps = np.zeros(self.num_actors, dtype=np.int64)
         batch_size = self.num_actors * self.num_agents
         self.is_discrete = False
         self.is_multi_discrete = False
         self.is_continuous = False
-        self.obs_base_shape = (self.horizon_length, self.num_agents * self.num_actors)
-        self.state_base_shape = (self.horizon_length, self.num_actors)
+        self.obs_base_shape = (self.capacity, self.num_agents * self.num_actors)
+        self.state_base_shape = (self.capacity, self.num_actors)
         if type(self.action_space) is gym.spaces.Discrete:
             self.actions_shape = ()
             self.actions_num = self.action_space.n
@@ -337,11 +347,13 @@ class ExperienceBuffer:
         self.tensor_dict['values'] = self._create_tensor_from_space(val_space, obs_base_shape)
         self.tensor_dict['neglogpacs'] = self._create_tensor_from_space(gym.spaces.Box(low=0, high=1,shape=(), dtype=np.float32), obs_base_shape)
         self.tensor_dict['dones'] = self._create_tensor_from_space(gym.spaces.Box(low=0, high=1,shape=(), dtype=np.uint8), obs_base_shape)
+        if self.use_step_masks:
+            self.tensor_dict['step_masks'] = self._create_tensor_from_space(gym.spaces.Box(low=0, high=1,shape=(), dtype=np.float32), obs_base_shape)
 
         if self.is_discrete or self.is_multi_discrete:
             self.tensor_dict['actions'] = self._create_tensor_from_space(gym.spaces.Box(low=0, high=1,shape=self.actions_shape, dtype=int), obs_base_shape)
         if self.use_action_masks:
-            self.tensor_dict['action_masks'] = self._create_tensor_from_space(gym.spaces.Box(low=0, high=1,shape=self.actions_shape + (np.sum(self.actions_num),), dtype=np.bool), obs_base_shape)
+            self.tensor_dict['action_masks'] = self._create_tensor_from_space(gym.spaces.Box(low=0, high=1,shape=self.actions_shape + (np.sum(self.actions_num),), dtype=np.bool_), obs_base_shape)
         if self.is_continuous:
             self.tensor_dict['actions'] = self._create_tensor_from_space(gym.spaces.Box(low=0, high=1,shape=self.actions_shape, dtype=np.float32), obs_base_shape)
             self.tensor_dict['mus'] = self._create_tensor_from_space(gym.spaces.Box(low=0, high=1,shape=self.actions_shape, dtype=np.float32), obs_base_shape)
@@ -352,20 +364,25 @@ class ExperienceBuffer:
         for k,v in tensor_dict.items():
             self.tensor_dict[k] = self._create_tensor_from_space(gym.spaces.Box(low=0, high=1,shape=(v), dtype=np.float32), obs_base_shape)
 
+    def _zeros(self, shape, dtype):
+        if self.actor_major:
+            return torch.zeros((shape[1], shape[0]) + shape[2:], dtype=dtype, device=self.device).transpose(0, 1)
+        return torch.zeros(shape, dtype=dtype, device=self.device)
+
     def _create_tensor_from_space(self, space, base_shape):       
         if type(space) is gym.spaces.Box:
             dtype = numpy_to_torch_dtype_dict[space.dtype]
-            return torch.zeros(base_shape + space.shape, dtype= dtype, device = self.device)
+            return self._zeros(base_shape + space.shape, dtype)
         if type(space) is gym.spaces.Discrete:
             dtype = numpy_to_torch_dtype_dict[space.dtype]
-            return torch.zeros(base_shape, dtype= dtype, device = self.device)
+            return self._zeros(base_shape, dtype)
         if type(space) is gym.spaces.Tuple:
             '''
             assuming that tuple is only Discrete tuple
             '''
             dtype = numpy_to_torch_dtype_dict[space.dtype]
             tuple_len = len(space)
-            return torch.zeros(base_shape +(tuple_len,), dtype= dtype, device = self.device)
+            return self._zeros(base_shape +(tuple_len,), dtype)
         if type(space) is gym.spaces.Dict:
             t_dict = {}
             for k,v in space.spaces.items():
@@ -382,21 +399,63 @@ class ExperienceBuffer:
 
     def update_data_rnn(self, name, indices,play_mask, val):
         if type(val) is dict:
-            for k,v in val:
+            for k,v in val.items():
                 self.tensor_dict[name][k][indices,play_mask] = v
         else:
             self.tensor_dict[name][indices,play_mask] = val
 
+    def get_env_rows(self, env_ids):
+        '''
+        Current rows of envs env_ids (numpy array) as a device tensor, computed once per partial batch.
+        '''
+        return torch.from_numpy(self.env_steps[env_ids]).to(self.device)
+
+    def update_data_envs(self, name, rows, env_ids, val):
+        '''
+        Writes val of envs env_ids at rows, both are device index tensors.
+        '''
+        if type(val) is dict:
+            for k,v in val.items():
+                self.tensor_dict[name][k][rows, env_ids] = v
+        else:
+            self.tensor_dict[name][rows, env_ids] = val
+
+    def get_data_envs(self, name, rows, env_ids):
+        return self.tensor_dict[name][rows, env_ids]
+
+    def advance_envs(self, env_ids):
+        self.env_steps[env_ids] += 1
+
+    def envs_done(self):
+        '''
+        True if every env has horizon_length transitions and the observation after them.
+        '''
+        return bool((self.env_steps > self.horizon_length).all())
+
+    def carry_over_envs(self):
+        '''
+        Moves rows after horizon_length to the start of the buffer, they begin the next rollout.
+        '''
+        def shift(v):
+            v[:self.capacity - self.horizon_length] = v[self.horizon_length:].clone()
+        for v in self.tensor_dict.values():
+            if type(v) is dict:
+                for vd in v.values():
+                    shift(vd)
+            else:
+                shift(v)
+        self.env_steps -= self.horizon_length
+
     def get_transformed(self, transform_op):
         res_dict = {}
         for k, v in self.tensor_dict.items():
             if type(v) is dict:
                 transformed_dict = {}
                 for kd,vd in v.items():
-                    transformed_dict[kd] = transform_op(vd)
+                    transformed_dict[kd] = transform_op(vd[:self.horizon_length])
                 res_dict[k] = transformed_dict
             else:
-                res_dict[k] = transform_op(v)
+                res_dict[k] = transform_op(v[:self.horizon_length])
         
         return res_dict
 
@@ -409,9 +468,9 @@ class ExperienceBuffer:
             if type(v) is dict:
                 transformed_dict = {}
                 for kd,vd in v.items():
-                    transformed_dict[kd] = transform_op(vd)
+                    transformed_dict[kd] = transform_op(vd[:self.horizon_length])
                 res_dict[k] = transformed_dict
             else:
-                res_dict[k] = transform_op(v)
+                res_dict[k] = transform_op(v[:self.horizon_length])
         
         return res_dict
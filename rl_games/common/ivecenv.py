@@ -8,6 +8,69 @@ class IVecEnv:
     def has_action_masks(self):
         return False
 
+    def has_async_step(self):
+        """
+        Return True if step_async/step_wait are implemented.
+        They are used by the pipelined rollout to step one group of actors while the policy runs on another.
+        """
+        return False
+
+    def step_async(self, actions, actor_slice):
+        """
+        Start stepping actors in actor_slice with actions for these actors only. Must not block.
+        """
+        raise NotImplementedError
+
+    def step_wait(self, actor_slice):
+        """
+        Wait for the step started with step_async for the same actor_slice and return obs, rewards, dones, infos for these actors.
+        """
+        raise NotImplementedError
+
+    def has_partial_batches(self):
+        """
+        Return True if async_reset/send/recv are implemented. recv returns results only for the envs which finished
+        stepping first, so slow envs don't gate the others. Used by the rollout instead of step and reset.
+        """
+        return False
+
+    def async_reset(self):
+        """
+        Start resetting all envs. First observations are returned by recv.
+        """
+        raise NotImplementedError
+
+    def send(self, actions, env_ids):
+        """
+        Start stepping envs env_ids with actions. Must not block.
+        """
+        raise NotImplementedError
+
+    def recv(self):
+        """
+        Wait for the next batch of envs which finished stepping and return obs, rewards, dones, infos, env_ids.
+        """
+        raise NotImplementedError
+
+    def has_step_masks(self):
+        """
+        Return True if step can return stale results for some agents, i.e. of envs which missed a step timeout.
+        get_step_masks tells which transitions of the last step are valid, the others are excluded from the loss.
+        """
+        return False
+
+    def get_step_masks(self):
+        """
+        Bool array with one value per agent, False if the transition of the last step is not valid.
+        """
+        raise NotImplementedError
+
+    def get_step_stats(self):
+        """
+        Return dict of stepping stats since the last call: scalars and arrays, arrays are written as histograms.
+        """
+        return {}
+
     def get_number_of_agents(self):
         return 1
 
@@ -0,0 +1,67 @@
+'''
+Per key obs compression: vec env workers compress obs before they are sent to the learner, obs are stored compressed
+in the experience buffer and decompressed on the device in _preproc_obs. The policy maps obs keys ('obs' for non dict
+obs) to one of:
+    float16: float features with a limited range
+    uint8, int16: integer valued features, i.e. pixels or categorical features emitted as floats
+    bits: boolean features, packed 8 per byte along the last axis
+Decompressed obs get the dtype of the observation space (float64 as float32), values are kept except the float16 rounding.
+'''
+
+import gym
+import numpy as np
+import torch
+
+from rl_games.algos_torch.torch_ext import numpy_to_torch_dtype_dict
+
+
+COMPRESSIONS = ['float16', 'uint8', 'int16', 'bits']
+
+def check_obs_compression(compression):
+    for key, method in compression.items():
+        if method not in COMPRESSIONS:
+            raise ValueError(f'Unknown obs compression {method} for {key}, expected one of {COMPRESSIONS}')
+
+def _compress(value, method):
+    if method == 'bits':
+        return np.packbits(np.asarray(value, dtype=np.bool_), axis=-1)
+    return np.asarray(value).astype(method)
+
+def compress_obs(obs, compression):
+    if isinstance(obs, dict):
+        return {k : _compress(v, compression[k]) if k in compression else v for k, v in obs.items()}
+    if 'obs' in compression:
+        return _compress(obs, compression['obs'])
+    return obs
+
+def _compressed_box(space, method):
+    if method == 'bits':
+        shape = space.shape[:-1] + ((space.shape[-1] + 7) // 8,)
+        return gym.spaces.Box(0, 255, shape, dtype=np.uint8)
+    dtype = np.dtype(method)
+    limits = np.finfo(dtype) if dtype.kind == 'f' else np.iinfo(dtype)
+    return gym.spaces.Box(limits.min, limits.max, space.shape, dtype=dtype)
+
+def compressed_space(observation_space, compression):
+    '''
+    Observation space of the compressed obs, used to allocate the experience buffer.
+    '''
+    if isinstance(observation_space, gym.spaces.Dict):
+        return gym.spaces.Dict({k : _compressed_box(v, compression[k]) if k in compression else v
+                                for k, v in observation_space.spaces.items()})
+    if 'obs' in compression:
+        return _compressed_box(observation_space, compression['obs'])
+    return observation_space
+
+def _decompress(value, method, space):
+    if method == 'bits':
+        shifts = torch.arange(7, -1, -1, dtype=torch.uint8, device=value.device)
+        value = ((value.unsqueeze(-1) >> shifts) & 1).flatten(-2)[..., :space.shape[-1]]
+    return value.to(numpy_to_torch_dtype_dict[space.dtype])
+
+def decompress_obs(obs, compression, observation_space):
+    if isinstance(obs, dict):
+        return {k : _decompress(v, compression[k], observation_space[k]) if k in compression else v for k, v in obs.items()}
+    if 'obs' in compression:
+        return _decompress(obs, compression['obs'], observation_space)
+    return obs
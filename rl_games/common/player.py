@@ -10,6 +10,7 @@ from os.path import basename
 from typing import Optional
 from rl_games.common import vecenv
 from rl_games.common import env_configurations
+from rl_games.common import obs_compression
 from rl_games.algos_torch import model_builder
 
 
@@ -45,6 +46,8 @@ class BasePlayer(object):
         self.action_space = self.env_info['action_space']
 
         self.observation_space = self.env_info['observation_space']
+        # set by vec envs which compress obs in their workers
+        self.obs_compression = self.env_info.get('obs_compression')
         if isinstance(self.observation_space, gym.spaces.Dict):
             self.obs_shape = {}
             for k, v in self.observation_space.spaces.items():
@@ -165,6 +168,8 @@ class BasePlayer(object):
         self.config['network'] = builder.load(params)
 
     def _preproc_obs(self, obs_batch):
+        if self.obs_compression is not None:
+            obs_batch = obs_compression.decompress_obs(obs_batch, self.obs_compression, self.observation_space)
         if type(obs_batch) is dict:
             obs_batch = copy.copy(obs_batch)
             for k, v in obs_batch.items():
@@ -223,6 +228,9 @@ class BasePlayer(object):
             assert (obs.dtype != np.int8)
             if obs.dtype == np.uint8:
                 obs = torch.ByteTensor(obs).to(self.device)
+            elif self.obs_compression is not None and obs.dtype in (np.float16, np.int16):
+                # compressed obs are decompressed on the device in _preproc_obs
+                obs = torch.tensor(obs, device=self.device)
             else:
                 obs = torch.FloatTensor(obs).to(self.device)
         elif np.isscalar(obs):
@@ -253,7 +261,8 @@ class BasePlayer(object):
                 weights['running_mean_std'])
 
     def create_env(self):
-        return env_configurations.configurations[self.env_name]['env_creator'](**self.env_config)
+        env_config = {k : v for k, v in self.env_config.items() if k not in vecenv.VECENV_CONFIG_KEYS}
+        return env_configurations.configurations[self.env_name]['env_creator'](**env_config)
 
     def get_action(self, obs, is_deterministic=False):
         raise NotImplementedError('step')
@@ -0,0 +1,120 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+import torch
+
+
+class DefaultProfiler(object):
+    '''
+    Does nothing. scope() returns the same null context every time, so instrumented code costs one call when profiling is off.
+    '''
+    def __init__(self):
+        self.null_scope = contextlib.nullcontext()
+
+    def scope(self, name):
+        return self.null_scope
+
+    def send_info(self, writter, frame):
+        pass
+
+    def close(self):
+        pass
+
+
+class _ProfilerScope(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler._push(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler._pop()
+        return False
+
+
+class TimelineProfiler(DefaultProfiler):
+    '''
+    Hierarchical wall clock timer. Nested scopes are named by their path, i.e. 'play/env_step'.
+    send_info writes the time spent in every scope since the previous call to 'profiling/<path>' and its number of calls
+    to 'profiling_calls/<path>'. If trace_path is set, every scope is also written there as a complete event
+    in chrome trace format (open in chrome://tracing or https://ui.perfetto.dev).
+    Cuda work is asynchronous, with sync_cuda=True every scope synchronizes on enter and exit so the time is attributed
+    to the scope which launched the work.
+    '''
+    def __init__(self, sync_cuda=False, trace_path=None):
+        DefaultProfiler.__init__(self)
+        self.sync_cuda = sync_cuda and torch.cuda.is_available()
+        self.trace_path = trace_path
+        self.trace_file = None
+        self.start_time = time.perf_counter()
+        self.totals = {}
+        self.counts = {}
+        self.events = []
+        # rollout threads (appo) have their own scope stacks
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def _stack(self):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def scope(self, name):
+        return _ProfilerScope(self, name)
+
+    def _push(self, name):
+        if self.sync_cuda:
+            torch.cuda.synchronize()
+        stack = self._stack()
+        path = stack[-1][0] + '/' + name if stack else name
+        stack.append((path, time.perf_counter()))
+
+    def _pop(self):
+        if self.sync_cuda:
+            torch.cuda.synchronize()
+        end = time.perf_counter()
+        path, start = self._stack().pop()
+        with self.lock:
+            self.totals[path] = self.totals.get(path, 0.0) + end - start
+            self.counts[path] = self.counts.get(path, 0) + 1
+            if self.trace_path is not None:
+                self.events.append({
+                    'name' : path.rsplit('/', 1)[-1],
+                    'cat' : path,
+                    'ph' : 'X',
+                    'ts' : (start - self.start_time) * 1e6,
+                    'dur' : (end - start) * 1e6,
+                    'pid' : os.getpid(),
+                    'tid' : threading.get_ident(),
+                })
+
+    def send_info(self, writter, frame):
+        with self.lock:
+            totals, counts, events = self.totals, self.counts, self.events
+            self.totals, self.counts, self.events = {}, {}, []
+
+        if writter is not None:
+            for path, total in totals.items():
+                writter.add_scalar('profiling/' + path, total, frame)
+                writter.add_scalar('profiling_calls/' + path, counts[path], frame)
+
+        if self.trace_path is not None and len(events) > 0:
+            # json array format, the closing bracket is optional so events can be appended every epoch
+            if self.trace_file is None:
+                self.trace_file = open(self.trace_path, 'w')
+                self.trace_file.write('[\n')
+            for event in events:
+                self.trace_file.write(json.dumps(event) + ',\n')
+            self.trace_file.flush()
+
+    def close(self):
+        if self.trace_file is not None:
+            self.trace_file.close()
+            self.trace_file = None
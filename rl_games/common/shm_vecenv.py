@@ -0,0 +1,330 @@
+import atexit
+import multiprocessing
+import traceback
+from multiprocessing import shared_memory
+
+try:
+    from multiprocessing import resource_tracker
+except ImportError:
+    # windows
+    resource_tracker = None
+
+import numpy as np
+
+from rl_games.common.ivecenv import IVecEnv
+from rl_games.common.tr_helpers import dicts_to_dict_with_arrays
+
+
+def _flatten(value, prefix):
+    '''
+    Flattens obs (array or dict of arrays, one level deep as in RayWorker) to {'prefix/key' : array}.
+    '''
+    if isinstance(value, dict):
+        res = {}
+        for k, v in value.items():
+            res.update(_flatten(v, prefix + '/' + k))
+        return res
+    return {prefix : np.asarray(value)}
+
+
+def _unflatten(arrays, prefix):
+    if prefix in arrays:
+        return arrays[prefix]
+    res = {}
+    for key, value in arrays.items():
+        if key.startswith(prefix + '/'):
+            res[key[len(prefix) + 1:]] = value
+    return res
+
+
+class SharedBuffers:
+    '''
+    numpy arrays in named shared memory blocks. The owner creates them, workers attach to the same blocks by name.
+    '''
+    def __init__(self, layout=None):
+        self.blocks = {}
+        self.arrays = {}
+        self.owner = layout is None
+        if layout is not None:
+            self.attach(layout)
+
+    def create(self, key, shape, dtype):
+        dtype = np.dtype(dtype)
+        size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        block = shared_memory.SharedMemory(create=True, size=size)
+        self.blocks[key] = block
+        self.arrays[key] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        self.arrays[key].fill(0)
+
+    def layout(self):
+        return {key : (self.blocks[key].name, arr.shape, arr.dtype.str) for key, arr in self.arrays.items()}
+
+    def attach(self, layout):
+        for key, (name, shape, dtype) in layout.items():
+            if key in self.blocks:
+                continue
+            block = shared_memory.SharedMemory(name=name)
+            self.blocks[key] = block
+            self.arrays[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+
+    def close(self):
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+            if self.owner:
+                block.unlink()
+        self.blocks = {}
+
+
+def _shm_worker(index, config_name, config, seed, pipe, parent_pipe):
+    parent_pipe.close()
+    # same env wrapper as ray uses: fp32 obs and reset on done
+    from rl_games.common.vecenv import RayWorker
+
+    def obs_arrays(obs):
+        if use_global_obs:
+            arrays = _flatten(obs['obs'], 'obs')
+            arrays.update(_flatten(obs['state'], 'states'))
+            return arrays
+        return _flatten(obs, 'obs')
+
+    buffers = None
+    try:
+        worker = RayWorker(config_name, config)
+        use_global_obs = worker.get_env_info()['use_global_observations']
+        # shapes of the shared buffers, sampled before seeding so the seeded envs match the ray ones
+        spec = {key : (value.shape, value.dtype.str) for key, value in obs_arrays(worker.reset()).items()}
+        if seed is not None:
+            worker.seed(seed)
+    except Exception:
+        pipe.send(('error', traceback.format_exc()))
+        pipe.close()
+        return
+    pipe.send(('ok', spec))
+
+    def write_obs(obs):
+        for key, value in obs_arrays(obs).items():
+            buf = buffers.arrays[key][index]
+            buf[...] = value.reshape(buf.shape)
+        # once the mask buffer is attached the next masks are written with every step and reset
+        if 'action_masks' in buffers.arrays:
+            write_action_mask()
+
+    def write_action_mask():
+        buf = buffers.arrays['action_masks'][index]
+        buf[...] = worker.get_action_mask().reshape(buf.shape)
+
+    while True:
+        try:
+            cmd, data = pipe.recv()
+        except EOFError:
+            break
+        try:
+            if cmd == 'step':
+                obs, reward, done, info = worker.step(data)
+                write_obs(obs)
+                rewards, dones = buffers.arrays['rewards'][index], buffers.arrays['dones'][index]
+                rewards[...] = np.asarray(reward, dtype=rewards.dtype).reshape(rewards.shape)
+                dones[...] = np.asarray(done).reshape(dones.shape)
+                res = info
+            elif cmd == 'reset':
+                write_obs(worker.reset())
+                res = None
+            elif cmd == 'action_mask':
+                if data:
+                    write_action_mask()
+                    res = None
+                else:
+                    mask = worker.get_action_mask()
+                    res = (mask.shape, mask.dtype.str)
+            elif cmd == 'attach':
+                if buffers is None:
+                    buffers = SharedBuffers(data)
+                else:
+                    buffers.attach(data)
+                res = None
+            elif cmd == 'get_env_info':
+                res = (worker.get_env_info(), worker.get_number_of_agents(), worker.can_concat_infos())
+            elif cmd == 'set_weights':
+                worker.set_weights(data)
+                res = None
+            elif cmd == 'close':
+                pipe.send(('ok', None))
+                break
+            else:
+                raise ValueError(f'Unknown command {cmd}')
+            pipe.send(('ok', res))
+        except Exception:
+            pipe.send(('error', traceback.format_exc()))
+
+    pipe.close()
+
+
+class SharedMemoryVecEnv(IVecEnv):
+    '''
+    Runs num_actors envs in subprocesses on the local machine. Obs, states, rewards, dones and action masks are written
+    by the workers straight into preallocated shared memory arrays, so only the actions and infos are pickled.
+    Workers are synced with one pipe each, a step is a send of the actions and a receive of the infos.
+    Returns the same obs, rewards, dones and infos as RayVecEnv, including dict obs, central value states,
+    action masks and multi agent envs. Returned arrays are copies, shared buffers are reused on the next step.
+    Select it with vecenv_type: SHM in env_config.
+    '''
+    def __init__(self, config_name, num_actors, **kwargs):
+        self.config_name = config_name
+        self.num_actors = num_actors
+        self.seed = kwargs.pop('seed', None)
+        start_method = kwargs.pop('shm_start_method', 'spawn')
+        ctx = multiprocessing.get_context(start_method)
+        if resource_tracker is not None:
+            # workers have to share the tracker of this process, otherwise a forked worker starts its own
+            # and it unlinks the attached blocks when the worker exits
+            resource_tracker.ensure_running()
+
+        self.pipes = []
+        self.processes = []
+        for i in range(num_actors):
+            seed = self.seed + i if self.seed is not None else None
+            parent_pipe, child_pipe = ctx.Pipe()
+            process = ctx.Process(target=_shm_worker, args=(i, config_name, kwargs, seed, child_pipe, parent_pipe), daemon=True)
+            process.start()
+            child_pipe.close()
+            self.pipes.append(parent_pipe)
+            self.processes.append(process)
+        self.closed = False
+        atexit.register(self.close)
+        spec = self._recv(range(num_actors))[0]
+
+        self.env_info, self.num_agents, self.concat_infos = self._call(0, 'get_env_info')
+        self.use_global_obs = self.env_info['use_global_observations']
+        self.value_size = self.env_info.get('value_size', 1)
+
+        self.buffers = SharedBuffers()
+        for key, (shape, dtype) in spec.items():
+            self.buffers.create(key, (num_actors, *shape), dtype)
+        reward_shape = (self.num_agents, self.value_size) if self.value_size > 1 else (self.num_agents,)
+        self.buffers.create('rewards', (num_actors, *reward_shape), np.float32)
+        self.buffers.create('dones', (num_actors, self.num_agents), np.bool_)
+        self._broadcast('attach', self.buffers.layout())
+        # in-flight step_async calls, keyed by the first actor of the slice
+        self.pending_steps = {}
+
+    def _send(self, indices, cmd, data=None):
+        for i in indices:
+            self.pipes[i].send((cmd, data))
+
+    def _recv(self, indices):
+        results = []
+        for i in indices:
+            status, res = self.pipes[i].recv()
+            if status == 'error':
+                raise RuntimeError(f'SHM env worker {i} failed:\n{res}')
+            results.append(res)
+        return results
+
+    def _call(self, index, cmd, data=None):
+        self._send([index], cmd, data)
+        return self._recv([index])[0]
+
+    def _broadcast(self, cmd, data=None):
+        indices = range(self.num_actors)
+        self._send(indices, cmd, data)
+        return self._recv(indices)
+
+    def _actors(self, value, actor_slice):
+        '''
+        Copies rows of actor_slice from a shared buffer, rows of the agents of an actor are concatenated like in RayVecEnv.
+        '''
+        value = value[actor_slice]
+        if self.num_agents > 1:
+            value = value.reshape(-1, *value.shape[2:])
+        return value.copy()
+
+    def _get_obs(self, actor_slice):
+        arrays = self.buffers.arrays
+        obs = {key : self._actors(value, actor_slice) for key, value in arrays.items() if key.startswith('obs')}
+        ret_obs = _unflatten(obs, 'obs')
+        if self.use_global_obs:
+            # states are stacked per actor, as in RayVecEnv
+            states = {key : value[actor_slice].copy() for key, value in arrays.items() if key.startswith('states')}
+            ret_obs = {'obs' : ret_obs, 'states' : _unflatten(states, 'states')}
+        return ret_obs
+
+    def _launch_step(self, actions, actor_slice):
+        indices = range(self.num_actors)[actor_slice]
+        for num, i in enumerate(indices):
+            if self.num_agents == 1:
+                action = actions[num]
+            else:
+                action = actions[self.num_agents * num: self.num_agents * num + self.num_agents]
+            self.pipes[i].send(('step', action))
+
+    def _collect_step(self, actor_slice):
+        infos = self._recv(range(self.num_actors)[actor_slice])
+        rewards = self._actors(self.buffers.arrays['rewards'], actor_slice)
+        if self.num_agents == 1:
+            rewards = rewards.reshape(rewards.shape[0], *rewards.shape[2:])
+        dones = self.buffers.arrays['dones'][actor_slice].reshape(-1).copy()
+        if self.concat_infos:
+            infos = dicts_to_dict_with_arrays(infos, False)
+        return self._get_obs(actor_slice), rewards, dones, infos
+
+    def step(self, actions):
+        actor_slice = slice(0, self.num_actors)
+        self._launch_step(actions, actor_slice)
+        return self._collect_step(actor_slice)
+
+    def has_async_step(self):
+        return True
+
+    def step_async(self, actions, actor_slice):
+        assert actor_slice.start not in self.pending_steps
+        self._launch_step(actions, actor_slice)
+        self.pending_steps[actor_slice.start] = actor_slice
+
+    def step_wait(self, actor_slice):
+        return self._collect_step(self.pending_steps.pop(actor_slice.start))
+
+    def reset(self):
+        self._broadcast('reset')
+        return self._get_obs(slice(0, self.num_actors))
+
+    def get_env_info(self):
+        return self.env_info
+
+    def get_number_of_agents(self):
+        return self.num_agents
+
+    def set_weights(self, indices, weights):
+        self._send(indices, 'set_weights', weights)
+        self._recv(indices)
+
+    def has_action_masks(self):
+        return True
+
+    def get_action_masks(self):
+        # the first call allocates the mask buffer, after that workers write masks with every step and reset
+        if 'action_masks' not in self.buffers.arrays:
+            shape, dtype = self._call(0, 'action_mask', False)
+            self.buffers.create('action_masks', (self.num_actors, *shape), dtype)
+            self._broadcast('attach', self.buffers.layout())
+            self._broadcast('action_mask', True)
+        masks = self.buffers.arrays['action_masks']
+        return masks.reshape(-1, *masks.shape[2:]).copy()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for pipe, process in zip(self.pipes, self.processes):
+            try:
+                if process.is_alive():
+                    pipe.send(('close', None))
+                    pipe.recv()
+            except (BrokenPipeError, EOFError, ConnectionResetError):
+                pass
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+            pipe.close()
+        if hasattr(self, 'buffers'):
+            self.buffers.close()
@@ -0,0 +1,200 @@
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from rl_games.common.ivecenv import IVecEnv
+from rl_games.common.shm_vecenv import _flatten, _unflatten
+from rl_games.common.tr_helpers import dicts_to_dict_with_arrays
+
+
+class ThreadedVecEnv(IVecEnv):
+    '''
+    Steps num_actors envs of the current process in a thread pool. Good for simulators which release the GIL in step
+    (MuJoCo, Box2D, pybullet): there is no serialization and no process boundary at all. Every thread steps a chunk
+    of envs and writes obs, states, rewards, dones and action masks into preallocated numpy arrays.
+    Returns the same obs, rewards, dones and infos as RayVecEnv. Returned arrays are copies, buffers are reused on the next step.
+    Select it with vecenv_type: THREADED in env_config. num_threads sets the pool size (default min(num_actors, cpu count)),
+    thread_affinity pins the pool threads to cpus: True for all cpus available to the process or a list of cpu ids.
+    '''
+    def __init__(self, config_name, num_actors, **kwargs):
+        # same env wrapper as ray uses: fp32 obs and reset on done
+        from rl_games.common.vecenv import RayWorker
+
+        self.config_name = config_name
+        self.num_actors = num_actors
+        self.seed = kwargs.pop('seed', None)
+        self.num_threads = min(kwargs.pop('num_threads', os.cpu_count() or 1), num_actors)
+        thread_affinity = kwargs.pop('thread_affinity', None)
+        self.cpus = self._get_cpus(thread_affinity)
+        self.thread_counter = itertools.count()
+
+        self.workers = [RayWorker(config_name, kwargs) for _ in range(num_actors)]
+        self.env_info = self.workers[0].get_env_info()
+        self.num_agents = self.workers[0].get_number_of_agents()
+        self.concat_infos = self.workers[0].can_concat_infos()
+        self.use_global_obs = self.env_info['use_global_observations']
+        self.value_size = self.env_info.get('value_size', 1)
+
+        # shapes of the buffers, sampled before seeding so the seeded envs match the ray ones
+        spec = {key : (value.shape, value.dtype) for key, value in self._obs_arrays(self.workers[0].reset()).items()}
+        if self.seed is not None:
+            for i, worker in enumerate(self.workers):
+                worker.seed(self.seed + i)
+
+        self.arrays = {}
+        for key, (shape, dtype) in spec.items():
+            self.arrays[key] = np.zeros((num_actors, *shape), dtype=dtype)
+        reward_shape = (self.num_agents, self.value_size) if self.value_size > 1 else (self.num_agents,)
+        self.arrays['rewards'] = np.zeros((num_actors, *reward_shape), dtype=np.float32)
+        self.arrays['dones'] = np.zeros((num_actors, self.num_agents), dtype=np.bool_)
+        # once allocated by get_action_masks, masks are written with every step and reset
+        self.fuse_action_masks = False
+        self.infos = [None] * num_actors
+
+        self.executor = ThreadPoolExecutor(max_workers=self.num_threads, thread_name_prefix='rl_games_vecenv',
+                                           initializer=self._init_thread)
+        # env index chunks of an actor slice, one task per chunk
+        self.chunks = {}
+        # in-flight step_async calls, keyed by the first actor of the slice
+        self.pending_steps = {}
+
+    def _get_cpus(self, thread_affinity):
+        if not thread_affinity:
+            return None
+        if not hasattr(os, 'sched_setaffinity'):
+            print('thread_affinity is not supported on this platform, threads are not pinned')
+            return None
+        if thread_affinity is True:
+            return sorted(os.sched_getaffinity(0))
+        return list(thread_affinity)
+
+    def _init_thread(self):
+        if self.cpus is not None:
+            # pid 0 is the calling thread on linux
+            cpu = self.cpus[next(self.thread_counter) % len(self.cpus)]
+            os.sched_setaffinity(0, {cpu})
+
+    def _obs_arrays(self, obs):
+        if self.use_global_obs:
+            arrays = _flatten(obs['obs'], 'obs')
+            arrays.update(_flatten(obs['state'], 'states'))
+            return arrays
+        return _flatten(obs, 'obs')
+
+    def _get_chunks(self, actor_slice):
+        key = (actor_slice.start, actor_slice.stop)
+        if key not in self.chunks:
+            indices = np.arange(self.num_actors)[actor_slice]
+            self.chunks[key] = [chunk for chunk in np.array_split(indices, min(self.num_threads, len(indices))) if len(chunk) > 0]
+        return self.chunks[key]
+
+    def _write_obs(self, index, obs):
+        for key, value in self._obs_arrays(obs).items():
+            buf = self.arrays[key][index]
+            buf[...] = value.reshape(buf.shape)
+        if self.fuse_action_masks:
+            self._write_action_mask(index)
+
+    def _write_action_mask(self, index):
+        buf = self.arrays['action_masks'][index]
+        buf[...] = self.workers[index].get_action_mask().reshape(buf.shape)
+
+    def _step_envs(self, indices, actions, offset):
+        rewards, dones = self.arrays['rewards'], self.arrays['dones']
+        for i in indices:
+            num = i - offset
+            if self.num_agents == 1:
+                action = actions[num]
+            else:
+                action = actions[self.num_agents * num: self.num_agents * num + self.num_agents]
+            obs, reward, done, info = self.workers[i].step(action)
+            self._write_obs(i, obs)
+            rewards[i] = np.asarray(reward, dtype=rewards.dtype).reshape(rewards.shape[1:])
+            dones[i] = np.asarray(done).reshape(dones.shape[1:])
+            self.infos[i] = info
+
+    def _reset_envs(self, indices):
+        for i in indices:
+            self._write_obs(i, self.workers[i].reset())
+
+    def _actors(self, value, actor_slice):
+        '''
+        Copies rows of actor_slice from a buffer, rows of the agents of an actor are concatenated like in RayVecEnv.
+        '''
+        value = value[actor_slice]
+        if self.num_agents > 1:
+            value = value.reshape(-1, *value.shape[2:])
+        return value.copy()
+
+    def _get_obs(self, actor_slice):
+        obs = {key : self._actors(value, actor_slice) for key, value in self.arrays.items() if key.startswith('obs')}
+        ret_obs = _unflatten(obs, 'obs')
+        if self.use_global_obs:
+            # states are stacked per actor, as in RayVecEnv
+            states = {key : value[actor_slice].copy() for key, value in self.arrays.items() if key.startswith('states')}
+            ret_obs = {'obs' : ret_obs, 'states' : _unflatten(states, 'states')}
+        return ret_obs
+
+    def _launch_step(self, actions, actor_slice):
+        return [self.executor.submit(self._step_envs, chunk, actions, actor_slice.start) for chunk in self._get_chunks(actor_slice)]
+
+    def _collect_step(self, futures, actor_slice):
+        for future in futures:
+            future.result()
+        rewards = self._actors(self.arrays['rewards'], actor_slice)
+        if self.num_agents == 1:
+            rewards = rewards.reshape(rewards.shape[0], *rewards.shape[2:])
+        dones = self.arrays['dones'][actor_slice].reshape(-1).copy()
+        infos = self.infos[actor_slice]
+        if self.concat_infos:
+            infos = dicts_to_dict_with_arrays(infos, False)
+        return self._get_obs(actor_slice), rewards, dones, infos
+
+    def step(self, actions):
+        actor_slice = slice(0, self.num_actors)
+        return self._collect_step(self._launch_step(actions, actor_slice), actor_slice)
+
+    def has_async_step(self):
+        return True
+
+    def step_async(self, actions, actor_slice):
+        assert actor_slice.start not in self.pending_steps
+        self.pending_steps[actor_slice.start] = (self._launch_step(actions, actor_slice), actor_slice)
+
+    def step_wait(self, actor_slice):
+        return self._collect_step(*self.pending_steps.pop(actor_slice.start))
+
+    def reset(self):
+        actor_slice = slice(0, self.num_actors)
+        for future in [self.executor.submit(self._reset_envs, chunk) for chunk in self._get_chunks(actor_slice)]:
+            future.result()
+        return self._get_obs(actor_slice)
+
+    def get_env_info(self):
+        return self.env_info
+
+    def get_number_of_agents(self):
+        return self.num_agents
+
+    def set_weights(self, indices, weights):
+        for i in indices:
+            self.workers[i].set_weights(weights)
+
+    def has_action_masks(self):
+        return True
+
+    def get_action_masks(self):
+        # the first call allocates the mask buffer, after that masks are written with every step and reset
+        if not self.fuse_action_masks:
+            mask = self.workers[0].get_action_mask()
+            self.arrays['action_masks'] = np.zeros((self.num_actors, *mask.shape), dtype=mask.dtype)
+            for i in range(self.num_actors):
+                self._write_action_mask(i)
+            self.fuse_action_masks = True
+        masks = self.arrays['action_masks']
+        return masks.reshape(-1, *masks.shape[2:]).copy()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
@@ -68,6 +68,74 @@ def dicts_to_dict_with_arrays(dicts, add_batch_dim = True):
     res = {k : concat_func(v)  for k,v in res.items()}
     return res
 
+class _BatchField:
+    def __init__(self, values, stack, num_buffers):
+        self.stack = stack
+        first = np.asarray(values[0])
+        if stack or first.ndim == 0:
+            self.stack = True
+            shape = (len(values),) + first.shape
+        else:
+            shape = (sum(np.shape(v)[0] for v in values),) + first.shape[1:]
+        self.buffers = [np.empty(shape, dtype=first.dtype) for _ in range(num_buffers)]
+        self.index = 0
+
+    def write(self, values):
+        out = self.buffers[self.index]
+        self.index = (self.index + 1) % len(self.buffers)
+        if self.stack:
+            np.stack(values, out=out)
+        else:
+            np.concatenate(values, out=out)
+        return out
+
+
+class BatchAssembler:
+    '''
+    Assembles results of vec env workers into batch arrays without allocating them every step.
+    Schema of a field (keys, shapes and dtypes) is taken from its first batch, next batches are written in place.
+    A batch which doesn't fit the schema reallocates the field.
+    Values are stacked (one row per worker) or concatenated (workers return several rows, i.e. agents).
+    num_buffers sets of output arrays are used in turn, so a returned batch stays valid while
+    the next num_buffers - 1 batches are assembled.
+    '''
+    def __init__(self, num_buffers=2):
+        self.num_buffers = num_buffers
+        self.fields = {}
+
+    def assemble(self, name, values, stack=True):
+        if isinstance(values[0], dict):
+            return {k : self.assemble(name + '/' + k, [v[k] for v in values], stack) for k in values[0]}
+        field = self.fields.get(name)
+        if field is None:
+            field = self.fields[name] = _BatchField(values, stack, self.num_buffers)
+        try:
+            return field.write(values)
+        except (ValueError, TypeError):
+            # dtype (i.e. int rewards followed by float ones) or shape changed from the first batch, buffers are reallocated
+            field = self.fields[name] = _BatchField(values, stack, self.num_buffers)
+            return field.write(values)
+
+    def assemble_infos(self, infos):
+        '''
+        Same as dicts_to_dict_with_arrays(infos, False) if all infos have the same keys, falls back to it otherwise.
+        '''
+        if len(infos) <= 1:
+            return dicts_to_dict_with_arrays(infos, False)
+        keys = tuple(infos[0].keys())
+        if any(tuple(info.keys()) != keys for info in infos):
+            return dicts_to_dict_with_arrays(infos, False)
+        if any(isinstance(v, dict) or np.asarray(v).dtype.kind not in 'biuf' for v in infos[0].values()):
+            return dicts_to_dict_with_arrays(infos, False)
+        name = 'infos/' + '/'.join(keys)
+        try:
+            return {k : self.assemble(name + '/' + k, [info[k] for info in infos], False) for k in keys}
+        except (ValueError, TypeError):
+            # shapes changed from the first batch
+            self.fields = {k : v for k, v in self.fields.items() if not k.startswith(name + '/')}
+            return dicts_to_dict_with_arrays(infos, False)
+
+
 def unsqueeze_obs(obs):
     if type(obs) is dict:
         for k,v in obs.items():
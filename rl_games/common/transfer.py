@@ -0,0 +1,71 @@
+import numpy as np
+import torch
+
+from rl_games.algos_torch.torch_ext import numpy_to_torch_dtype_dict
+
+
+class TransferManager:
+    '''
+    Moves numpy arrays returned by vec envs to the device and actions back to the host through preallocated host buffers.
+    On cuda the host buffers are pinned and host->device copies are non blocking. Every (key, shape, dtype) has num_slots
+    buffers which are used in turn, a buffer is reused only after the copy which used it last time is finished.
+    On cpu there is nothing to pin and the host buffers are returned as they are, so a returned tensor is valid
+    until the same key is transferred num_slots more times.
+    '''
+    def __init__(self, device, num_slots=2):
+        self.device = torch.device(device)
+        self.is_cuda = self.device.type == 'cuda' and torch.cuda.is_available()
+        self.num_slots = num_slots
+        self.buffers = {}
+        self.events = {}
+        self.slots = {}
+
+    def _get_buffer(self, key, shape, dtype):
+        buffer_key = (key, shape, dtype)
+        if buffer_key not in self.buffers:
+            self.buffers[buffer_key] = [torch.zeros(shape, dtype=dtype, pin_memory=self.is_cuda) for _ in range(self.num_slots)]
+            self.events[buffer_key] = [None] * self.num_slots
+            self.slots[buffer_key] = 0
+
+        slot = self.slots[buffer_key]
+        self.slots[buffer_key] = (slot + 1) % self.num_slots
+        event = self.events[buffer_key][slot]
+        if event is not None:
+            event.synchronize()
+        return buffer_key, slot, self.buffers[buffer_key][slot]
+
+    def _record(self, buffer_key, slot):
+        if self.is_cuda:
+            event = torch.cuda.Event()
+            event.record()
+            self.events[buffer_key][slot] = event
+
+    def to_device(self, key, array, dtype=None):
+        '''
+        Copies numpy array to the device. If dtype is None, dtype of the array is kept.
+        '''
+        array = np.asarray(array)
+        if dtype is None:
+            dtype = numpy_to_torch_dtype_dict[array.dtype]
+        buffer_key, slot, host = self._get_buffer(key, array.shape, dtype)
+        np.copyto(host.numpy(), array, casting='unsafe')
+        if not self.is_cuda:
+            return host
+
+        res = host.to(self.device, non_blocking=True)
+        self._record(buffer_key, slot)
+        return res
+
+    def to_host(self, key, tensor):
+        '''
+        Copies tensor to the host and returns it as numpy array.
+        '''
+        if not self.is_cuda or not tensor.is_cuda:
+            return tensor.cpu().numpy()
+
+        buffer_key, slot, host = self._get_buffer(key, tuple(tensor.size()), tensor.dtype)
+        host.copy_(tensor, non_blocking=True)
+        self._record(buffer_key, slot)
+        # the env reads actions right away
+        self.events[buffer_key][slot].synchronize()
+        return host.numpy()
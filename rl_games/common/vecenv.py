@@ -1,16 +1,30 @@
 import ray
 from rl_games.common.ivecenv import IVecEnv
 from rl_games.common.env_configurations import configurations
-from rl_games.common.tr_helpers import dicts_to_dict_with_arrays
+from rl_games.common.tr_helpers import BatchAssembler
+from rl_games.algos_torch import torch_ext
+from rl_games.common.obs_compression import check_obs_compression, compress_obs
 import numpy as np
 import gym
 import random
+import time
 from time import sleep
 import torch
+from collections import defaultdict
 
 class RayWorker:
     def __init__(self, config_name, config):
+        # obs key -> compression applied before obs leave the worker, see obs_compression
+        self.obs_compression = config.get('obs_compression')
+        if self.obs_compression is not None:
+            check_obs_compression(self.obs_compression)
+        config = {k : v for k, v in config.items() if k != 'obs_compression'}
         self.env = configurations[config_name]['env_creator'](**config)
+        self.use_global_obs = getattr(self.env, 'use_central_value', False)
+        # step and reset also return the next action mask, saves a round trip per step
+        self.fuse_action_masks = False
+        # version of the weights set with set_weights_ref
+        self.weights_version = None
 
     def _obs_to_fp32(self, obs):
         if isinstance(obs, dict):
@@ -27,6 +41,16 @@ class RayWorker:
                 obs = obs.astype(np.float32)
         return obs
 
+    def _compress_obs(self, obs):
+        obs = self._obs_to_fp32(obs)
+        if self.obs_compression is None:
+            return obs
+        if self.use_global_obs:
+            # states of the central value are not compressed
+            obs['obs'] = compress_obs(obs['obs'], self.obs_compression)
+            return obs
+        return compress_obs(obs, self.obs_compression)
+
     def step(self, action):
         next_state, reward, is_done, info = self.env.step(action)
         
@@ -35,8 +59,10 @@ class RayWorker:
         else:
             episode_done = is_done.all()
         if episode_done:
-            next_state = self.reset()
-        next_state = self._obs_to_fp32(next_state)
+            next_state = self._reset()
+        next_state = self._compress_obs(next_state)
+        if self.fuse_action_masks:
+            return next_state, reward, is_done, info, self.get_action_mask()
         return next_state, reward, is_done, info
 
     def seed(self, seed):
@@ -50,13 +76,23 @@ class RayWorker:
     def render(self):
         self.env.render()
 
-    def reset(self):
+    def _reset(self):
         obs = self.env.reset()
-        obs = self._obs_to_fp32(obs)
+        obs = self._compress_obs(obs)
+        return obs
+
+    def reset(self):
+        obs = self._reset()
+        if self.fuse_action_masks:
+            return obs, self.get_action_mask()
         return obs
 
     def get_action_mask(self):
-        return self.env.get_action_mask()
+        # one row per agent, masks of single agent envs are concatenated to (num_actors, actions) like the ones of multi agent envs
+        return np.asarray(self.env.get_action_mask(), dtype=np.bool_).reshape(self.get_number_of_agents(), -1)
+
+    def set_fuse_action_masks(self, fuse_action_masks):
+        self.fuse_action_masks = fuse_action_masks
 
     def get_number_of_agents(self):
         if hasattr(self.env, 'get_number_of_agents'):
@@ -65,7 +101,20 @@ class RayWorker:
             return 1
 
     def set_weights(self, weights):
-        self.env.update_weights(weights)
+        # float16 weights are sent to halve the transfer, envs get them as float32
+        self.env.update_weights(torch_ext.state_dict_to_float(weights))
+
+    def set_weights_ref(self, weights_ref, version):
+        '''
+        weights_ref is a list with the object ref of weights put once to the object store for all workers.
+        Refs in a list are not resolved by ray, so the weights are only fetched if the version is new.
+        '''
+        if version != self.weights_version:
+            self.set_weights(ray.get(weights_ref[0]))
+            self.weights_version = version
+
+    def get_node_ip(self):
+        return ray.util.get_node_ip_address()
 
     def can_concat_infos(self):
         if hasattr(self.env, 'concat_infos'):
@@ -92,20 +141,123 @@ class RayWorker:
             info['value_size'] = self.env.value_size
         if hasattr(self.env, 'state_space'):
             info['state_space'] = self.env.state_space
+        if self.obs_compression is not None:
+            info['obs_compression'] = self.obs_compression
         return info
 
 
+class RayMultiWorker:
+    '''
+    Hosts num_envs envs in one ray actor. They are stepped in a loop and results are stacked over the envs
+    in the same layout RayVecEnv uses for the whole batch, so the vec env only concatenates the chunks of the workers.
+    '''
+    def __init__(self, config_name, config, num_envs):
+        self.workers = [RayWorker(config_name, config) for _ in range(num_envs)]
+        self.num_agents = self.workers[0].get_number_of_agents()
+        self.use_global_obs = self.workers[0].get_env_info()['use_global_observations']
+        self.fuse_action_masks = False
+
+    def _stack(self, values, stack):
+        if isinstance(values[0], dict):
+            return {k : self._stack([v[k] for v in values], stack) for k in values[0]}
+        return np.stack(values) if stack else np.concatenate(values)
+
+    def _stack_obs(self, obs):
+        if self.use_global_obs:
+            return {
+                'obs' : self._stack([o['obs'] for o in obs], self.num_agents == 1),
+                'state' : self._stack([o['state'] for o in obs], True),
+            }
+        return self._stack(obs, self.num_agents == 1)
+
+    def step(self, actions):
+        newobs, newrewards, newdones, newinfos = [], [], [], []
+        for num, worker in enumerate(self.workers):
+            if self.num_agents == 1:
+                action = actions[num]
+            else:
+                action = actions[self.num_agents * num: self.num_agents * num + self.num_agents]
+            obs, reward, done, info = worker.step(action)
+            newobs.append(obs)
+            newrewards.append(reward)
+            newdones.append(done)
+            newinfos.append(info)
+        stack = self.num_agents == 1
+        res = self._stack_obs(newobs), self._stack(newrewards, stack), self._stack(newdones, stack), newinfos
+        if self.fuse_action_masks:
+            return res + (self.get_action_mask(),)
+        return res
+
+    def seed(self, seed):
+        for num, worker in enumerate(self.workers):
+            worker.seed(seed + num)
+
+    def reset(self):
+        obs = self._stack_obs([worker._reset() for worker in self.workers])
+        if self.fuse_action_masks:
+            return obs, self.get_action_mask()
+        return obs
+
+    def get_action_mask(self):
+        return np.concatenate([worker.get_action_mask() for worker in self.workers], axis=0)
+
+    def set_fuse_action_masks(self, fuse_action_masks):
+        # masks of the envs are collected once per call, after all of them have stepped
+        self.fuse_action_masks = fuse_action_masks
+
+    def get_number_of_agents(self):
+        return self.num_agents
+
+    def set_weights(self, weights, indices=None):
+        indices = range(len(self.workers)) if indices is None else indices
+        for ind in indices:
+            self.workers[ind].set_weights(weights)
+
+    def set_weights_ref(self, weights_ref, version, indices=None):
+        # weights are fetched once for all envs of the worker
+        indices = range(len(self.workers)) if indices is None else indices
+        indices = [ind for ind in indices if self.workers[ind].weights_version != version]
+        if len(indices) > 0:
+            self.set_weights(ray.get(weights_ref[0]), indices)
+            for ind in indices:
+                self.workers[ind].weights_version = version
+
+    def get_node_ip(self):
+        return ray.util.get_node_ip_address()
+
+    def can_concat_infos(self):
+        return self.workers[0].can_concat_infos()
+
+    def get_env_info(self):
+        return self.workers[0].get_env_info()
+
+
 class RayVecEnv(IVecEnv):
     def __init__(self, config_name, num_actors, **kwargs):
         self.config_name = config_name
         self.num_actors = num_actors
         self.use_torch = False
         self.seed = kwargs.pop('seed', None)
-        self.remote_worker = ray.remote(RayWorker)
-        self.workers = [self.remote_worker.remote(self.config_name, kwargs) for i in range(self.num_actors)]
+        # envs hosted by one ray actor, fewer processes and remote calls per step
+        self.envs_per_worker = kwargs.pop('envs_per_worker', 1)
+        # seconds step waits for the workers. Workers which miss it are stragglers: their last results are returned
+        # again and get_step_masks marks their transitions as invalid until they catch up. None waits for all workers
+        self.step_timeout = kwargs.pop('step_timeout', None)
+        # stragglers pending for longer than this many seconds are killed and replaced by a new worker
+        self.straggler_restart_timeout = kwargs.pop('straggler_restart_timeout', None)
+        self.worker_config = kwargs
+        # weights of every env as (version, object ref), set_weights puts weights to the object store only once
+        self.weights_version = 0
+        self.env_weights = [None] * self.num_actors
+        if self.envs_per_worker > 1:
+            self.remote_worker = ray.remote(RayMultiWorker)
+        else:
+            self.remote_worker = ray.remote(RayWorker)
+        self.workers = [self._create_worker(start) for start in range(0, self.num_actors, self.envs_per_worker)]
 
         if self.seed is not None:
-            seeds = range(self.seed, self.seed + self.num_actors)
+            # a multi worker seeds its envs with seed + env index, as if every env had its own worker
+            seeds = range(self.seed, self.seed + self.num_actors, self.envs_per_worker)
             seed_set = []
             for (seed, worker) in zip(seeds, self.workers):	        
                 seed_set.append(worker.seed.remote(seed))
@@ -120,26 +272,78 @@ class RayVecEnv(IVecEnv):
         can_concat_infos = ray.get(res)
         self.use_global_obs = env_info['use_global_observations']
         self.concat_infos = can_concat_infos
-        self.obs_type_dict = type(env_info.get('observation_space')) is gym.spaces.Dict
-        self.state_type_dict = type(env_info.get('state_space')) is gym.spaces.Dict
-        if self.num_agents == 1:
-            self.concat_func = np.stack
-        else:
-            self.concat_func = np.concatenate
+        # results of a worker are one row per actor, or several rows for multiple agents and multi env workers
+        self.stack_results = self.num_agents == 1 and self.envs_per_worker == 1
+        # preallocated outputs, one assembler per actor slice of step_async
+        self.assemblers = {}
+        # in-flight step_async calls, keyed by the first actor of the slice
+        self.pending_steps = {}
+        # bool masks of the last step or reset. Workers return them with the transition after the first get_action_masks
+        self.action_masks = None
+        self.fuse_action_masks = False
+
+        if self.step_timeout is not None:
+            # rows of the batch returned by one worker
+            self.worker_rows = self.num_agents * self.envs_per_worker
+            # worker index -> (object ref, launch time, True if the ref is the reset of a restarted worker)
+            self.stragglers = {}
+            # last results of every worker, returned again while it is a straggler
+            self.last_results = [None] * len(self.workers)
+            self.step_masks = np.ones(self.num_actors * self.num_agents, dtype=np.bool_)
+            self.step_latencies = [[] for _ in self.workers]
+            self.worker_ips = ray.get([worker.get_node_ip.remote() for worker in self.workers])
+            self.num_restarts = 0
+            self.has_step_results = False
+
+    def _create_worker(self, start):
+        if self.envs_per_worker > 1:
+            return self.remote_worker.remote(self.config_name, self.worker_config, min(self.envs_per_worker, self.num_actors - start))
+        return self.remote_worker.remote(self.config_name, self.worker_config)
     
-    def step(self, actions):
-        newobs, newstates, newrewards, newdones, newinfos = [], [], [], [], []
-        res_obs = []
-        if self.num_agents == 1:
-            for (action, worker) in zip(actions, self.workers):	        
-                res_obs.append(worker.step.remote(action))
+    def _worker_actions(self, actions, num):
+        if self.num_agents == 1 and self.envs_per_worker == 1:
+            return actions[num]
+        rows = self.num_agents * self.envs_per_worker
+        return actions[rows * num: rows * num + rows]
+
+    def _launch_step(self, actions, workers):
+        return [worker.step.remote(self._worker_actions(actions, num)) for num, worker in enumerate(workers)]
+
+    def _get_assembler(self, actor_slice):
+        key = (actor_slice.start, actor_slice.stop)
+        if key not in self.assemblers:
+            self.assemblers[key] = BatchAssembler()
+        return self.assemblers[key]
+
+    def _combine_obs(self, newobs, newstates, assembler):
+        ret_obs = assembler.assemble('obs', newobs, self.stack_results)
+        if self.use_global_obs:
+            newobsdict = {}
+            newobsdict["obs"] = ret_obs
+            # states are stacked per actor
+            newobsdict["states"] = assembler.assemble('states', newstates, self.envs_per_worker == 1)
+            ret_obs = newobsdict
+        return ret_obs
+
+    def _update_action_masks(self, masks, actor_slice):
+        if actor_slice.start == 0 and actor_slice.stop == self.num_actors:
+            self.action_masks = self._get_assembler(actor_slice).assemble('action_masks', masks, False)
         else:
-            for num, worker in enumerate(self.workers):
-                res_obs.append(worker.step.remote(actions[self.num_agents * num: self.num_agents * num + self.num_agents]))
+            masks = np.concatenate(masks, axis=0)
+            rows = self.action_masks.shape[0] // self.num_actors
+            self.action_masks[actor_slice.start * rows: actor_slice.stop * rows] = masks
+
+    def _collect_step(self, res_obs, actor_slice):
+        return self._combine_results(ray.get(res_obs), actor_slice)
 
-        all_res = ray.get(res_obs)
+    def _combine_results(self, all_res, actor_slice):
+        newobs, newstates, newrewards, newdones, newinfos, newmasks = [], [], [], [], [], []
         for res in all_res:
-            cobs, crewards, cdones, cinfos = res
+            if self.fuse_action_masks:
+                cobs, crewards, cdones, cinfos, cmasks = res
+                newmasks.append(cmasks)
+            else:
+                cobs, crewards, cdones, cinfos = res
             if self.use_global_obs:
                 newobs.append(cobs["obs"])
                 newstates.append(cobs["state"])
@@ -147,82 +351,249 @@ class RayVecEnv(IVecEnv):
                 newobs.append(cobs)
             newrewards.append(crewards)
             newdones.append(cdones)
-            newinfos.append(cinfos)
+            if self.envs_per_worker > 1:
+                newinfos.extend(cinfos)
+            else:
+                newinfos.append(cinfos)
 
-        if self.obs_type_dict:
-            ret_obs = dicts_to_dict_with_arrays(newobs, self.num_agents == 1)
-        else:
-            ret_obs = self.concat_func(newobs)
+        if self.fuse_action_masks:
+            self._update_action_masks(newmasks, actor_slice)
+        assembler = self._get_assembler(actor_slice)
+        ret_obs = self._combine_obs(newobs, newstates, assembler)
+        if self.concat_infos:
+            newinfos = assembler.assemble_infos(newinfos)
+        rewards = assembler.assemble('rewards', newrewards, self.stack_results)
+        dones = assembler.assemble('dones', newdones, self.stack_results)
+        return ret_obs, rewards, dones, newinfos
 
-        if self.use_global_obs:
-            newobsdict = {}
-            newobsdict["obs"] = ret_obs
-            
-            if self.state_type_dict:
-                newobsdict["states"] = dicts_to_dict_with_arrays(newstates, True)
+    def step(self, actions):
+        if self.step_timeout is not None:
+            return self._combine_results(self._step_with_timeout(actions), slice(0, self.num_actors))
+        res_obs = self._launch_step(actions, self.workers)
+        return self._collect_step(res_obs, slice(0, self.num_actors))
+
+    def _step_with_timeout(self, actions):
+        '''
+        Steps the idle workers and waits for all of them until step_timeout. Stragglers don't get new actions,
+        their last results are returned with zero rewards and dones until their pending step arrives.
+        Transitions of stragglers and the one their late step arrives with are marked invalid in step_masks.
+        '''
+        start_time = time.time()
+        refs = {}
+        for num, worker in enumerate(self.workers):
+            if num in self.stragglers:
+                refs[num] = self.stragglers[num][0]
             else:
-                newobsdict["states"] = np.stack(newstates)            
-            ret_obs = newobsdict
-        if self.concat_infos:
-            newinfos = dicts_to_dict_with_arrays(newinfos, False)
-        return ret_obs, self.concat_func(newrewards), self.concat_func(newdones), newinfos
+                refs[num] = worker.step.remote(self._worker_actions(actions, num))
+                self.stragglers[num] = (refs[num], start_time, False)
+        workers_by_ref = {ref : num for num, ref in refs.items()}
+
+        self.step_masks[:] = True
+        results = [None] * len(self.workers)
+        pending = list(refs.values())
+        deadline = start_time + self.step_timeout
+        while pending:
+            # stale results need rewards and infos of at least one worker, the first step waits for it
+            timeout = max(deadline - time.time(), 0) if self.has_step_results else None
+            ready, pending = ray.wait(pending, num_returns=1, timeout=timeout)
+            if not ready:
+                break
+            num = workers_by_ref[ready[0]]
+            _, launch_time, restarted = self.stragglers.pop(num)
+            self.step_latencies[num].append(time.time() - launch_time)
+            if restarted:
+                results[num] = self._restarted_result(num, ray.get(ready[0]))
+                self._mask_worker(num)
+            else:
+                results[num] = ray.get(ready[0])
+                self.has_step_results = True
+                if launch_time != start_time:
+                    # late step of a straggler, its action was played before this step
+                    self._mask_worker(num)
+            self.last_results[num] = results[num]
+
+        now = time.time()
+        for num in self.stragglers:
+            results[num] = self._stale_result(num)
+            self._mask_worker(num)
+        if self.straggler_restart_timeout is not None:
+            for num, (_, launch_time, restarted) in list(self.stragglers.items()):
+                if not restarted and now - launch_time > self.straggler_restart_timeout:
+                    self._restart_worker(num)
+        return results
+
+    def _mask_worker(self, num):
+        self.step_masks[num * self.worker_rows: (num + 1) * self.worker_rows] = False
+
+    def _stale_result(self, num):
+        '''
+        Last results of the worker with zero rewards and dones. Workers which didn't step yet reuse the rewards
+        and infos of the first worker with results.
+        '''
+        last_result = self.last_results[num]
+        template = last_result if last_result[1] is not None else \
+            next(res for res in self.last_results if res is not None and res[1] is not None)
+        obs = last_result[0]
+        res = (obs, np.zeros_like(template[1]), np.zeros_like(template[2]), template[3])
+        if self.fuse_action_masks:
+            res = res + (last_result[-1],)
+        return res
+
+    def _restarted_result(self, num, reset_result):
+        # first obs of a restarted worker ends the episode of its envs
+        template = self._stale_result(num)
+        if self.fuse_action_masks:
+            obs, masks = reset_result
+            return (obs, template[1], np.ones_like(template[2]), template[3], masks)
+        return (reset_result, template[1], np.ones_like(template[2]), template[3])
+
+    def _restart_worker(self, num):
+        ray.kill(self.workers[num], no_restart=True)
+        start = num * self.envs_per_worker
+        worker = self._create_worker(start)
+        if self.seed is not None:
+            worker.seed.remote(self.seed + start)
+        if self.fuse_action_masks:
+            worker.set_fuse_action_masks.remote(True)
+        self.workers[num] = worker
+        # the new worker gets the weights its envs had, refs stay in the object store while env_weights holds them
+        versions = defaultdict(list)
+        for ind in range(start, min(start + self.envs_per_worker, self.num_actors)):
+            if self.env_weights[ind] is not None:
+                versions[self.env_weights[ind]].append(ind - start)
+        for (version, weights_ref), inds in versions.items():
+            self._send_weights(num, inds, version, weights_ref)
+        # calls of an actor run in order, so the reset ref is ready once the worker is up
+        self.stragglers[num] = (worker.reset.remote(), time.time(), True)
+        self.num_restarts += 1
+
+    def has_step_masks(self):
+        return self.step_timeout is not None
+
+    def get_step_masks(self):
+        return self.step_masks
+
+    def get_step_stats(self):
+        '''
+        Step latency of every worker since the last call, tagged by the ip of its node to find slow hosts,
+        and the number of stragglers and restarts.
+        '''
+        if self.step_timeout is None:
+            return {}
+        stats = {'stragglers' : len(self.stragglers), 'restarts' : self.num_restarts}
+        for num, latencies in enumerate(self.step_latencies):
+            if latencies:
+                stats[f'step_latency/{self.worker_ips[num]}/worker_{num}'] = np.array(latencies)
+                latencies.clear()
+        return stats
+
+    def has_async_step(self):
+        return True
+
+    def _worker_slice(self, actor_slice):
+        if self.envs_per_worker == 1:
+            return actor_slice
+        assert actor_slice.start % self.envs_per_worker == 0 and (actor_slice.stop % self.envs_per_worker == 0 or actor_slice.stop == self.num_actors), \
+            'actor slices must not split the envs of a worker, use num_rollout_groups which divides num_actors / envs_per_worker'
+        return slice(actor_slice.start // self.envs_per_worker, -(-actor_slice.stop // self.envs_per_worker))
+
+    def step_async(self, actions, actor_slice):
+        assert self.step_timeout is None, 'step_timeout is not supported with step_async'
+        assert actor_slice.start not in self.pending_steps
+        self.pending_steps[actor_slice.start] = (self._launch_step(actions, self.workers[self._worker_slice(actor_slice)]), actor_slice)
+
+    def step_wait(self, actor_slice):
+        res_obs, actor_slice = self.pending_steps.pop(actor_slice.start)
+        return self._collect_step(res_obs, actor_slice)
 
     def get_env_info(self):
         res = self.workers[0].get_env_info.remote()
         return ray.get(res)
 
+    def _send_weights(self, worker_ind, env_indices, version, weights_ref):
+        if self.envs_per_worker > 1:
+            return self.workers[worker_ind].set_weights_ref.remote([weights_ref], version, env_indices)
+        return self.workers[worker_ind].set_weights_ref.remote([weights_ref], version)
+
     def set_weights(self, indices, weights):
-        res = []
-        for ind in indices:
-            res.append(self.workers[ind].set_weights.remote(weights))
+        '''
+        Puts weights to the object store once instead of sending them with the call of every worker.
+        Workers get the reference and the version of the weights and load them only once per version.
+        '''
+        self.weights_version += 1
+        weights_ref = ray.put(weights)
+        env_indices = defaultdict(list)
+        for ind in np.unique(indices):
+            self.env_weights[ind] = (self.weights_version, weights_ref)
+            env_indices[ind // self.envs_per_worker].append(ind % self.envs_per_worker)
+        res = [self._send_weights(worker_ind, inds, self.weights_version, weights_ref) for worker_ind, inds in env_indices.items()]
         ray.get(res)
 
     def has_action_masks(self):
         return True
 
     def get_action_masks(self):
-        mask = [worker.get_action_mask.remote() for worker in self.workers]
-        masks = ray.get(mask)
-        return np.concatenate(masks, axis=0)
+        '''
+        The first call fetches the masks from the workers and switches them to return the next masks with every
+        step and reset, later calls return the cached masks without remote calls.
+        '''
+        if self.action_masks is None:
+            mask = ray.get([worker.get_action_mask.remote() for worker in self.workers])
+            self._update_action_masks(mask, slice(0, self.num_actors))
+            if self.step_timeout is not None:
+                self.last_results = [res[:4] + (m,) if res is not None else None for res, m in zip(self.last_results, mask)]
+        if not self.fuse_action_masks:
+            ray.get([worker.set_fuse_action_masks.remote(True) for worker in self.workers])
+            self.fuse_action_masks = True
+        return self.action_masks
 
     def reset(self):
+        if self.step_timeout is not None:
+            # pending steps would be returned after the reset
+            ray.get([ref for ref, _, _ in self.stragglers.values()])
+            self.stragglers = {}
         res_obs = [worker.reset.remote() for worker in self.workers]
-        newobs, newstates = [],[]
-        for res in res_obs:
+        newobs, newstates, newmasks = [], [], []
+        for num, res in enumerate(res_obs):
             cobs = ray.get(res)
+            if self.fuse_action_masks:
+                cobs, cmasks = cobs
+                newmasks.append(cmasks)
+            if self.step_timeout is not None:
+                self.last_results[num] = (cobs, None, None, None) + ((cmasks,) if self.fuse_action_masks else ())
             if self.use_global_obs:
                 newobs.append(cobs["obs"])
                 newstates.append(cobs["state"])
             else:
                 newobs.append(cobs)
 
-        if self.obs_type_dict:
-            ret_obs = dicts_to_dict_with_arrays(newobs, self.num_agents == 1)
-        else:
-            ret_obs = self.concat_func(newobs)
-
-        if self.use_global_obs:
-            newobsdict = {}
-            newobsdict["obs"] = ret_obs
-            
-            if self.state_type_dict:
-                newobsdict["states"] = dicts_to_dict_with_arrays(newstates, True)
-            else:
-                newobsdict["states"] = np.stack(newstates)            
-            ret_obs = newobsdict
-        return ret_obs
+        actor_slice = slice(0, self.num_actors)
+        if self.fuse_action_masks:
+            self._update_action_masks(newmasks, actor_slice)
+        return self._combine_obs(newobs, newstates, self._get_assembler(actor_slice))
 
 vecenv_config = {}
 
+# env_config keys consumed by the vec envs, they are not passed to the env creator of a single env (player)
+VECENV_CONFIG_KEYS = ['vecenv_type', 'envs_per_worker', 'shm_start_method', 'num_threads', 'thread_affinity',
+                      'step_timeout', 'straggler_restart_timeout', 'obs_compression']
+
 def register(config_name, func):
     vecenv_config[config_name] = func
 
 def create_vec_env(config_name, num_actors, **kwargs):
-    vec_env_name = configurations[config_name]['vecenv_type']
+    # vecenv_type in env_config overrides the default one of the env, i.e. SHM instead of RAY
+    vec_env_name = kwargs.pop('vecenv_type', configurations[config_name]['vecenv_type'])
     return vecenv_config[vec_env_name](config_name, num_actors, **kwargs)
 
 register('RAY', lambda config_name, num_actors, **kwargs: RayVecEnv(config_name, num_actors, **kwargs))
 
+from rl_games.common.shm_vecenv import SharedMemoryVecEnv
+register('SHM', lambda config_name, num_actors, **kwargs: SharedMemoryVecEnv(config_name, num_actors, **kwargs))
+
+from rl_games.common.threaded_vecenv import ThreadedVecEnv
+register('THREADED', lambda config_name, num_actors, **kwargs: ThreadedVecEnv(config_name, num_actors, **kwargs))
+
 from rl_games.envs.brax import BraxEnv
 register('BRAX', lambda config_name, num_actors, **kwargs: BraxEnv(config_name, num_actors, **kwargs))
 
@@ -230,4 +601,10 @@ from rl_games.envs.envpool import Envpool
 register('ENVPOOL', lambda config_name, num_actors, **kwargs: Envpool(config_name, num_actors, **kwargs))
 
 from rl_games.envs.cule import CuleEnv
-register('CULE', lambda config_name, num_actors, **kwargs: CuleEnv(config_name, num_actors, **kwargs))
\ No newline at end of file
+register('CULE', lambda config_name, num_actors, **kwargs: CuleEnv(config_name, num_actors, **kwargs))
+
+from rl_games.common.dlpack_vecenv import DLPackVecEnv
+register('DLPACK', lambda config_name, num_actors, **kwargs: DLPackVecEnv(config_name, num_actors, **kwargs))
+
+from rl_games.envs.test.vec_envs import create_test_vec_env
+register('TEST_VEC', lambda config_name, num_actors, **kwargs: create_test_vec_env(config_name, num_actors, **kwargs))
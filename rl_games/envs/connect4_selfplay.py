@@ -3,6 +3,7 @@ import numpy as np
 from pettingzoo.classic import connect_four_v0
 import yaml
 from rl_games.torch_runner import Runner
+from rl_games.algos_torch.opponent_inference import RemoteOpponent
 import os
 from collections import deque
 
@@ -29,7 +30,7 @@ class ConnectFourSelfPlay(gym.Env):
     def _get_legal_moves(self, agent_id):
         name = 'player_0' if agent_id == 0 else 'player_1'
         action_ids = self.env.infos[name]['legal_moves']
-        mask = np.zeros(self.action_space.n, dtype=np.bool)
+        mask = np.zeros(self.action_space.n, dtype=np.bool_)
         mask[action_ids] = True
         return mask, action_ids
 
@@ -122,7 +123,11 @@ class ConnectFourSelfPlay(gym.Env):
         self.env.render(mode)
 
     def update_weights(self, weigths):
-        self.agent.set_weights(weigths)
+        if 'opponent_server' in weigths:
+            # central opponent inference, the env only steps the game and doesn't build its own player
+            self.agent = RemoteOpponent(weigths['opponent_server'], weigths['version'])
+        else:
+            self.agent.set_weights(weigths)
 
     def get_action_mask(self):
         mask, _ = self._get_legal_moves(self.agent_id)
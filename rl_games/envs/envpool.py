@@ -1,4 +1,5 @@
 from rl_games.common.ivecenv import IVecEnv
+from rl_games.common.obs_compression import check_obs_compression, compress_obs
 import gym
 import numpy as np
 
@@ -15,11 +16,16 @@ class Envpool(IVecEnv):
     def __init__(self, config_name, num_actors, **kwargs):
         import envpool
 
-        self.batch_size = num_actors
+        # async mode if async_batch_size < num_actors: recv returns the first async_batch_size envs which finished stepping
+        self.batch_size = kwargs.pop('async_batch_size', num_actors)
+        self.is_async = self.batch_size < num_actors
         env_name=kwargs.pop('env_name')
         self.has_lives = kwargs.pop('has_lives', False)
         self.use_dict_obs_space = kwargs.pop('use_dict_obs_space', False)
         self.flatten_obs = kwargs.pop('flatten_obs', False) # for the dm control
+        self.obs_compression = kwargs.pop('obs_compression', None)
+        if self.obs_compression is not None:
+            check_obs_compression(self.obs_compression)
         self.env = envpool.make( env_name,
                                  env_type=kwargs.pop('env_type', 'gym'),
                                  num_envs=num_actors,
@@ -44,37 +50,65 @@ class Envpool(IVecEnv):
         self.action_space = self.env.action_space
         self.scores = np.zeros(num_actors)
         self.returned_scores = np.zeros(num_actors)
+        # actions sent in async mode, for the last_action obs
+        self.last_actions = np.zeros((num_actors,) + self.action_space.shape, dtype=self.action_space.dtype)
 
-    def _set_scores(self, infos, dones):
+    def _set_scores(self, infos, dones, env_ids):
         # thanks to cleanrl: https://github.com/vwxyzjn/cleanrl/blob/3d20d11f45a5f1d764934e9851b816d0b03d2d10/cleanrl/ppo_atari_envpool.py#L111
         if 'reward' not in infos:
             return
-        self.scores += infos["reward"]
-        self.returned_scores[:] = self.scores
-        infos["scores"] = self.returned_scores
+        scores = self.scores[env_ids] + infos["reward"]
+        returned_scores = self.returned_scores[:len(env_ids)]
+        returned_scores[:] = scores
+        infos["scores"] = returned_scores
 
         if self.has_lives:
             all_lives_exhausted = infos["lives"] == 0
-            self.scores *= 1 - all_lives_exhausted
+            self.scores[env_ids] = scores * (1 - all_lives_exhausted)
         else:
             # removing lives otherwise default observer will use them
             if 'lives' in infos:
                 del infos['lives']
-            self.scores *= 1 - dones
+            self.scores[env_ids] = scores * (1 - dones)
 
-    def step(self, action):
-        next_obs, reward, is_done, info = self.env.step(action , self.ids)
+    def _process_results(self, next_obs, reward, is_done, info, action, env_ids):
         info['time_outs'] = info['TimeLimit.truncated']
-        self._set_scores(info, is_done)
+        self._set_scores(info, is_done, env_ids)
         if self.flatten_obs:
             next_obs = flatten_dict(next_obs)
         if self.use_dict_obs_space:
             next_obs = {
                 'observation': next_obs,
-                'reward': np.clip(reward, -1, 1),
-                'last_action': action
+                'reward': np.clip(reward, -1, 1).astype(np.float32, copy=False),
+                'last_action': np.asarray(action, dtype=int)
             }
-        return next_obs, reward, is_done, info
+        return self._compress_obs(next_obs), reward, is_done, info
+
+    def _compress_obs(self, obs):
+        if self.obs_compression is None:
+            return obs
+        return compress_obs(obs, self.obs_compression)
+
+    def step(self, action):
+        next_obs, reward, is_done, info = self.env.step(action , self.ids)
+        return self._process_results(next_obs, reward, is_done, info, action, self.ids)
+
+    def has_partial_batches(self):
+        return self.is_async
+
+    def async_reset(self):
+        self.scores[:] = 0
+        self.last_actions[:] = 0
+        self.env.async_reset()
+
+    def send(self, actions, env_ids):
+        self.last_actions[env_ids] = actions
+        self.env.send(actions, env_ids)
+
+    def recv(self):
+        next_obs, reward, is_done, info = self.env.recv()
+        env_ids = info['env_id']
+        return self._process_results(next_obs, reward, is_done, info, self.last_actions[env_ids], env_ids) + (env_ids,)
 
     def reset(self):
         obs = self.env.reset(self.ids)
@@ -83,11 +117,11 @@ class Envpool(IVecEnv):
         if self.use_dict_obs_space:
             obs = {
                 'observation': obs,
-                'reward': np.zeros(obs.shape[0]),
-                'last_action': np.zeros(obs.shape[0]),
+                'reward': np.zeros(obs.shape[0], dtype=np.float32),
+                'last_action': np.zeros(obs.shape[0], dtype=int),
             }
         
-        return obs
+        return self._compress_obs(obs)
 
     def get_number_of_agents(self):
         return 1
@@ -96,6 +130,8 @@ class Envpool(IVecEnv):
         info = {}
         info['action_space'] = self.action_space
         info['observation_space'] = self.observation_space
+        if self.obs_compression is not None:
+            info['obs_compression'] = self.obs_compression
         return info
 
 
@@ -3,6 +3,7 @@ import numpy as np
 import slimevolleygym
 import yaml
 from rl_games.torch_runner import Runner
+from rl_games.algos_torch.opponent_inference import RemoteOpponent
 import os
 
 class SlimeVolleySelfplay(gym.Env):
@@ -60,4 +61,8 @@ class SlimeVolleySelfplay(gym.Env):
         self.env.render(mode)
 
     def update_weights(self, weigths):
-        self.agent.set_weights(weigths)
+        if 'opponent_server' in weigths:
+            # central opponent inference, the env only steps the game and doesn't build its own player
+            self.agent = RemoteOpponent(weigths['opponent_server'], weigths['version'])
+        else:
+            self.agent.set_weights(weigths)
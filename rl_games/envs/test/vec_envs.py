@@ -0,0 +1,313 @@
+import gym
+import numpy as np
+
+from rl_games.common.ivecenv import IVecEnv
+
+
+class BatchedTestEnv(IVecEnv):
+    '''
+    Base class for the vectorized versions of the test envs.
+    All instances are stepped at once with numpy array ops, there are no ray workers and no python loop over envs.
+    Finished instances are reset in the same step call, like RayWorker does, and obs are returned in the RayVecEnv format.
+    Subclasses keep their state in arrays with num_actors rows and implement _reset, _step, _observe and _state
+    for index, which is a slice or an array of actor ids.
+    '''
+    def __init__(self, num_actors, seed=None, use_central_value=False):
+        self.num_actors = num_actors
+        self.use_central_value = use_central_value
+        self.rng = np.random.default_rng(seed)
+        self.actor_ids = np.arange(num_actors)
+        self.pending_steps = {}
+
+    def _reset(self, index):
+        raise NotImplementedError
+
+    def _step(self, actions, index):
+        '''
+        Returns rewards, dones and dict infos with arrays for the actors in index.
+        '''
+        raise NotImplementedError
+
+    def _observe(self, index):
+        raise NotImplementedError
+
+    def _state(self, index):
+        return self._observe(index)
+
+    def _get_obs(self, index):
+        obs = self._observe(index)
+        if self.use_central_value:
+            return {'obs' : obs, 'states' : self._state(index)}
+        return obs
+
+    def _step_actors(self, actions, index):
+        rewards, dones, infos = self._step(actions, index)
+        done_ids = self.actor_ids[index][dones]
+        if len(done_ids) > 0:
+            self._reset(done_ids)
+        return self._get_obs(index), rewards, dones, infos
+
+    def step(self, actions):
+        return self._step_actors(actions, slice(0, self.num_actors))
+
+    def has_async_step(self):
+        return True
+
+    def step_async(self, actions, actor_slice):
+        # stepping is cheap, the work is done right away and step_wait only returns the result
+        assert actor_slice.start not in self.pending_steps
+        self.pending_steps[actor_slice.start] = self._step_actors(actions, actor_slice)
+
+    def step_wait(self, actor_slice):
+        return self.pending_steps.pop(actor_slice.start)
+
+    def reset(self):
+        self.pending_steps = {}
+        self._reset(slice(0, self.num_actors))
+        return self._get_obs(slice(0, self.num_actors))
+
+    def seed(self, seed):
+        self.rng = np.random.default_rng(seed)
+
+    def get_number_of_agents(self):
+        return 1
+
+    def get_env_info(self):
+        info = {}
+        info['action_space'] = self.action_space
+        info['observation_space'] = self.observation_space
+        info['state_space'] = self.state_space
+        info['use_global_observations'] = self.use_central_value
+        info['agents'] = self.get_number_of_agents()
+        info['value_size'] = self.value_size
+        return info
+
+
+class TestRNNVecEnv(BatchedTestEnv):
+    '''
+    Vectorized TestRNNEnv with the same dynamics, observations and rewards.
+    '''
+    def __init__(self, num_actors, **kwargs):
+        self.max_steps = kwargs.pop('max_steps', 21)
+        self.min_dist = kwargs.pop('min_dist', 2)
+        self.max_dist = kwargs.pop('max_dist', 8)
+        self.hide_object = kwargs.pop('hide_object', False)
+        self.apply_dist_reward = kwargs.pop('apply_dist_reward', False)
+        self.multi_head_value = kwargs.pop('multi_head_value', False)
+        self.multi_discrete_space = kwargs.pop('multi_discrete_space', False)
+        self.multi_obs_space = kwargs.pop('multi_obs_space', False)
+        BatchedTestEnv.__init__(self, num_actors, kwargs.pop('seed', None), kwargs.pop('use_central_value', False))
+
+        self.value_size = 2 if self.multi_head_value else 1
+        if self.multi_discrete_space:
+            self.action_space = gym.spaces.Tuple([gym.spaces.Discrete(2),gym.spaces.Discrete(3)])
+        else:
+            self.action_space = gym.spaces.Discrete(4)
+
+        if self.multi_obs_space:
+            spaces = {
+                'pos': gym.spaces.Box(low=0, high=1, shape=(2, ), dtype=np.float32),
+                'info': gym.spaces.Box(low=0, high=1, shape=(4, ), dtype=np.float32),
+            }
+            self.observation_space = gym.spaces.Dict(spaces)
+        else:
+            self.observation_space = gym.spaces.Box(low=0, high=1, shape=(6, ), dtype=np.float32)
+        self.state_space = self.observation_space
+
+        self.curr_steps = np.zeros(num_actors, dtype=np.int64)
+        self.current_pos = np.zeros((num_actors, 2), dtype=np.int64)
+        self.goal_pos = np.zeros((num_actors, 2), dtype=np.int64)
+        # moves along x and y for every action
+        if self.multi_discrete_space:
+            self.moves = (np.array([1, -1]), np.array([1, -1, 0]))
+        else:
+            self.moves = (np.array([1, -1, 0, 0]), np.array([0, 0, 1, -1]))
+
+    def _reset(self, index):
+        size = len(self.actor_ids[index])
+        self.curr_steps[index] = 0
+        self.current_pos[index] = 0
+        rand_dir = - 2 * self.rng.integers(0, 2, (size, 2)) + 1
+        self.goal_pos[index] = rand_dir * self.rng.integers(self.min_dist, self.max_dist + 1, (size, 2))
+
+    def _step(self, actions, index):
+        actions = np.asarray(actions)
+        self.curr_steps[index] += 1
+        # the first step is a no-op, as in TestRNNEnv
+        can_move = self.curr_steps[index] > 1
+        if self.multi_discrete_space:
+            dx, dy = self.moves[0][actions[:, 0]], self.moves[1][actions[:, 1]]
+        else:
+            dx, dy = self.moves[0][actions], self.moves[1][actions]
+        self.current_pos[index] += np.stack([dx, dy], axis=1) * can_move[:, None]
+
+        dist = self.current_pos[index] - self.goal_pos[index]
+        reached = (dist == 0).all(axis=1)
+        dones = reached | (self.curr_steps[index] == self.max_steps)
+        rewards = np.zeros((len(dones), 2), dtype=np.float32)
+        rewards[:, 0] = reached
+        if self.apply_dist_reward:
+            rewards[:, 1] = -0.1 * np.abs(dist).sum(axis=1) / self.max_dist
+        if not self.multi_head_value:
+            rewards = rewards.sum(axis=1)
+
+        infos = {'scores' : reached.astype(np.float32)}
+        return rewards, dones, infos
+
+    def _build_obs(self, index, show_goal, show_object):
+        obs = np.concatenate([self.current_pos[index], self.goal_pos[index] * show_goal[:, None],
+            show_object[:, None], self.curr_steps[index, None]], axis=1).astype(np.float32)
+        if self.multi_obs_space:
+            return {
+                'pos': obs[:, :2],
+                'info': obs[:, 2:]
+            }
+        return obs
+
+    def _show_object(self, index):
+        # the goal is always visible in the first observation of an episode
+        if self.hide_object:
+            return self.curr_steps[index] == 0
+        return np.ones(len(self.actor_ids[index]), dtype=bool)
+
+    def _observe(self, index):
+        show_object = self._show_object(index)
+        return self._build_obs(index, show_object, show_object)
+
+    def _state(self, index):
+        show_object = self._show_object(index)
+        return self._build_obs(index, np.ones_like(show_object), show_object)
+
+
+class TestAsymmetricVecEnv(BatchedTestEnv):
+    '''
+    Vectorized TestAsymmetricCritic. The wrapped env physics is reimplemented with numpy,
+    CartPole-v1 and Pendulum are supported. Obs have the velocities masked, states are the full obs.
+    '''
+    masks = {
+        'CartPole-v1' : np.array([1., 0., 1., 0.], dtype=np.float32),
+        'Pendulum-v0' : np.array([1., 1., 0.], dtype=np.float32),
+        'Pendulum-v1' : np.array([1., 1., 0.], dtype=np.float32),
+    }
+
+    def __init__(self, num_actors, wrapped_env_name, **kwargs):
+        self.apply_mask = kwargs.pop('apply_mask', True)
+        BatchedTestEnv.__init__(self, num_actors, kwargs.pop('seed', None), kwargs.pop('use_central_value', True))
+        if wrapped_env_name not in self.masks:
+            raise ValueError(f'{wrapped_env_name} has no vectorized version, supported envs: {list(self.masks.keys())}')
+
+        self.wrapped_env_name = wrapped_env_name
+        self.is_cartpole = wrapped_env_name == 'CartPole-v1'
+        self.mask = self.masks[wrapped_env_name] if self.apply_mask else 1
+        self.value_size = 1
+        if self.is_cartpole:
+            self.max_steps = 500
+            high = np.array([2.4 * 2, np.finfo(np.float32).max, 12 * 2 * np.pi / 360 * 2, np.finfo(np.float32).max], dtype=np.float32)
+            self.action_space = gym.spaces.Discrete(2)
+        else:
+            self.max_steps = 200
+            high = np.array([1., 1., 8.], dtype=np.float32)
+            self.action_space = gym.spaces.Box(low=-2.0, high=2.0, shape=(1,), dtype=np.float32)
+        self.observation_space = gym.spaces.Box(-high, high, dtype=np.float32)
+        self.state_space = self.observation_space
+
+        # cartpole: x, x_dot, theta, theta_dot. pendulum: th, thdot
+        self.physics_state = np.zeros((num_actors, 4 if self.is_cartpole else 2), dtype=np.float64)
+        self.curr_steps = np.zeros(num_actors, dtype=np.int64)
+
+    def _reset(self, index):
+        size = len(self.actor_ids[index])
+        self.curr_steps[index] = 0
+        if self.is_cartpole:
+            self.physics_state[index] = self.rng.uniform(-0.05, 0.05, (size, 4))
+        else:
+            self.physics_state[index] = self.rng.uniform([-np.pi, -1.0], [np.pi, 1.0], (size, 2))
+
+    def _step_cartpole(self, actions, index):
+        gravity, masspole, total_mass, length, tau = 9.8, 0.1, 1.1, 0.5, 0.02
+        polemass_length = masspole * length
+        x, x_dot, theta, theta_dot = self.physics_state[index].T
+        force = np.where(np.asarray(actions) == 1, 10.0, -10.0)
+        costheta, sintheta = np.cos(theta), np.sin(theta)
+        temp = (force + polemass_length * theta_dot ** 2 * sintheta) / total_mass
+        thetaacc = (gravity * sintheta - costheta * temp) / (length * (4.0 / 3.0 - masspole * costheta ** 2 / total_mass))
+        xacc = temp - polemass_length * thetaacc * costheta / total_mass
+        new_state = np.stack([x + tau * x_dot, x_dot + tau * xacc, theta + tau * theta_dot, theta_dot + tau * thetaacc], axis=1)
+        self.physics_state[index] = new_state
+
+        terminated = (np.abs(new_state[:, 0]) > 2.4) | (np.abs(new_state[:, 2]) > 12 * 2 * np.pi / 360)
+        rewards = np.ones(len(terminated), dtype=np.float32)
+        return rewards, terminated
+
+    def _step_pendulum(self, actions, index):
+        g, m, l, dt = 10.0, 1.0, 1.0, 0.05
+        th, thdot = self.physics_state[index].T
+        u = np.clip(np.asarray(actions, dtype=np.float64).reshape(-1), -2.0, 2.0)
+        norm_th = ((th + np.pi) % (2 * np.pi)) - np.pi
+        costs = norm_th ** 2 + 0.1 * thdot ** 2 + 0.001 * u ** 2
+        newthdot = np.clip(thdot + (3 * g / (2 * l) * np.sin(th) + 3.0 / (m * l ** 2) * u) * dt, -8.0, 8.0)
+        self.physics_state[index] = np.stack([th + newthdot * dt, newthdot], axis=1)
+        return -costs.astype(np.float32), np.zeros(len(u), dtype=bool)
+
+    def _step(self, actions, index):
+        self.curr_steps[index] += 1
+        if self.is_cartpole:
+            rewards, terminated = self._step_cartpole(actions, index)
+        else:
+            rewards, terminated = self._step_pendulum(actions, index)
+        time_outs = ~terminated & (self.curr_steps[index] >= self.max_steps)
+        dones = terminated | time_outs
+        return rewards, dones, {'time_outs' : time_outs}
+
+    def _state(self, index):
+        if self.is_cartpole:
+            return self.physics_state[index].astype(np.float32)
+        th, thdot = self.physics_state[index].T
+        return np.stack([np.cos(th), np.sin(th), thdot], axis=1).astype(np.float32)
+
+    def _observe(self, index):
+        return self._state(index) * self.mask
+
+
+class ExampleVecEnv(BatchedTestEnv):
+    '''
+    Vectorized ExampleEnv: central value, two value heads and a multi discrete action space.
+    Obs are random, the first head rewards a[0] == (obs[0] > 0.5), the second one a[1] == int(3 * obs[1]).
+    Episodes are episode_length steps long and end with a time out.
+    '''
+    def __init__(self, num_actors, **kwargs):
+        self.episode_length = kwargs.pop('episode_length', 64)
+        BatchedTestEnv.__init__(self, num_actors, kwargs.pop('seed', None), True)
+        self.value_size = 2
+        self.action_space = gym.spaces.Tuple([gym.spaces.Discrete(2),gym.spaces.Discrete(3)])
+        self.observation_space = gym.spaces.Box(low=0, high=1, shape=(6, ), dtype=np.float32)
+        self.state_space = self.observation_space
+        self.obs = np.zeros((num_actors, 6), dtype=np.float32)
+        self.curr_steps = np.zeros(num_actors, dtype=np.int64)
+
+    def _reset(self, index):
+        self.curr_steps[index] = 0
+        self.obs[index] = self.rng.random((len(self.actor_ids[index]), 6), dtype=np.float32)
+
+    def _step(self, actions, index):
+        actions = np.asarray(actions)
+        obs = self.obs[index]
+        rewards = np.stack([actions[:, 0] == (obs[:, 0] > 0.5), actions[:, 1] == (obs[:, 1] * 3).astype(np.int64)], axis=1).astype(np.float32)
+        self.curr_steps[index] += 1
+        dones = self.curr_steps[index] >= self.episode_length
+        self.obs[index] = self.rng.random(obs.shape, dtype=np.float32)
+        return rewards, dones, {'time_outs' : dones}
+
+    def _observe(self, index):
+        return self.obs[index].copy()
+
+
+def create_test_vec_env(config_name, num_actors, **kwargs):
+    name = kwargs.pop('name')
+    if name == 'TestRnnEnv-v0':
+        return TestRNNVecEnv(num_actors, **kwargs)
+    if name == 'TestAsymmetricEnv-v0':
+        return TestAsymmetricVecEnv(num_actors, **kwargs)
+    if name == 'ExampleEnv-v0':
+        return ExampleVecEnv(num_actors, **kwargs)
+    raise ValueError(f'{name} has no vectorized version')
@@ -0,0 +1,78 @@
+import pytest
+import torch
+
+from rl_games.common import advantages
+
+
+GAMMA = 0.99
+TAU = 0.95
+
+
+def make_rollout(horizon_length, batch_size, value_size, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    fdones = (torch.rand(batch_size, generator=generator) < 0.2).float()
+    last_values = torch.randn(batch_size, value_size, generator=generator)
+    mb_fdones = (torch.rand(horizon_length, batch_size, generator=generator) < 0.2).float()
+    mb_values = torch.randn(horizon_length, batch_size, value_size, generator=generator)
+    mb_rewards = torch.randn(horizon_length, batch_size, value_size, generator=generator)
+    mb_masks = (torch.rand(horizon_length, batch_size, generator=generator) < 0.8).float()
+    return fdones, last_values, mb_fdones, mb_values, mb_rewards, mb_masks
+
+
+def create_estimators(chunk_size=4):
+    return [
+        advantages.create_advantage_estimator('loop', GAMMA, TAU),
+        advantages.create_advantage_estimator('scripted', GAMMA, TAU),
+        advantages.create_advantage_estimator('chunked', GAMMA, TAU, chunk_size=chunk_size),
+    ]
+
+
+@pytest.mark.parametrize('horizon_length', [1, 8, 13])
+@pytest.mark.parametrize('value_size', [1, 3])
+def test_estimators_match_loop(horizon_length, value_size):
+    fdones, last_values, mb_fdones, mb_values, mb_rewards, _ = make_rollout(horizon_length, 5, value_size)
+    expected = advantages.gae_loop(fdones, last_values, mb_fdones, mb_values, mb_rewards, None, GAMMA, TAU)
+    for estimator in create_estimators():
+        mb_advs = estimator.discount_values(fdones, last_values, mb_fdones, mb_values, mb_rewards)
+        torch.testing.assert_close(mb_advs, expected)
+
+
+@pytest.mark.parametrize('horizon_length', [8, 13])
+@pytest.mark.parametrize('value_size', [1, 3])
+def test_estimators_match_loop_masks(horizon_length, value_size):
+    fdones, last_values, mb_fdones, mb_values, mb_rewards, mb_masks = make_rollout(horizon_length, 5, value_size)
+    expected = advantages.gae_loop(fdones, last_values, mb_fdones, mb_values, mb_rewards, mb_masks, GAMMA, TAU)
+    for estimator in create_estimators():
+        mb_advs = estimator.discount_values_masks(fdones, last_values, mb_fdones, mb_values, mb_rewards, mb_masks)
+        torch.testing.assert_close(mb_advs, expected)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 5, 16, 64])
+def test_chunked_horizon_not_divisible(chunk_size):
+    fdones, last_values, mb_fdones, mb_values, mb_rewards, mb_masks = make_rollout(37, 4, 2)
+    estimator = advantages.create_advantage_estimator('chunked', GAMMA, TAU, chunk_size=chunk_size)
+    expected = advantages.gae_loop(fdones, last_values, mb_fdones, mb_values, mb_rewards, None, GAMMA, TAU)
+    torch.testing.assert_close(estimator.discount_values(fdones, last_values, mb_fdones, mb_values, mb_rewards), expected)
+    expected = advantages.gae_loop(fdones, last_values, mb_fdones, mb_values, mb_rewards, mb_masks, GAMMA, TAU)
+    torch.testing.assert_close(estimator.discount_values_masks(fdones, last_values, mb_fdones, mb_values, mb_rewards, mb_masks), expected)
+
+
+def test_unknown_engine():
+    with pytest.raises(ValueError):
+        advantages.create_advantage_estimator('unknown', GAMMA, TAU)
+
+
+@pytest.mark.parametrize('value_size', [1, 3])
+def test_vtrace_on_policy_is_gae(value_size):
+    horizon_length, batch_size = 13, 5
+    fdones, last_values, mb_fdones, mb_values, mb_rewards, _ = make_rollout(horizon_length, batch_size, value_size)
+    log_rhos = torch.zeros(horizon_length, batch_size)
+    vs, pg_advantages = advantages.vtrace(log_rhos, fdones, last_values, mb_fdones, mb_values, mb_rewards, GAMMA, TAU)
+    mb_advs = advantages.gae_loop(fdones, last_values, mb_fdones, mb_values, mb_rewards, None, GAMMA, TAU)
+    torch.testing.assert_close(vs, mb_advs + mb_values)
+
+    # the policy gradient advantage bootstraps from the next v-trace target
+    nextnonterminal = 1.0 - torch.cat([mb_fdones[1:], fdones.unsqueeze(0)], dim=0)
+    next_vs = torch.cat([vs[1:], last_values.unsqueeze(0)], dim=0)
+    expected = mb_rewards + GAMMA * next_vs * nextnonterminal.unsqueeze(2) - mb_values
+    torch.testing.assert_close(pg_advantages, expected)
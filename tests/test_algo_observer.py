@@ -0,0 +1,39 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import torch
+
+from rl_games.common.algo_observer import DefaultAlgoObserver
+
+
+def create_observer(num_agents=1):
+    observer = DefaultAlgoObserver()
+    observer.after_init(SimpleNamespace(games_to_track=100, ppo_device='cpu', writer=None, num_agents=num_agents))
+    return observer
+
+
+@pytest.mark.parametrize('infos, needs_done_indices', [
+    ([], False),
+    ({}, False),
+    ([{}, {}], False),
+    ([{'time_outs' : False}, {'time_outs' : True}], False),
+    ([{'scores' : 1.0}, {'scores' : 0.0}], True),
+    # results only in the infos of finished games
+    ([{}, {}, {'battle_won' : 1.0}], True),
+    ([{}, {'scores' : 2.0}], True),
+    ({'scores' : np.zeros(2)}, True),
+    ({'scores' : np.zeros(2), 'lives' : np.ones(2)}, False),
+])
+def test_needs_done_indices(infos, needs_done_indices):
+    assert create_observer().needs_done_indices(infos) == needs_done_indices
+
+
+def test_scores_of_finished_games():
+    observer = create_observer()
+    infos = [{}, {'scores' : 3.0}, {}, {'scores' : 5.0}]
+    assert observer.needs_done_indices(infos)
+    dones = torch.tensor([False, True, False, True])
+    observer.process_infos(infos, dones.nonzero(as_tuple=False))
+    assert observer.game_scores.current_size == 2
+    assert observer.game_scores.get_mean() == pytest.approx(4.0)
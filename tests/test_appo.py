@@ -0,0 +1,75 @@
+import numpy as np
+
+from rl_games.common import env_configurations
+from rl_games.common import vecenv
+from rl_games.common.tr_helpers import BatchAssembler
+from rl_games.envs.test import vec_envs
+
+
+class ConcatInfosVecEnv(vec_envs.TestAsymmetricVecEnv):
+    '''
+    CartPole which reports the length of every game as its score. Infos of the envs are concatenated into reused
+    buffers, as RayVecEnv does for envs with concat_infos.
+    '''
+    def __init__(self, num_actors, **kwargs):
+        vec_envs.TestAsymmetricVecEnv.__init__(self, num_actors, 'CartPole-v1', use_central_value=False, seed=0)
+        self.assembler = BatchAssembler()
+
+    def _step(self, actions, index):
+        rewards, dones, _ = vec_envs.TestAsymmetricVecEnv._step(self, actions, index)
+        infos = self.assembler.assemble_infos([{'scores' : float(steps)} for steps in self.curr_steps[index]])
+        return rewards, dones, infos
+
+
+def test_appo_game_scores(tmp_path):
+    from rl_games.torch_runner import Runner
+
+    vecenv.register('APPO_CONCAT_INFOS_TEST', lambda config_name, num_actors, **kwargs: ConcatInfosVecEnv(num_actors, **kwargs))
+    env_configurations.register('appo_concat_infos_test', {'vecenv_type' : 'APPO_CONCAT_INFOS_TEST'})
+    config = {
+        'seed' : 7,
+        'algo' : {'name' : 'appo_discrete'},
+        'model' : {'name' : 'discrete_a2c'},
+        'network' : {
+            'name' : 'actor_critic',
+            'separate' : False,
+            'space' : {'discrete' : None},
+            'mlp' : {'units' : [16], 'activation' : 'relu', 'initializer' : {'name' : 'default'}},
+        },
+        'config' : {
+            'name' : 'appo_test',
+            'env_name' : 'appo_concat_infos_test',
+            'train_dir' : str(tmp_path),
+            'device' : 'cpu',
+            'reward_shaper' : {},
+            'normalize_advantage' : True,
+            'gamma' : 0.99,
+            'tau' : 0.95,
+            'learning_rate' : 3e-4,
+            'grad_norm' : 1.0,
+            'entropy_coef' : 0.0,
+            'truncate_grads' : True,
+            'e_clip' : 0.2,
+            'clip_value' : True,
+            'num_actors' : 8,
+            'horizon_length' : 16,
+            'minibatch_size' : 64,
+            'mini_epochs' : 1,
+            'critic_coef' : 1,
+            'lr_schedule' : None,
+            'normalize_input' : False,
+            'games_to_track' : 1000,
+            'max_epochs' : 4,
+        },
+    }
+    runner = Runner()
+    runner.load({'params' : config})
+    runner.run({'train' : True, 'play' : False, 'checkpoint' : None, 'sigma' : None})
+
+    agent = runner.algo_observer.algo
+    game_scores = runner.algo_observer.game_scores
+    assert game_scores.current_size > 0
+    # the learner writes the stats of a rollout after the rollout thread has stepped the env further,
+    # scores have to be the ones of the steps in which the games finished
+    assert game_scores.current_size == agent.game_lengths.current_size
+    np.testing.assert_allclose(game_scores.get_mean(), agent.game_lengths.get_mean(), rtol=1e-5)
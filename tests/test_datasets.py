@@ -0,0 +1,132 @@
+import pytest
+import torch
+
+from rl_games.common import datasets
+
+
+BATCH_SIZE = 64
+MINIBATCH_SIZE = 16
+SEQ_LEN = 4
+
+
+def create_dataset(is_rnn=False, shuffle=True):
+    dataset = datasets.PPODataset(BATCH_SIZE, MINIBATCH_SIZE, False, is_rnn, 'cpu', SEQ_LEN, shuffle=shuffle)
+    # every value holds the id of its transition, rnn states the id of their game
+    ids = torch.arange(BATCH_SIZE)
+    values_dict = {
+        'obs' : ids.float().unsqueeze(1).repeat(1, 3),
+        'actions' : ids.clone(),
+        'returns' : ids.float().unsqueeze(1),
+        'mu' : torch.zeros(BATCH_SIZE, 2),
+        'sigma' : torch.zeros(BATCH_SIZE, 2),
+        'rnn_masks' : None,
+    }
+    if is_rnn:
+        games = torch.arange(BATCH_SIZE // SEQ_LEN).float()
+        values_dict['rnn_states'] = [games.view(1, -1, 1).repeat(2, 1, 5)]
+    dataset.update_values_dict(values_dict)
+    return dataset
+
+
+def minibatch_ids(input_dict):
+    return input_dict['actions'].tolist()
+
+
+@pytest.mark.parametrize('shuffle', [False, True])
+def test_minibatches_cover_batch(shuffle):
+    dataset = create_dataset(shuffle=shuffle)
+    epochs = []
+    for _ in range(3):
+        dataset.new_mini_epoch()
+        ids = []
+        for idx in range(len(dataset)):
+            input_dict = dataset[idx]
+            assert len(input_dict['actions']) == MINIBATCH_SIZE
+            assert (input_dict['obs'][:, 0] == input_dict['actions'].float()).all()
+            assert (input_dict['returns'][:, 0] == input_dict['actions'].float()).all()
+            ids += minibatch_ids(input_dict)
+        assert sorted(ids) == list(range(BATCH_SIZE))
+        epochs.append(ids)
+    if shuffle:
+        assert epochs[0] != epochs[1] or epochs[1] != epochs[2]
+    else:
+        assert epochs[0] == epochs[1] == epochs[2] == list(range(BATCH_SIZE))
+
+
+@pytest.mark.parametrize('shuffle', [False, True])
+def test_rnn_games_stay_contiguous(shuffle):
+    dataset = create_dataset(is_rnn=True, shuffle=shuffle)
+    dataset.new_mini_epoch()
+    ids = []
+    for idx in range(len(dataset)):
+        input_dict = dataset[idx]
+        games = input_dict['actions'].view(-1, SEQ_LEN)
+        # whole games in order of their steps
+        assert (games[:, 0] % SEQ_LEN == 0).all()
+        assert (games - games[:, :1] == torch.arange(SEQ_LEN)).all()
+        # rnn states are the ones of the games of the minibatch
+        rnn_states = input_dict['rnn_states'][0]
+        assert rnn_states.shape == (2, MINIBATCH_SIZE // SEQ_LEN, 5)
+        assert (rnn_states == (games[:, 0] // SEQ_LEN).float().view(1, -1, 1)).all()
+        assert input_dict['rnn_masks'] is None
+        ids += minibatch_ids(input_dict)
+    assert sorted(ids) == list(range(BATCH_SIZE))
+
+
+def test_update_mu_sigma_shuffled():
+    dataset = create_dataset()
+    dataset.new_mini_epoch()
+    for idx in range(len(dataset)):
+        input_dict = dataset[idx]
+        ids = input_dict['actions'].float().unsqueeze(1).repeat(1, 2)
+        dataset.update_mu_sigma(ids, -ids)
+    expected = torch.arange(BATCH_SIZE).float().unsqueeze(1).repeat(1, 2)
+    assert (dataset.values_dict['mu'] == expected).all()
+    assert (dataset.values_dict['sigma'] == -expected).all()
+
+
+@pytest.mark.parametrize('is_rnn', [False, True])
+@pytest.mark.parametrize('shuffle', [False, True])
+def test_prefetcher_matches_iterator(is_rnn, shuffle):
+    def preproc_obs(obs):
+        return obs * 2
+
+    dataset = create_dataset(is_rnn, shuffle)
+    prefetched_dataset = create_dataset(is_rnn, shuffle)
+    iterator = datasets.MinibatchIterator(dataset)
+    prefetcher = datasets.MinibatchPrefetcher(prefetched_dataset, preproc_obs, 'cpu')
+    assert len(prefetcher) == len(iterator)
+
+    for epoch in range(2):
+        torch.manual_seed(epoch)
+        dataset.new_mini_epoch()
+        torch.manual_seed(epoch)
+        prefetched_dataset.new_mini_epoch()
+        num_minibatches = 0
+        for input_dict, prefetched_dict in zip(iterator, prefetcher):
+            for key in ['obs', 'actions', 'returns']:
+                assert torch.equal(input_dict[key], prefetched_dict[key])
+            assert torch.equal(prefetched_dict['processed_obs'], preproc_obs(input_dict['obs']))
+            if is_rnn:
+                assert torch.equal(input_dict['rnn_states'][0], prefetched_dict['rnn_states'][0])
+            # mu and sigma are written to the rows of the trained minibatch, not of the prefetched one
+            ids = input_dict['actions'].float().unsqueeze(1).repeat(1, 2) + epoch
+            iterator.update_mu_sigma(ids, -ids)
+            prefetcher.update_mu_sigma(ids, -ids)
+            num_minibatches += 1
+        assert num_minibatches == len(dataset)
+        assert torch.equal(dataset.values_dict['mu'], prefetched_dataset.values_dict['mu'])
+        assert torch.equal(dataset.values_dict['sigma'], prefetched_dataset.values_dict['sigma'])
+
+
+def test_prefetcher_stops_early():
+    dataset = create_dataset()
+    prefetcher = datasets.MinibatchPrefetcher(dataset, lambda obs: obs, 'cpu')
+    dataset.new_mini_epoch()
+    for idx, input_dict in enumerate(prefetcher):
+        if idx == 1:
+            break
+    # the next mini-epoch starts with the minibatch of its own permutation
+    dataset.new_mini_epoch()
+    first = next(iter(prefetcher))
+    assert torch.equal(first['actions'], dataset.sampler.get_items(0))
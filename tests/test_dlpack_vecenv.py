@@ -0,0 +1,192 @@
+import numpy as np
+import pytest
+import torch
+
+from rl_games.common import env_configurations
+from rl_games.common.dlpack_vecenv import DLPackVecEnv
+from rl_games.envs.test import vec_envs
+
+
+class RecordingSimulator:
+    '''
+    Passes step and reset to env and keeps the arrays exchanged with the adapter.
+    '''
+    def __init__(self, env):
+        self.env = env
+        self.actions = []
+        self.results = []
+
+    def step(self, actions):
+        self.actions.append(actions)
+        self.results.append(self.env.step(actions))
+        return self.results[-1]
+
+    def reset(self):
+        self.results.append(self.env.reset())
+        return self.results[-1]
+
+    def get_env_info(self):
+        return self.env.get_env_info()
+
+
+class TorchCartPole:
+    '''
+    Batched simulator which works on torch tensors, obs are float16 to check that dtypes are kept.
+    '''
+    def __init__(self, num_actors):
+        self.env = vec_envs.TestAsymmetricVecEnv(num_actors, 'CartPole-v1', use_central_value=False, seed=0)
+
+    def step(self, actions):
+        assert isinstance(actions, torch.Tensor)
+        obs, rewards, dones, infos = self.env.step(actions.numpy())
+        infos = {k : torch.from_numpy(v) for k, v in infos.items()}
+        return torch.from_numpy(obs).half(), torch.from_numpy(rewards), torch.from_numpy(dones), infos
+
+    def reset(self):
+        return torch.from_numpy(self.env.reset()).half()
+
+    def get_env_info(self):
+        return self.env.get_env_info()
+
+
+def create_vec_env(name, env_creator, num_actors=4):
+    env_configurations.register(name, {'env_creator' : env_creator, 'vecenv_type' : 'DLPACK'})
+    return DLPackVecEnv(name, num_actors)
+
+
+def shares_memory(tensor, array):
+    return tensor.data_ptr() == array.__array_interface__['data'][0]
+
+
+def test_numpy_simulator():
+    simulator = None
+    def create_simulator(num_actors):
+        nonlocal simulator
+        simulator = RecordingSimulator(vec_envs.TestAsymmetricVecEnv(num_actors, 'CartPole-v1', seed=0))
+        return simulator
+
+    vec_env = create_vec_env('dlpack_numpy_test', create_simulator)
+    obs = vec_env.reset()
+    sim_obs = simulator.results[-1]
+    assert vec_env.framework == 'numpy'
+    for key in ['obs', 'states']:
+        assert isinstance(obs[key], torch.Tensor)
+        assert obs[key].dtype == torch.float32
+        assert shares_memory(obs[key], sim_obs[key])
+
+    obs, rewards, dones, infos = vec_env.step(torch.ones(4, dtype=torch.int64))
+    sim_obs, sim_rewards, sim_dones, sim_infos = simulator.results[-1]
+    assert isinstance(simulator.actions[-1], np.ndarray)
+    assert simulator.actions[-1].dtype == np.int64
+    assert shares_memory(obs['obs'], sim_obs['obs'])
+    assert shares_memory(rewards, sim_rewards)
+    assert rewards.dtype == torch.float32
+    assert dones.dtype == torch.bool
+    assert isinstance(infos['time_outs'], torch.Tensor)
+    assert shares_memory(infos['time_outs'], sim_infos['time_outs'])
+
+
+def test_torch_simulator():
+    simulator = None
+    def create_simulator(num_actors):
+        nonlocal simulator
+        simulator = RecordingSimulator(TorchCartPole(num_actors))
+        return simulator
+
+    vec_env = create_vec_env('dlpack_torch_test', create_simulator)
+    obs = vec_env.reset()
+    assert vec_env.framework == 'torch'
+    assert obs is simulator.results[-1]
+    assert obs.dtype == torch.float16
+
+    actions = torch.zeros(4, dtype=torch.int64)
+    obs, rewards, dones, infos = vec_env.step(actions)
+    assert simulator.actions[-1] is actions
+    assert obs is simulator.results[-1][0]
+    assert obs.dtype == torch.float16
+
+
+def test_jax_simulator():
+    jnp = pytest.importorskip('jax.numpy')
+
+    class JaxSimulator:
+        def __init__(self, num_actors):
+            self.num_actors = num_actors
+            self.actions = None
+
+        def step(self, actions):
+            self.actions = actions
+            return jnp.ones((self.num_actors, 3), dtype=jnp.float16), jnp.ones(self.num_actors), jnp.zeros(self.num_actors, dtype=bool), {}
+
+        def reset(self):
+            return jnp.zeros((self.num_actors, 3), dtype=jnp.float16)
+
+    simulator = None
+    def create_simulator(num_actors):
+        nonlocal simulator
+        simulator = JaxSimulator(num_actors)
+        return simulator
+
+    vec_env = create_vec_env('dlpack_jax_test', create_simulator)
+    obs = vec_env.reset()
+    assert vec_env.framework == 'jax'
+    assert obs.dtype == torch.float16
+    obs, rewards, dones, infos = vec_env.step(torch.zeros(4, dtype=torch.int64))
+    assert type(simulator.actions).__module__.split('.')[0] in ['jax', 'jaxlib']
+    assert obs.dtype == torch.float16
+    assert dones.dtype == torch.bool
+
+
+def test_tensor_obses_training(tmp_path):
+    from rl_games.torch_runner import Runner
+
+    simulator = None
+    def create_simulator(num_actors):
+        nonlocal simulator
+        simulator = RecordingSimulator(vec_envs.TestAsymmetricVecEnv(num_actors, 'CartPole-v1', use_central_value=False, seed=0))
+        return simulator
+
+    env_configurations.register('dlpack_train_test', {'env_creator' : create_simulator, 'vecenv_type' : 'DLPACK'})
+    config = {
+        'seed' : 7,
+        'algo' : {'name' : 'a2c_discrete'},
+        'model' : {'name' : 'discrete_a2c'},
+        'network' : {
+            'name' : 'actor_critic',
+            'separate' : False,
+            'space' : {'discrete' : None},
+            'mlp' : {'units' : [16], 'activation' : 'relu', 'initializer' : {'name' : 'default'}},
+        },
+        'config' : {
+            'name' : 'dlpack_test',
+            'env_name' : 'dlpack_train_test',
+            'train_dir' : str(tmp_path),
+            'device' : 'cpu',
+            'reward_shaper' : {},
+            'normalize_advantage' : True,
+            'gamma' : 0.99,
+            'tau' : 0.95,
+            'learning_rate' : 3e-4,
+            'grad_norm' : 1.0,
+            'entropy_coef' : 0.0,
+            'truncate_grads' : True,
+            'e_clip' : 0.2,
+            'clip_value' : True,
+            'num_actors' : 4,
+            'horizon_length' : 8,
+            'minibatch_size' : 16,
+            'mini_epochs' : 1,
+            'critic_coef' : 1,
+            'lr_schedule' : None,
+            'normalize_input' : False,
+            'max_epochs' : 1,
+        },
+    }
+    runner = Runner()
+    runner.load({'params' : config})
+    runner.run({'train' : True, 'play' : False, 'checkpoint' : None, 'sigma' : None})
+
+    agent = runner.algo_observer.algo
+    assert agent.is_tensor_obses
+    # actions go back to the simulator as numpy arrays
+    assert all(isinstance(actions, np.ndarray) for actions in simulator.actions)
@@ -0,0 +1,85 @@
+import copy
+import os
+
+import pytest
+import torch
+import yaml
+
+from rl_games.torch_runner import Runner
+
+
+CONFIG_DIR = os.path.join(os.path.dirname(__file__), '..', 'rl_games', 'configs', 'test')
+
+
+def create_agent(config_name, train_dir, is_rnn):
+    with open(os.path.join(CONFIG_DIR, config_name)) as f:
+        config = yaml.safe_load(f)
+    config['params']['seed'] = 3
+    if not is_rnn:
+        config['params']['network'].pop('rnn')
+    agent_config = config['params']['config']
+    agent_config.update({
+        'device' : 'cpu',
+        'train_dir' : str(train_dir),
+        'num_actors' : 8,
+        'horizon_length' : 16,
+        'minibatch_size' : 64,
+        'seq_length' : 4,
+        'max_epochs' : 1,
+    })
+    agent_config.pop('central_value_config', None)
+    agent_config['env_config']['use_central_value'] = False
+    runner = Runner()
+    runner.load(config)
+    return runner.algo_factory.create(runner.algo_name, base_name='run', params=runner.params)
+
+
+def play_minibatch(agent):
+    agent.init_tensors()
+    agent.set_eval()
+    agent.obs = agent.env_reset()
+    with torch.no_grad():
+        batch_dict = agent.play_steps_rnn() if agent.is_rnn else agent.play_steps()
+    agent.set_train()
+    agent.prepare_dataset(batch_dict)
+    return agent.dataset[0]
+
+
+def calc_gradients(agent, weights, input_dict, micro_batch_size):
+    agent.model.load_state_dict(weights)
+    agent.micro_batch_size = micro_batch_size
+    # the step doesn't change the weights, gradients are left in the parameters
+    agent.optimizer = torch.optim.SGD(agent.model.parameters(), lr=0.0)
+    result = agent.train_actor_critic(copy.copy(input_dict))
+    grads = torch.cat([p.grad.flatten() for p in agent.model.parameters() if p.grad is not None])
+    return grads, result, copy.deepcopy(agent.model.state_dict())
+
+
+@pytest.mark.parametrize('config_name, is_rnn, use_masks', [
+    ('test_asymmetric_discrete_vec.yaml', False, False),
+    ('test_asymmetric_discrete_vec.yaml', False, True),
+    ('test_rnn_vec.yaml', True, False),
+    ('test_rnn_vec.yaml', True, True),
+])
+def test_micro_batch_gradients(tmp_path, config_name, is_rnn, use_masks):
+    torch.manual_seed(0)
+    agent = create_agent(config_name, tmp_path, is_rnn)
+    input_dict = play_minibatch(agent)
+    if use_masks:
+        # masked transitions are spread unevenly over the micro batches
+        input_dict['rnn_masks'] = (torch.rand(input_dict['returns'].size(0)) < 0.7).float()
+    weights = copy.deepcopy(agent.model.state_dict())
+
+    grads, result, state = calc_gradients(agent, weights, input_dict, None)
+    # micro batches of whole sequences, the last one is shorter
+    micro_grads, micro_result, micro_state = calc_gradients(agent, weights, input_dict, 24)
+
+    assert grads.abs().max() > 0
+    torch.testing.assert_close(micro_grads, grads, rtol=1e-4, atol=1e-6)
+    # losses, kl, mu and sigma
+    for value, micro_value in zip(result, micro_result):
+        if isinstance(value, torch.Tensor):
+            torch.testing.assert_close(micro_value, value, rtol=1e-4, atol=1e-6)
+    # running mean std is updated with the whole minibatch once
+    for key in state:
+        torch.testing.assert_close(micro_state[key], state[key])
@@ -0,0 +1,70 @@
+import json
+import os
+
+from rl_games.common.profiler import TimelineProfiler
+
+
+def test_trace_events(tmp_path):
+    trace_path = str(tmp_path / 'trace.json')
+    profiler = TimelineProfiler(trace_path=trace_path)
+    with profiler.scope('play'):
+        with profiler.scope('env_step'):
+            pass
+    profiler.send_info(None, 0)
+    profiler.close()
+    assert profiler.trace_file is None
+
+    with open(trace_path) as f:
+        # the closing bracket of the json array is optional in the trace format
+        events = json.loads(f.read().rstrip().rstrip(',') + ']')
+    assert sorted(event['name'] for event in events) == ['env_step', 'play']
+
+
+def test_trace_closed_after_training(tmp_path):
+    from rl_games.torch_runner import Runner
+
+    config = {
+        'seed' : 7,
+        'algo' : {'name' : 'a2c_discrete'},
+        'model' : {'name' : 'discrete_a2c'},
+        'network' : {
+            'name' : 'actor_critic',
+            'separate' : False,
+            'space' : {'discrete' : None},
+            'mlp' : {'units' : [16], 'activation' : 'relu', 'initializer' : {'name' : 'default'}},
+        },
+        'config' : {
+            'name' : 'profiler_test',
+            'env_name' : 'test_vec_env',
+            'env_config' : {'name' : 'TestAsymmetricEnv-v0', 'wrapped_env_name' : 'CartPole-v1', 'use_central_value' : False, 'seed' : 0},
+            'train_dir' : str(tmp_path),
+            'device' : 'cpu',
+            'reward_shaper' : {},
+            'normalize_advantage' : True,
+            'gamma' : 0.99,
+            'tau' : 0.95,
+            'learning_rate' : 3e-4,
+            'grad_norm' : 1.0,
+            'entropy_coef' : 0.0,
+            'truncate_grads' : True,
+            'e_clip' : 0.2,
+            'clip_value' : True,
+            'num_actors' : 4,
+            'horizon_length' : 8,
+            'minibatch_size' : 16,
+            'mini_epochs' : 1,
+            'critic_coef' : 1,
+            'lr_schedule' : None,
+            'normalize_input' : False,
+            'use_profiler' : True,
+            'profiler_trace' : True,
+            'max_epochs' : 2,
+        },
+    }
+    runner = Runner()
+    runner.load({'params' : config})
+    runner.run({'train' : True, 'play' : False, 'checkpoint' : None, 'sigma' : None})
+
+    agent = runner.algo_observer.algo
+    assert agent.profiler.trace_file is None
+    assert os.path.getsize(agent.profiler.trace_path) > 0
@@ -0,0 +1,45 @@
+import numpy as np
+
+from rl_games.common.tr_helpers import BatchAssembler, dicts_to_dict_with_arrays
+
+
+def test_assemble_matches_stack():
+    assembler = BatchAssembler()
+    for step in range(3):
+        values = [np.full((2, 3), step + i, dtype=np.float32) for i in range(4)]
+        np.testing.assert_array_equal(assembler.assemble('obs', values), np.stack(values))
+        np.testing.assert_array_equal(assembler.assemble('agents', values, False), np.concatenate(values))
+
+
+def test_assemble_dtype_drift():
+    assembler = BatchAssembler()
+    rewards = assembler.assemble('rewards', [0, 0])
+    assert rewards.dtype.kind == 'i'
+    rewards = assembler.assemble('rewards', [0.5, 1])
+    np.testing.assert_array_equal(rewards, np.stack([0.5, 1]))
+    assert rewards.dtype == np.float64
+    # narrower values are written into the reallocated field
+    np.testing.assert_array_equal(assembler.assemble('rewards', [1, 2]), np.array([1.0, 2.0]))
+
+
+def test_assemble_shape_drift():
+    assembler = BatchAssembler()
+    assembler.assemble('obs', [np.zeros(3), np.zeros(3)])
+    obs = assembler.assemble('obs', [np.ones(4), np.ones(4)])
+    np.testing.assert_array_equal(obs, np.ones((2, 4)))
+
+
+def test_assemble_double_buffered():
+    assembler = BatchAssembler(num_buffers=2)
+    first = assembler.assemble('dones', [True, False])
+    second = assembler.assemble('dones', [False, False])
+    np.testing.assert_array_equal(first, [True, False])
+    np.testing.assert_array_equal(second, [False, False])
+
+
+def test_assemble_infos():
+    assembler = BatchAssembler()
+    infos = [{'scores' : np.array([1.0])}, {'scores' : np.array([2.0])}]
+    np.testing.assert_array_equal(assembler.assemble_infos(infos)['scores'], dicts_to_dict_with_arrays(infos, False)['scores'])
+    infos = [{'scores' : np.array([1.0])}, {'other' : 1}]
+    assert assembler.assemble_infos(infos).keys() == dicts_to_dict_with_arrays(infos, False).keys()